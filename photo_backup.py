@@ -10,206 +10,374 @@
  * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
 """
 
-import os
-import re
-import sys
-import shutil
-import hashlib
-from PIL import Image
-from PIL.ExifTags import TAGS
-
-
-# 定义支持的图片文件类型
-SUPPORTED_IMAGE_TYPES = ('.jpg', '.jpeg', '.png', 'JPG')
-# 定义需要从Exif数据中提取的标签名称
-DATE_TIME_ORIGINAL_TAG = 'DateTimeOriginal'
-MAKE_TAG = 'Make'
-
-
-def validate_folder_path(folder_path):
-    """
-    check if the folder path is valid
-    """
-    if not os.path.isdir(folder_path):
-        raise ValueError(f"{folder_path} is not a valid directory.")
-
-
-def generate_unique_filename(destination_path, base_name):
-    """generate a unique filename"""
-    unique_name = f"{base_name}"
-    unique_path = os.path.join(destination_path, unique_name)
-    if os.path.exists(unique_path):
-        counter = 1
-        while True:
-            unique_name = f"{base_name.split('.')[-2]}({counter}).{base_name.split('.')[-1]}"
-            unique_path = os.path.join(destination_path, unique_name)
-            if not os.path.exists(unique_path):
-                return unique_name
-            counter += 1
-    else:
-        return unique_name
-
-
-def get_md5(file_path):
-    """计算文件的MD5哈希值"""
-    with open(file_path, 'rb') as file:
-        md5_hash = hashlib.md5()
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-    return md5_hash.hexdigest()
-
-
-def extract_dateComponents(match):
-    """
-    Extracts the year, month, and day from a regex match.
-    """
-    year = "20" + match.group(1)
-    month = match.group(2)
-    day = match.group(3)
-    return f"{year}-{month}-{day}", year, month, day
-
-
-def get_photo_date_from_filename(filename):
-    """
-    Extracts the date from the file name.
-    """
-    # match date format like 20221111
-    pattern1 = r"20(\d{2})(0[1-9]|1[0-2])(0[1-9]|[12][0-9]|3[01])"
-    # match date format like 2022-11-11
-    pattern2 = r"20(\d{2})-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])"
-    match1 = re.search(pattern1, filename)
-    match2 = re.search(pattern2, filename)
-
-    if match1:
-        # 成功匹配时，调用extract_dateComponents处理匹配结果
-        date_str, year, month, day = extract_dateComponents(match1)
-        # 可以在这里进一步处理或验证日期，例如检查月份和日期的合法性
-        return date_str
-    elif match2:
-        date_str, year, month, day = extract_dateComponents(match2)
-        # 可以在这里进一步处理或验证日期，例如检查月份和日期的合法性
-        return date_str
-
-    else:
-        # 未匹配时，返回None或其他自定义消息
-        return None
-
-
-def get_photo_date(file_path):
-    """ Read photo exif date and return photo date, formatted as YYYY-MM-DD
-
-    Args:
-        file_path (str): file path
+import argparse
+import cProfile
+
+import photo_backup_events
+import photo_backup_hash
+import photo_backup_memory
+import photo_backup_profile
+import photo_backup_transfer
+import photo_backup_utils
+from photo_backup_utils import (SUPPORTED_IMAGE_TYPES, validate_folder_path,
+                                copy_photos_by_date)
+from photo_backup_catalog import Catalog
+from photo_backup_dedupe import DestinationIndex, dedupe_existing
+from photo_backup_jobs import load_jobs, run_jobs
+from photo_backup_journal import Journal
+from photo_backup_manifest import AUDIT_CYCLE, Manifest, audit
+from photo_backup_metadata import MetadataCache
+from photo_backup_plan import plan_copy, execute_plan
+from photo_backup_similar import (DEFAULT_HASH, DEFAULT_THRESHOLD, HASH_NAMES,
+                                  SimilarityIndex, report_similar_existing)
+from photo_backup_pipeline import (DATE_WORKERS, COPY_WORKERS, LARGE_WORKERS,
+                                   copy_photos_by_date_parallel)
+from photo_backup_scheduler import LARGE_FILE_SIZE, CopyScheduler
+from photo_backup_async import CONCURRENCY, IO_WORKERS, copy_photos_by_date_async
+from photo_backup_watch import DEBOUNCE, POLL_INTERVAL, watch
+from photo_backup_thumbnails import (DEFAULT_FORMAT, DEFAULT_SIZES, FORMATS,
+                                     ThumbnailGenerator, backfill_thumbnails)
+
+
+def parse_args(argv=None):
+    """parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Copy photos into YYYY/MM/YYYY-MM-DD folders.")
+    parser.add_argument("source", nargs="?", help="image source path")
+    parser.add_argument("destination", nargs="?", help="image destination path")
+    parser.add_argument("image_types", nargs="*",
+                        default=list(SUPPORTED_IMAGE_TYPES),
+                        help="image file suffixes to back up")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="only back up files whose name or relative path matches")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="skip files and folders whose name or relative path matches")
+    parser.add_argument("--jobs", metavar="JOB_FILE",
+                        help="run every source -> destination job of a .json, .toml "
+                             "or .yaml file in this process")
+    parser.add_argument("--parallel", action="store_true",
+                        help="run the scan, date and copy stages in parallel")
+    parser.add_argument("--async", dest="async_engine", action="store_true",
+                        help="keep many file operations in flight with asyncio "
+                             "(for SMB/NFS destinations)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="files in progress at once (with --async)")
+    parser.add_argument("--io-workers", type=int, default=IO_WORKERS,
+                        help="threads running blocking file calls (with --async)")
+    parser.add_argument("--date-workers", type=int, default=DATE_WORKERS,
+                        help="threads reading photo dates (with --parallel)")
+    parser.add_argument("--copy-workers", type=int, default=COPY_WORKERS,
+                        help="threads copying files (with --parallel or --execute)")
+    parser.add_argument("--schedule", action="store_true",
+                        help="with --parallel, copy grouped by source device and date "
+                             "folder, with large files in their own lane")
+    parser.add_argument("--large-file-size", type=float, metavar="MB",
+                        default=LARGE_FILE_SIZE / 1024 / 1024,
+                        help="size from which --schedule puts a file in the large lane")
+    parser.add_argument("--large-workers", type=int, default=LARGE_WORKERS,
+                        help="threads copying large files with --schedule")
+    parser.add_argument("--bandwidth-limit", type=float, metavar="MB/S",
+                        help="cap the copy throughput (implies --schedule with --parallel)")
+    parser.add_argument("--iops-limit", type=float, metavar="FILES/S",
+                        help="cap the number of files copied per second")
+    parser.add_argument("--watch", action="store_true",
+                        help="after the backup, keep running and back up new photos "
+                             "as they arrive (best with --incremental)")
+    parser.add_argument("--watch-debounce", type=float, default=DEBOUNCE, metavar="SECONDS",
+                        help="time a new file must stay unchanged before it is copied")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, rescan the source instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        metavar="SECONDS", help="time between rescans with --poll")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip files recorded as unchanged in the destination catalog")
+    parser.add_argument("--global-dedupe", action="store_true",
+                        help="skip files whose content is anywhere in the destination")
+    parser.add_argument("--link", action="store_true",
+                        help="hard-link duplicates instead of skipping/deleting them")
+    parser.add_argument("--dedupe-existing", metavar="DESTINATION",
+                        help="collapse duplicates already in DESTINATION")
+    parser.add_argument("--near-duplicates", choices=("flag", "skip"),
+                        help="compare perceptual hashes with the destination photos "
+                             "and report (flag) or leave out (skip) look-alikes")
+    parser.add_argument("--similarity-threshold", type=int, default=DEFAULT_THRESHOLD,
+                        metavar="BITS",
+                        help="max differing bits of a near-duplicate (of 64)")
+    parser.add_argument("--similarity-hash", choices=HASH_NAMES, default=DEFAULT_HASH,
+                        help="perceptual hash compared for --near-duplicates")
+    parser.add_argument("--similar-existing", metavar="DESTINATION",
+                        help="list groups of near-duplicates already in DESTINATION")
+    parser.add_argument("--hash-algorithm", choices=photo_backup_hash.ALGORITHMS,
+                        default=photo_backup_hash.DEFAULT_ALGORITHM,
+                        help="hash used to compare files")
+    parser.add_argument("--metadata-cache", action="store_true",
+                        help="read EXIF in batches on a process pool and cache it "
+                             "in the destination by device, inode, size and mtime")
+    parser.add_argument("--metadata-workers", type=int, metavar="N",
+                        help="processes reading EXIF with --metadata-cache "
+                             "(default: one per CPU)")
+    parser.add_argument("--thumbnails", action="store_true",
+                        help="write thumbnails of the copied photos to DESTINATION/.thumbnails, "
+                             "once per distinct content")
+    parser.add_argument("--thumbnail-sizes", type=int, nargs="+", metavar="PIXELS",
+                        default=list(DEFAULT_SIZES),
+                        help="longest side of each thumbnail size")
+    parser.add_argument("--thumbnail-format", choices=tuple(FORMATS), default=DEFAULT_FORMAT,
+                        help="thumbnail file format")
+    parser.add_argument("--thumbnail-workers", type=int, metavar="N",
+                        help="processes writing thumbnails (default: one per CPU)")
+    parser.add_argument("--thumbnails-backfill", metavar="DESTINATION",
+                        help="write the missing thumbnails of every photo in DESTINATION")
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="keep the process near MB of RAM: large indexes spill to "
+                             "disk and the scan waits for the copy stages when over")
+    parser.add_argument("--verify", action="store_true",
+                        help="hash every file while copying, check the copy by reading it "
+                             "back and record the hash in the destination manifest")
+    parser.add_argument("--audit", metavar="DESTINATION",
+                        help="re-verify a slice of DESTINATION against its manifest "
+                             "(run nightly to catch bit rot)")
+    parser.add_argument("--audit-cycle", type=int, default=AUDIT_CYCLE, metavar="RUNS",
+                        help="check 1/RUNS of the archive per --audit run")
+    parser.add_argument("--audit-max-gb", type=float, metavar="GB",
+                        help="stop an --audit run after reading GB")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="do not keep a journal for resuming an interrupted run")
+    parser.add_argument("--plan", metavar="PLAN_FILE",
+                        help="only write the copy plan to PLAN_FILE")
+    parser.add_argument("--execute", metavar="PLAN_FILE",
+                        help="apply a plan written by --plan")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--verbose", action="store_true",
+                        help="print a line for every file")
+    output.add_argument("--quiet", action="store_true",
+                        help="print only the final summary")
+    parser.add_argument("--log-jsonl", metavar="LOG_FILE",
+                        help="append every backup event to LOG_FILE as JSON lines")
+    parser.add_argument("--profile", action="store_true",
+                        help="print per-stage timings and the slowest files after the run")
+    parser.add_argument("--profile-slowest", type=int, metavar="N",
+                        default=photo_backup_profile.SLOWEST_FILES,
+                        help="number of slowest files listed by --profile")
+    parser.add_argument("--profile-dump", metavar="PSTATS_FILE",
+                        help="write a cProfile dump of the run to PSTATS_FILE "
+                             "(main thread only, so best without --parallel)")
+    args = parser.parse_args(argv)
+    if args.dedupe_existing is None and args.execute is None and \
+            args.similar_existing is None and args.thumbnails_backfill is None and \
+            args.jobs is None and args.audit is None and \
+            (args.source is None or args.destination is None):
+        parser.error("the following arguments are required: source, destination")
+    if args.watch and (args.parallel or args.async_engine or args.plan):
+        parser.error("--watch runs the serial engine and cannot be combined with "
+                     "--parallel, --async or --plan")
+    if args.schedule and not args.parallel:
+        parser.error("--schedule requires --parallel")
+    if args.async_engine and (args.bandwidth_limit or args.iops_limit):
+        parser.error("--bandwidth-limit and --iops-limit do not apply to --async")
+    return args
+
+
+def build_events(args):
+    """ Build the event stream and sinks the command line options ask for
 
     Returns:
-        str: date formatted as YYYY-MM-DD
+        tuple: (EventStream, CounterSink with the totals of the run)
     """
-
-    file_name = os.path.basename(file_path)
-
-    try:
-        with Image.open(file_path) as img:
-            exif_data = img._getexif()
-            # check if the exif data is not None
-            if exif_data is not None:
-                for tag, value in exif_data.items():
-                    tag_name = TAGS.get(tag, tag)
-                    # check if the tag DateTimeOriginal exists
-                    if tag_name == 'DateTimeOriginal':
-                        # extract the date and time from the value
-                        # check if the value is like 2011:11:22
-                        if re.match(r"20\d{2}:\d{2}:\d{2}", value):
-                            date = value.split(' ')[0].replace(':', '-')
-                            return date
-    except (OSError, IsADirectoryError, KeyError, TypeError) as e:
-        print(f"Error processing {file_path}: {e}")
-
-    return get_photo_date_from_filename(file_name)
-
-
-def copy_photos_by_date(source_dir, destination_dir, supported_image_types=SUPPORTED_IMAGE_TYPES):
-    """ copy photos by date
-
-    Args:
-        source_dir (_type_): _description_
-        destination_dir (_type_): _description_
-    """
-    file_count = 0
-    validate_folder_path(source_dir)
-    validate_folder_path(destination_dir)
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            # check if the file is an image
-            if file.endswith(supported_image_types):
-
-                file_path = os.path.join(root, file)
-                parent_dir = os.path.basename(
-                    os.path.dirname(file_path))
-                try:
-                    # get the date of the photo, default to 0000-00-00
-                    date_fromfile = get_photo_date(file_path)
-                    date_fromparent = get_photo_date_from_filename(parent_dir)
-                    if date_fromfile:
-                        date = date_fromfile
-                        print(f"{file_path} : date has got from file {date}")
-                    elif date_fromparent:
-                        date = date_fromparent
-                        print(f"{file_path} : date has got from dir {date}")
-                    else:
-                        date = "2000-01-01"
-                        print(f"{file_path} : date has set to default {date}")
-                    # create destination directory if it doesn't exist
-
-                    year = date.split('-')[0]
-                    month = date.split('-')[1]
-                    day = date.split('-')[2]
-                    date = f"{year}/{month}/{date}"
-                    destination_dir_path = os.path.join(
-                        destination_dir, date)
-                    destination_file_path = os.path.join(
-                        destination_dir_path, file)
-                    if os.path.exists(destination_dir_path):
-                        if os.path.exists(destination_file_path):
-                            # md5
-                            source_md5 = get_md5(file_path)
-                            destination_md5 = get_md5(destination_file_path)
-                            if source_md5 == destination_md5:
-                                print(f'{file} is already exist')
-                                break
-                            else:
-                                # rename file
-                                rename_path = generate_unique_filename(
-                                    destination_dir_path, file)
-                                # copy file
-                                shutil.copy2(file_path, rename_path)
-                        else:
-
-                            shutil.copy(file_path, destination_file_path)
-                    else:
-                        os.makedirs(destination_dir_path)
-                        shutil.copy(file_path, destination_file_path)
-                    file_count += 1
-                except Exception as e:
-                    print(e)
-    print(f"{file_count} files copied")
+    counter = photo_backup_events.ProgressBarSink() \
+        if not (args.quiet or args.verbose) else photo_backup_events.CounterSink()
+    events = photo_backup_events.EventStream([counter])
+    if args.verbose:
+        events.add_sink(photo_backup_events.PrintSink())
+    if args.log_jsonl is not None:
+        events.add_sink(photo_backup_events.JsonlSink(args.log_jsonl))
+    return events, counter
 
 
 def main():
     """main
     """
-    if len(sys.argv) < 3:
-        print("Usage: python photo_backup.py <image_source_path> <image_destination_path> <image_file_type_list>")
-        sys.exit(1)
-
-    source_folder = sys.argv[1]
-    destination_folder = sys.argv[2]
-    support_image_types = sys.argv[3]
-    if validate_folder_path(source_folder):
-        sys.exit(1)
-    if validate_folder_path(destination_folder):
-        sys.exit(1)
-
-    copy_photos_by_date(source_folder, destination_folder, support_image_types)
+    args = parse_args()
+    if args.profile:
+        photo_backup_profile.PROFILER.enabled = True
+        photo_backup_profile.PROFILER.reset()
+    profiler = None
+    if args.profile_dump is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+        if args.profile:
+            print(photo_backup_profile.PROFILER.report(args.profile_slowest))
+
+
+def run(args):
+    """run the mode selected on the command line"""
+    photo_backup_hash.DEFAULT_ALGORITHM = args.hash_algorithm
+    if args.max_memory is not None:
+        photo_backup_memory.BUDGET.configure(int(args.max_memory * 1024 * 1024))
+        photo_backup_utils.DECODE_BUDGET.limit = photo_backup_memory.BUDGET.decode_limit(
+            photo_backup_utils.DECODE_BUDGET.limit)
+    if args.dedupe_existing is not None:
+        dedupe_existing(args.dedupe_existing, link=args.link)
+        if args.source is None or args.destination is None:
+            return
+    if args.similar_existing is not None:
+        report_similar_existing(args.similar_existing, args.similarity_threshold,
+                                args.similarity_hash)
+        if args.source is None or args.destination is None:
+            return
+    if args.thumbnails_backfill is not None:
+        backfill_thumbnails(args.thumbnails_backfill, args.thumbnail_sizes,
+                            args.thumbnail_format, args.thumbnail_workers,
+                            args.image_types)
+        if args.source is None or args.destination is None:
+            return
+    if args.audit is not None:
+        audit(args.audit, args.audit_cycle,
+              int(args.audit_max_gb * 1024 ** 3) if args.audit_max_gb else None)
+        if args.source is None or args.destination is None:
+            return
+    if args.execute is not None:
+        events, counter = build_events(args)
+        try:
+            execute_plan(args.execute, workers=args.copy_workers, events=events)
+        finally:
+            events.close()
+        print(f"{counter.snapshot()['errors']} errors")
+        return
+    if args.jobs is not None:
+        run_job_file(args)
+        return
+    validate_folder_path(args.source)
+    validate_folder_path(args.destination)
+    events, counter = build_events(args)
+    if args.plan is not None:
+        try:
+            plan_copy(args.source, args.destination, args.plan, args.image_types,
+                      include=args.include, exclude=args.exclude, events=events)
+        finally:
+            events.close()
+        return
+
+    catalog = Catalog(args.destination) if args.incremental else None
+    index = DestinationIndex(args.destination) if args.global_dedupe else None
+    # 监视模式不会结束，日志无法在完成时删除，由 --incremental 的目录记录已备份的文件
+    journal = None if args.no_journal or args.watch else Journal(args.destination)
+    metadata = MetadataCache(args.destination, args.metadata_workers) \
+        if args.metadata_cache else None
+    similar = None
+    if args.near_duplicates is not None:
+        similar = SimilarityIndex(args.destination, args.similarity_threshold,
+                                  args.similarity_hash, skip=args.near_duplicates == 'skip',
+                                  supported_image_types=args.image_types)
+    manifest = Manifest(args.destination) if args.verify else None
+    thumbnails = None
+    if args.thumbnails:
+        # 作为事件接收者挂在事件流上，events.close() 时等待剩余的缩略图
+        thumbnails = ThumbnailGenerator(args.destination, args.thumbnail_sizes,
+                                        args.thumbnail_format, args.thumbnail_workers)
+        events.add_sink(thumbnails)
+    scheduler = None
+    if args.schedule or args.bandwidth_limit or args.iops_limit:
+        scheduler = CopyScheduler(
+            int(args.large_file_size * 1024 * 1024),
+            args.bandwidth_limit * 1024 * 1024 if args.bandwidth_limit else None,
+            args.iops_limit)
+    try:
+        if args.watch:
+            try:
+                watch(args.source, args.destination, args.image_types,
+                      include=args.include, exclude=args.exclude, events=events,
+                      debounce=args.watch_debounce, poll_interval=args.poll_interval,
+                      use_inotify=not args.poll, catalog=catalog, index=index,
+                      link=args.link, metadata=metadata, similar=similar,
+                      scheduler=scheduler, manifest=manifest)
+            except KeyboardInterrupt:
+                print("watch stopped")
+        elif args.async_engine:
+            copy_photos_by_date_async(
+                args.source, args.destination, args.image_types,
+                concurrency=args.concurrency, io_workers=args.io_workers,
+                catalog=catalog, index=index, link=args.link, journal=journal,
+                include=args.include, exclude=args.exclude, events=events,
+                metadata=metadata, similar=similar, manifest=manifest)
+        elif args.parallel:
+            copy_photos_by_date_parallel(
+                args.source, args.destination, args.image_types,
+                date_workers=args.date_workers, copy_workers=args.copy_workers,
+                catalog=catalog, index=index, link=args.link, journal=journal,
+                include=args.include, exclude=args.exclude, events=events,
+                metadata=metadata, similar=similar,
+                scheduler=scheduler,
+                large_workers=args.large_workers, manifest=manifest)
+        else:
+            copy_photos_by_date(args.source, args.destination,
+                                args.image_types, catalog=catalog,
+                                index=index, link=args.link, journal=journal,
+                                include=args.include, exclude=args.exclude,
+                                events=events, metadata=metadata, similar=similar,
+                                scheduler=scheduler, manifest=manifest)
+        if journal is not None:
+            journal.finish()
+    finally:
+        events.close()
+        if metadata is not None:
+            metadata.close()
+        if similar is not None:
+            similar.close()
+        if journal is not None:
+            journal.close()
+        if manifest is not None:
+            manifest.close()
+        if index is not None:
+            index.close()
+        if catalog is not None:
+            catalog.close()
+    snapshot = counter.snapshot()
+    if catalog is not None or journal is not None:
+        print(f"{snapshot['skipped']} files skipped as unchanged or already done")
+    print(f"{snapshot['copied']} files copied, {snapshot['duplicates']} duplicates, "
+          f"{snapshot['errors']} errors")
+    if similar is not None:
+        print(f"{snapshot['near_duplicates']} near-duplicates "
+              f"{'skipped' if similar.skip else 'flagged'}")
+    if thumbnails is not None:
+        print(thumbnails.summary())
+    if scheduler is not None:
+        print(scheduler.summary())
+    if photo_backup_memory.BUDGET.limit is not None:
+        print(photo_backup_memory.BUDGET.summary())
+    if photo_backup_transfer.TRANSFER_STATS.strategies:
+        print(photo_backup_transfer.TRANSFER_STATS.summary())
+    if photo_backup_hash.HASH_STATS.comparisons:
+        print(photo_backup_hash.HASH_STATS.summary())
+
+
+def run_job_file(args):
+    """run the jobs of the --jobs file and print a summary per job"""
+    jobs, options = load_jobs(args.jobs)
+    events, counter = build_events(args)
+    try:
+        results = run_jobs(jobs, options['workers'], options['metadata_workers'],
+                           options['journal'], events)
+    finally:
+        events.close()
+    for job in jobs:
+        snapshot = results.get(job.name)
+        if snapshot is None:
+            continue
+        print(f"{job.name}: {snapshot['copied']} files copied, {snapshot['duplicates']} "
+              f"duplicates, {snapshot['skipped']} skipped, {snapshot['errors']} errors")
+    snapshot = counter.snapshot()
+    print(f"{len(results)} jobs: {snapshot['copied']} files copied, "
+          f"{snapshot['duplicates']} duplicates, {snapshot['errors']} errors")
+    if photo_backup_transfer.TRANSFER_STATS.strategies:
+        print(photo_backup_transfer.TRANSFER_STATS.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 20:03:37
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 20:03:37
+ * @Description  : asyncio backup engine for high-latency destinations
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import asyncio
+import contextlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import photo_backup_events
+import photo_backup_memory
+import photo_backup_profile
+import photo_backup_utils
+from photo_backup_profile import PROFILER
+from photo_backup_utils import SUPPORTED_IMAGE_TYPES, COPIED
+
+# 同时处理中的文件数上限
+CONCURRENCY = 64
+# 执行阻塞文件操作的线程数
+IO_WORKERS = 16
+# 每次从扫描器取出的文件数
+SCAN_BATCH = 64
+
+
+def _next_batch(iterator, count):
+    """up to count items of iterator, run on the executor"""
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= count:
+            break
+    return batch
+
+
+def _copy_reserved(file_path, destination_file_path, manifest):
+    """copy a file to the name reserved for it"""
+    with PROFILER.timed(photo_backup_profile.COPY, file_path, os.path.getsize(file_path)):
+        photo_backup_utils.transfer_file(file_path, destination_file_path, manifest=manifest)
+
+
+def _copy_locked(index, source, destination_dir_path, link, names, manifest):
+    """copy_photo under the size lock of the destination index"""
+    lock = index.size_lock(source.size) if index is not None else contextlib.nullcontext()
+    with lock:
+        return photo_backup_utils.copy_photo(
+            source.path, destination_dir_path, index, link, names, manifest)
+
+
+class _AsyncBackup:
+    """state of one asyncio backup run"""
+
+    def __init__(self, destination_dir, catalog, index, link, journal, events, metadata,
+                 similar, manifest, concurrency, executor):
+        self.destination_dir = destination_dir
+        self.catalog = catalog
+        self.index = index
+        self.link = link
+        self.journal = journal
+        self.events = events
+        self.metadata = metadata
+        self.similar = similar
+        self.manifest = manifest
+        self.executor = executor
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.names = photo_backup_utils.DirectoryNameIndex(
+            photo_backup_memory.BUDGET.max_folders())
+        # 目标日期目录 -> 锁；按扫描顺序排队，保证重名文件的编号与串行版本一致
+        self.folder_locks = {}
+        # 目标日期目录 -> 创建该目录的 Future，每个目录只调用一次 makedirs
+        self.folders_ready = {}
+        # (目录, 文件名) -> 正在复制到该名字的 Future
+        self.in_flight = {}
+        self.tasks = set()
+
+    def run(self, function, *args):
+        """run a blocking call on the executor"""
+        return self.loop.run_in_executor(self.executor, function, *args)
+
+    def _folder_ready(self, destination_dir_path):
+        ready = self.folders_ready.get(destination_dir_path)
+        if ready is None:
+            ready = self.folders_ready[destination_dir_path] = asyncio.ensure_future(
+                self.run(self._makedirs, destination_dir_path))
+        return ready
+
+    def _makedirs(self, destination_dir_path):
+        with PROFILER.timed(photo_backup_profile.MAKEDIRS):
+            self.names.makedirs(destination_dir_path)
+
+    def _resolve(self, source, record):
+        date = photo_backup_utils.resolve_photo_date(source.path, self.events, record)
+        if photo_backup_utils.skip_near_duplicate(source, date, self.similar, self.events,
+                                                  self.catalog, self.journal):
+            return date, None
+        return date, photo_backup_utils.build_destination_dir(self.destination_dir, date)
+
+    async def resolve(self, source, record):
+        """resolve the date folder of a file on the executor, None for a skipped near-duplicate"""
+        return await self.run(self._resolve, source, record)
+
+    async def place(self, source, date, destination_dir_path):
+        """copy one file into its date folder; must be scheduled in scan order"""
+        lock = self.folder_locks.get(destination_dir_path)
+        if lock is None:
+            lock = self.folder_locks[destination_dir_path] = asyncio.Lock()
+        file = os.path.basename(source.path)
+        try:
+            # 第一个 await 就是目录锁，任务按创建顺序排队
+            async with lock:
+                if self.index is None:
+                    await self._folder_ready(destination_dir_path)
+                    if not self.names.cached(destination_dir_path):
+                        # 目录名单被挤出后重读磁盘，不能在事件循环线程上做
+                        await self.run(self.names.load, destination_dir_path)
+                # 目录名单被挤出后会从磁盘重读，看不到仍在复制的文件，所以也查 in_flight
+                if self.index is None and (destination_dir_path, file) not in self.in_flight \
+                        and not self.names.exists(destination_dir_path, file):
+                    # 常见情况：新名字，先占用名字，释放锁后再复制
+                    self.names.add(destination_dir_path, file)
+                    destination_file_path = os.path.join(destination_dir_path, file)
+                    copied = self.in_flight[(destination_dir_path, file)] = \
+                        self.loop.create_future()
+                    result = None
+                else:
+                    # 重名或全局去重：等同名文件复制完成后按原流程比较/改名
+                    earlier = self.in_flight.get((destination_dir_path, file))
+                    if earlier is not None:
+                        await asyncio.wait([earlier])
+                    result, destination_file_path = await self.run(
+                        _copy_locked, self.index, source, destination_dir_path,
+                        self.link, self.names, self.manifest)
+            if result is None:
+                try:
+                    await self.run(_copy_reserved, source.path, destination_file_path,
+                                   self.manifest)
+                    result = COPIED
+                except FileExistsError:
+                    # 名字索引之外已有同名文件：不覆盖，比较后改名
+                    result, destination_file_path = await self.run(
+                        photo_backup_utils.copy_on_collision, source.path,
+                        destination_dir_path, destination_file_path, self.names, True,
+                        self.manifest)
+                except BaseException:
+                    self.names.discard(destination_dir_path, file)
+                    raise
+                finally:
+                    copied.set_result(None)
+                    del self.in_flight[(destination_dir_path, file)]
+            await self.run(photo_backup_utils.settle_near_duplicate,
+                           source, self.similar, result, destination_file_path)
+            await self.run(photo_backup_utils.record_done, source, date, result,
+                           destination_file_path, self.catalog, self.journal)
+            photo_backup_utils.emit_result(self.events, source, result, destination_file_path)
+        except Exception as e:
+            photo_backup_utils.settle_near_duplicate(source, self.similar)
+            self.events.emit(photo_backup_events.ERROR, source.path, error=str(e))
+        finally:
+            self.slots.release()
+
+    def spawn(self, coroutine):
+        """start a task and keep a reference until it is done"""
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def backup(self, pending):
+        """resolve dates concurrently, then schedule the copies in scan order"""
+        order = asyncio.Queue()
+
+        async def dispatch():
+            while True:
+                item = await order.get()
+                if item is None:
+                    return
+                source, resolving = item
+                try:
+                    date, destination_dir_path = await resolving
+                except Exception as e:
+                    self.events.emit(photo_backup_events.ERROR, source.path, error=str(e))
+                    self.slots.release()
+                    continue
+                if destination_dir_path is None:
+                    self.slots.release()
+                    continue
+                self.spawn(self.place(source, date, destination_dir_path))
+
+        dispatcher = self.loop.create_task(dispatch())
+        try:
+            while not self.events.cancelled():
+                batch = await self.run(_next_batch, pending, SCAN_BATCH)
+                if not batch:
+                    break
+                for source, record in batch:
+                    # 超出内存预算时等进行中的文件完成
+                    if photo_backup_memory.BUDGET.over():
+                        while self.tasks and photo_backup_memory.BUDGET.exceeded():
+                            await asyncio.sleep(photo_backup_memory.WAIT_STEP)
+                    await self.slots.acquire()
+                    order.put_nowait((source, self.spawn(self.resolve(source, record))))
+        finally:
+            order.put_nowait(None)
+            await dispatcher
+            while self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def backup_async(source_dir, destination_dir,
+                       supported_image_types=SUPPORTED_IMAGE_TYPES,
+                       concurrency=CONCURRENCY, io_workers=IO_WORKERS,
+                       catalog=None, index=None, link=False, journal=None,
+                       include=None, exclude=None, events=None, metadata=None,
+                       similar=None, manifest=None):
+    """ copy photos by date with many file operations in flight at once
+
+    Every blocking call (scan, EXIF, makedirs, copy, catalog) runs on a
+    bounded thread pool while the event loop keeps up to concurrency files
+    in progress. Each date folder is created once and listed once, and the
+    files of one folder are placed in scan order, so the final tree is the
+    same as copy_photos_by_date's. Files with new names are copied outside
+    the folder lock; name collisions are compared and renamed under it.
+
+    Args:
+        source_dir (str): source directory
+        destination_dir (str): destination directory
+        supported_image_types (tuple): file suffixes to back up
+        concurrency (int): max files being processed at the same time
+        io_workers (int): threads running the blocking file operations
+        catalog (Catalog): skip files already backed up with the same size
+            and mtime, and record every handled file
+        index (DestinationIndex): skip files already anywhere in the destination
+        link (bool): with index, hard-link instead of skipping
+        journal (Journal): skip files an interrupted run already finished,
+            and record every handled file
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        events (EventStream): receives one event per step of every file,
+            and carries the cancel flag of the run
+        metadata (MetadataCache): extract EXIF dates in batches on a process
+            pool and reuse them across runs
+        similar (SimilarityIndex): flag or skip photos that look like one
+            already in the destination
+        manifest (Manifest): verify every copy by read-back and record its hash
+
+    Returns:
+        int: number of files copied
+    """
+    if concurrency < 1 or io_workers < 1:
+        raise ValueError("concurrency and io_workers must be at least 1.")
+    photo_backup_utils.validate_folder_path(source_dir)
+    photo_backup_utils.validate_folder_path(destination_dir)
+    if events is None:
+        events = photo_backup_events.EventStream()
+    with ThreadPoolExecutor(max_workers=io_workers) as executor, \
+            events.attach(photo_backup_events.CounterSink()) as counter:
+        pending = photo_backup_utils.iter_pending(
+            source_dir, supported_image_types, include, exclude,
+            catalog, journal, events, metadata)
+        run = _AsyncBackup(destination_dir, catalog, index, link, journal, events,
+                           metadata, similar, manifest, concurrency, executor)
+        await run.backup(pending)
+    return counter.copied
+
+
+def copy_photos_by_date_async(source_dir, destination_dir, *args, **kwargs):
+    """run backup_async to completion; takes the same arguments"""
+    return asyncio.run(backup_async(source_dir, destination_dir, *args, **kwargs))
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 11:20:36
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 11:20:36
+ * @Description  : benchmarks for photo_backup
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import photo_backup_exif
+import photo_backup_memory
+import photo_backup_utils
+
+# rss 默认的文件数与内存预算 (MB)
+RSS_FILES = 1000000
+RSS_BUDGET = 256
+# suite 默认的库规模；10 万文件的大规模需显式用 --scales 指定
+SUITE_SCALES = (1000, 10000)
+LARGE_SCALE = 100000
+# 生成文件大小的默认范围 (KiB)，按对数均匀分布，平均约 60 KiB
+MIN_KB = 4
+MAX_KB = 256
+# 生成库时每个源目录最多放多少个文件
+FILES_PER_FOLDER = 500
+# 生成库的参数文件，参数相同时复用已生成的库
+LIBRARY_MANIFEST = '.bench_library.json'
+# 结果文件格式版本
+RESULTS_VERSION = 1
+# 文件名中的日期格式 -> 权重；None 表示文件名不含日期
+NAME_PATTERNS = {'IMG_%Y%m%d_%H%M%S': 4, '%Y-%m-%d %H.%M.%S': 2, None: 1}
+# 生成日期的范围
+FIRST_DATE = datetime.datetime(2005, 1, 1)
+LAST_DATE = datetime.datetime(2024, 12, 31)
+
+
+def list_images(folder_path, supported_image_types=photo_backup_utils.SUPPORTED_IMAGE_TYPES):
+    """return every image path under folder_path"""
+    return [os.path.join(root, file)
+            for root, dirs, files in os.walk(folder_path)
+            for file in files if file.endswith(tuple(supported_image_types))]
+
+
+def time_function(function, paths, repeat):
+    """return the best total seconds of calling function on every path"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                function(path)
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_exif(args):
+    """compare the EXIF header parser with the PIL path"""
+    paths = list_images(args.folder)
+    if not paths:
+        print(f"no images found in {args.folder}")
+        return
+    mismatches = [path for path in paths
+                  if photo_backup_utils.get_exif_date(path)
+                  != photo_backup_utils.get_exif_date_pil(path)]
+    pil = time_function(photo_backup_utils.get_exif_date_pil, paths, args.repeat)
+    fast = time_function(photo_backup_utils.get_exif_date, paths, args.repeat)
+    print(f"{len(paths)} files, best of {args.repeat}")
+    print(f"PIL _getexif   : {pil * 1e6 / len(paths):10.1f} us/file")
+    print(f"header parser  : {fast * 1e6 / len(paths):10.1f} us/file")
+    print(f"speedup        : {pil / fast:10.1f}x")
+    for path in mismatches:
+        print(f"date differs from PIL: {path}")
+
+
+class LibraryGenerator:
+    """ Deterministic synthetic photo library
+
+    Every file is a tiny JPEG padded with random bytes after its end marker
+    to the drawn size, so content differs per file while the headers stay
+    realistic. One JPEG header is encoded per EXIF date and reused.
+
+    Args:
+        files (int): number of files to write
+        seed (int): random seed, the same seed gives the same library
+        min_kb (int): smallest file size in KiB
+        max_kb (int): largest file size in KiB, sizes are log-uniform
+        exif (float): fraction of files with a DateTimeOriginal
+        parent_dates (float): fraction of undated names put in a dated folder
+        duplicates (float): fraction of files that repeat an earlier file's bytes
+        collisions (float): fraction of files that reuse an earlier name and
+            date with different content
+    """
+
+    def __init__(self, files, seed=0, min_kb=MIN_KB, max_kb=MAX_KB, exif=0.7,
+                 parent_dates=0.5, duplicates=0.05, collisions=0.02):
+        self.files = files
+        self.seed = seed
+        self.min_kb = min_kb
+        self.max_kb = max_kb
+        self.exif = exif
+        self.parent_dates = parent_dates
+        self.duplicates = duplicates
+        self.collisions = collisions
+        self._headers = {}
+
+    def params(self):
+        """the parameters as a dict, for the manifest and the results"""
+        return {name: getattr(self, name) for name in (
+            'files', 'seed', 'min_kb', 'max_kb', 'exif', 'parent_dates',
+            'duplicates', 'collisions')}
+
+    def _header(self, date):
+        """a small JPEG, with date as its DateTimeOriginal unless date is None"""
+        header = self._headers.get(date)
+        if header is None:
+            buffer = io.BytesIO()
+            image = Image.new('RGB', (16, 16), (len(self._headers) % 256, 128, 64))
+            if date is None:
+                image.save(buffer, 'JPEG')
+            else:
+                exif = Image.Exif()
+                value = date.strftime('%Y:%m:%d %H:%M:%S')
+                exif[photo_backup_exif.DATE_TIME] = value
+                exif.get_ifd(photo_backup_exif.EXIF_IFD_POINTER)[
+                    photo_backup_exif.DATE_TIME_ORIGINAL] = value
+                image.save(buffer, 'JPEG', exif=exif.tobytes())
+            header = self._headers[date] = buffer.getvalue()
+        return header
+
+    def _size(self, rng):
+        low, high = self.min_kb * 1024, self.max_kb * 1024
+        return int(low * (high / low) ** rng.random())
+
+    def _name(self, rng, date, number):
+        pattern = rng.choices(list(NAME_PATTERNS), list(NAME_PATTERNS.values()))[0]
+        if pattern is None:
+            return f"DSC_{number:06d}.jpg", True
+        return date.strftime(pattern) + '.jpg', False
+
+    def generate(self, source_dir):
+        """ Write the library under source_dir
+
+        Returns:
+            dict: number of files per kind
+        """
+        rng = random.Random(self.seed)
+        span = int((LAST_DATE - FIRST_DATE).total_seconds())
+        counts = {'files': 0, 'exif': 0, 'parent_dates': 0, 'duplicates': 0,
+                  'collisions': 0, 'bytes': 0}
+        written = []
+        for number in range(self.files):
+            folder = os.path.join(source_dir, f"{number // FILES_PER_FOLDER:04d}")
+            roll = rng.random()
+            if written and roll < self.duplicates:
+                # 与之前某个文件内容相同、名字不同
+                earlier_path, earlier_name = rng.choice(written)
+                name = f"copy_{number:06d}_{earlier_name}"
+                os.makedirs(folder, exist_ok=True)
+                shutil.copyfile(earlier_path, os.path.join(folder, name))
+                counts['duplicates'] += 1
+                counts['files'] += 1
+                continue
+            date = FIRST_DATE + datetime.timedelta(seconds=rng.randrange(span))
+            name, undated = self._name(rng, date, number)
+            if written and roll < self.duplicates + self.collisions:
+                # 与之前某个文件同名同日期、内容不同，目标目录中会重名
+                earlier_path, name = rng.choice(written)
+                # 保留上级目录名，使按目录日期归档的文件也落到同一目标目录
+                folder = os.path.join(source_dir, 'collisions', f"{number:06d}",
+                                      os.path.basename(os.path.dirname(earlier_path)))
+                header = self._read_header(earlier_path)
+                counts['collisions'] += 1
+            else:
+                has_exif = rng.random() < self.exif
+                header = self._header(date if has_exif else None)
+                counts['exif'] += has_exif
+                if undated and rng.random() < self.parent_dates:
+                    folder = os.path.join(folder, date.strftime('%Y-%m-%d'))
+                    counts['parent_dates'] += 1
+            size = max(self._size(rng), len(header))
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, name)
+            with open(path, 'wb') as file:
+                file.write(header)
+                file.write(rng.randbytes(size - len(header)))
+            written.append((path, name))
+            counts['files'] += 1
+            counts['bytes'] += size
+        return counts
+
+    @staticmethod
+    def _read_header(path):
+        """the JPEG part of a generated file, up to and including its end marker"""
+        with open(path, 'rb') as file:
+            data = file.read(64 * 1024)
+        return data[:data.index(b'\xff\xd9') + 2]
+
+
+def ensure_library(source_dir, generator):
+    """ Generate the library in source_dir unless it already holds one with the same parameters
+
+    Returns:
+        dict: the library manifest
+    """
+    manifest_path = os.path.join(source_dir, LIBRARY_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get('params') == generator.params():
+            return manifest
+        shutil.rmtree(source_dir)
+    os.makedirs(source_dir, exist_ok=True)
+    start = time.perf_counter()
+    counts = generator.generate(source_dir)
+    manifest = {'params': generator.params(), 'counts': counts,
+                'seconds': time.perf_counter() - start}
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def git_commit():
+    """the current commit of the repository, or None"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _result(seconds, files):
+    return {'seconds': seconds, 'files': files,
+            'us_per_file': seconds * 1e6 / files if files else 0.0}
+
+
+def bench_library(source_dir, repeat, copy_repeat):
+    """time the date, hash and copy functions over one generated library"""
+    paths = list_images(source_dir)
+    names = [os.path.basename(path) for path in paths]
+    results = {}
+    for name, function, arguments in (
+            ('get_photo_date_from_filename', photo_backup_utils.get_photo_date_from_filename, names),
+            ('get_photo_date', photo_backup_utils.get_photo_date, paths),
+            ('resolve_photo_date', photo_backup_utils.resolve_photo_date, paths),
+            ('get_md5', photo_backup_utils.get_md5, paths)):
+        results[name] = _result(time_function(function, arguments, repeat), len(arguments))
+    best = None
+    for _ in range(copy_repeat):
+        destination_dir = tempfile.mkdtemp(prefix='photo_backup_bench_')
+        try:
+            start = time.perf_counter()
+            photo_backup_utils.copy_photos_by_date(
+                source_dir, destination_dir, photo_backup_utils.SUPPORTED_IMAGE_TYPES)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(destination_dir, ignore_errors=True)
+        best = elapsed if best is None else min(best, elapsed)
+    results['copy_photos_by_date'] = _result(best, len(paths))
+    return results
+
+
+def _generator(args, files):
+    return LibraryGenerator(files, seed=args.seed, min_kb=args.min_kb, max_kb=args.max_kb,
+                            exif=args.exif, parent_dates=args.parent_dates,
+                            duplicates=args.duplicates, collisions=args.collisions)
+
+
+def bench_generate(args):
+    """write one synthetic library"""
+    manifest = ensure_library(args.folder, _generator(args, args.files))
+    print(json.dumps(manifest['counts']))
+
+
+def bench_suite(args):
+    """run the benchmarks at every scale and write the JSON results"""
+    results = {'version': RESULTS_VERSION, 'commit': git_commit(),
+               'time': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'repeat': args.repeat, 'scales': {}}
+    for files in args.scales:
+        source_dir = os.path.join(args.work_dir, f"library_{files}")
+        manifest = ensure_library(source_dir, _generator(args, files))
+        timings = bench_library(source_dir, args.repeat, args.copy_repeat)
+        results['scales'][str(files)] = {'library': manifest['params'],
+                                         'counts': manifest['counts'],
+                                         'results': timings}
+        for name, timing in timings.items():
+            print(f"{files:>7} {name:<30}{timing['seconds']:10.3f} s"
+                  f"{timing['us_per_file']:12.1f} us/file")
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {args.output}")
+
+
+def bench_compare(args):
+    """print the change of every timing between two result files"""
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    with open(args.candidate, encoding='utf-8') as file:
+        candidate = json.load(file)
+    print(f"baseline {baseline.get('commit')}  candidate {candidate.get('commit')}")
+    for scale, entry in candidate['scales'].items():
+        before = baseline['scales'].get(scale)
+        if before is None:
+            continue
+        if before['library'] != entry['library']:
+            print(f"{scale}: libraries were generated with different parameters")
+        for name, timing in entry['results'].items():
+            old = before['results'].get(name)
+            if old is None or not old['seconds']:
+                continue
+            ratio = timing['seconds'] / old['seconds']
+            print(f"{scale:>7} {name:<30}{old['seconds']:10.3f} s ->"
+                  f"{timing['seconds']:10.3f} s  {ratio:6.2f}x")
+
+
+def write_flat_tree(folder, files, seed=0):
+    """ Write a flat folder of tiny files named like a WeChat export
+
+    Names are mmexport<milliseconds>.jpg spread over 2005-2024, so the
+    backup sorts them into thousands of date folders. The contents are
+    the file numbers, so there are no duplicates. An existing folder with
+    enough files is reused.
+
+    Returns:
+        int: number of files in the folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    with os.scandir(folder) as entries:
+        existing = sum(1 for _ in entries)
+    if existing >= files:
+        return existing
+    rng = random.Random(seed)
+    first = int(FIRST_DATE.timestamp() * 1000)
+    last = int(LAST_DATE.timestamp() * 1000)
+    for number in range(existing, files):
+        name = os.path.join(folder, f"mmexport{rng.randint(first, last)}_{number}.jpg")
+        with open(name, 'wb') as file:
+            file.write(str(number).encode())
+    return files
+
+
+def bench_rss(args):
+    """back up a large flat tree under --max-memory and check the peak RSS"""
+    source_dir = os.path.join(args.work_dir, f"flat_{args.files}")
+    print(f"{write_flat_tree(source_dir, args.files)} files in {source_dir}")
+    destination_dir = tempfile.mkdtemp(prefix="rss_", dir=args.work_dir)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            "photo_backup.py"),
+               source_dir, destination_dir, "--quiet", "--max-memory", str(args.max_memory)]
+    command += [arg for arg in args.backup_args if arg != "--"]
+    start = time.perf_counter()
+    try:
+        returncode = subprocess.call(command)
+    finally:
+        if not args.keep:
+            shutil.rmtree(destination_dir, ignore_errors=True)
+    seconds = time.perf_counter() - start
+    peak = photo_backup_memory.peak_rss_bytes(children=True)
+    if returncode:
+        sys.exit(f"backup failed with exit code {returncode}")
+    if peak is None:
+        sys.exit("peak RSS is not available on this platform")
+    budget = args.max_memory * 1024 * 1024
+    print(f"{args.files} files in {seconds:.1f} s, peak RSS {peak / 1024 / 1024:.1f} MB, "
+          f"budget {args.max_memory} MB")
+    if peak > budget:
+        sys.exit(f"peak RSS over budget by {(peak - budget) / 1024 / 1024:.1f} MB")
+
+
+def _library_arguments(parser):
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-kb", type=int, default=MIN_KB)
+    parser.add_argument("--max-kb", type=int, default=MAX_KB,
+                        help="sizes are log-uniform between --min-kb and --max-kb; "
+                             "the defaults average about 60 KiB per file")
+    parser.add_argument("--exif", type=float, default=0.7,
+                        help="fraction of files with an EXIF date")
+    parser.add_argument("--parent-dates", type=float, default=0.5,
+                        help="fraction of undated names placed in a dated folder")
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--collisions", type=float, default=0.02)
+
+
+def main():
+    """main
+    """
+    parser = argparse.ArgumentParser(description="photo_backup benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    exif = commands.add_parser("exif", help="EXIF date reader vs PIL")
+    exif.add_argument("folder", nargs="?", default="source")
+    exif.add_argument("--repeat", type=int, default=5)
+    exif.set_defaults(func=bench_exif)
+
+    generate = commands.add_parser("generate", help="write a synthetic photo library")
+    generate.add_argument("folder")
+    generate.add_argument("--files", type=int, default=1000)
+    _library_arguments(generate)
+    generate.set_defaults(func=bench_generate)
+
+    suite = commands.add_parser(
+        "suite", help="time the backup at several library sizes",
+        epilog=f"The large scale is left out by default; run it with --scales "
+               f"{' '.join(map(str, SUITE_SCALES))} {LARGE_SCALE}. At the default sizes it "
+               f"writes about 6 GB to --work-dir; --min-kb 16 --max-kb 4096 (camera-sized "
+               f"files) makes that about 70 GB.")
+    suite.add_argument("--scales", type=int, nargs="+", default=list(SUITE_SCALES),
+                       help="library sizes in files")
+    suite.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(),
+                                                          "photo_backup_bench"),
+                       help="where the generated libraries are kept between runs")
+    suite.add_argument("--output", default="bench_results.json")
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--copy-repeat", type=int, default=1)
+    _library_arguments(suite)
+    suite.set_defaults(func=bench_suite)
+
+    rss = commands.add_parser("rss", help="check the peak RSS of a backup under --max-memory; "
+                                         "exits non-zero when over budget")
+    rss.add_argument("--files", type=int, default=RSS_FILES)
+    rss.add_argument("--max-memory", type=float, default=RSS_BUDGET, metavar="MB")
+    rss.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(),
+                                                        "photo_backup_bench"))
+    rss.add_argument("--keep", action="store_true", help="keep the backup destination")
+    rss.add_argument("backup_args", nargs=argparse.REMAINDER,
+                     help="extra photo_backup.py options, after --")
+    rss.set_defaults(func=bench_rss)
+
+    compare = commands.add_parser("compare", help="compare two suite result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
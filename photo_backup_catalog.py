@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 10:02:41
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 10:02:41
+ * @Description  : persistent catalog of backed-up files for incremental runs
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import os
+import sqlite3
+import threading
+
+# 目录数据库文件名，保存在目标根目录下
+CATALOG_NAME = '.photo_backup.db'
+# 每写入多少条记录提交一次事务
+COMMIT_INTERVAL = 500
+
+
+class Catalog:
+    """ SQLite catalog kept in the destination root
+
+    One row per source file: path, size, mtime, resolved date, where it
+    ended up and that file's size. A source whose (size, mtime) still
+    matches its row, and whose archived file is still there with its
+    recorded size, is skipped without being opened. No content hash is
+    kept: none of the engines hashes a plain new copy, and content checks
+    belong to the manifest (--verify). Safe to share between worker threads.
+    """
+
+    def __init__(self, destination_dir):
+        self.path = os.path.join(destination_dir, CATALOG_NAME)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " source_path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " date TEXT,"
+            " destination_path TEXT,"
+            " destination_size INTEGER)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]
+        if 'destination_size' not in columns:
+            # 旧版目录没有这一列，旧记录只检查归档文件是否存在
+            self._conn.execute("ALTER TABLE files ADD COLUMN destination_size INTEGER")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS files_destination ON files (destination_path)")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_unchanged(self, source_path, size, mtime):
+        """ True if source_path was backed up with the same size and mtime
+
+        and its archived file is still there, with the size it had then; a
+        deleted or truncated archive file gets the source copied again.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, destination_path, destination_size FROM files"
+                " WHERE source_path = ?", (os.path.abspath(source_path),)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime or row[2] is None:
+            return False
+        try:
+            destination_size = os.path.getsize(row[2])
+        except OSError:
+            return False
+        return row[3] is None or destination_size == row[3]
+
+    def get(self, source_path):
+        """return the catalog row of source_path as a dict, or None"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT source_path, size, mtime, date, destination_path,"
+                " destination_size FROM files WHERE source_path = ?",
+                (os.path.abspath(source_path),))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def record(self, source_path, size, mtime, date, destination_path):
+        """insert or update the row of source_path"""
+        try:
+            destination_size = os.path.getsize(destination_path)
+        except (OSError, TypeError):
+            destination_size = None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files"
+                " (source_path, size, mtime, date, destination_path, destination_size)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(source_path), size, mtime, date,
+                 destination_path and os.path.abspath(destination_path), destination_size))
+            self._count_write()
+
+    def retarget(self, destination_path, new_destination_path):
+        """ Point the rows of a removed archived file at the file replacing it
+
+        Used when duplicates in the archive are collapsed, so the sources
+        recorded against the removed file are not copied back.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET destination_path = ?, destination_size = ?"
+                " WHERE destination_path = ?",
+                (os.path.abspath(new_destination_path), os.path.getsize(new_destination_path),
+                 os.path.abspath(destination_path)))
+            self._count_write()
+
+    def _count_write(self):
+        """commit every COMMIT_INTERVAL writes; call with the lock held"""
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        """commit pending rows and close the database"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 18:47:20
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 18:47:20
+ * @Description  : single-pass date inference from file and folder names
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import datetime
+import functools
+import os
+import re
+import time
+
+# 目录名日期的缓存大小
+DIRECTORY_CACHE_SIZE = 4096
+# 毫秒时间戳只接受这个日期之后的值，13 位数字更常见的是各种编号
+EPOCH_FIRST_DATE = datetime.date(2001, 9, 9)
+
+# 一次扫描同时匹配：
+#   20160326 / 2016-03-26 / 2016_03_26 / 2016.03.26，年份 19xx 或 20xx，
+#   分隔符必须前后一致，后面可以紧跟序号（如 20100606139.jpg）；
+#   覆盖 IMG_20160326_082056、IMG-20200101-WA0001 (WhatsApp)、
+#   PXL_/VID_/Screenshot_ (Android)、2011-08-01 11.42.16 (iOS 导出)；
+#   mmexport1596012345678 / wx_camera_1596012345678 (微信) 等 13 位毫秒时间戳。
+DATE_PATTERN = re.compile(
+    r"(?<!\d)(?:"
+    r"(?P<year>(?:19|20)\d{2})(?P<sep>[-_.]?)"
+    r"(?P<month>0[1-9]|1[0-2])(?P=sep)(?P<day>0[1-9]|[12]\d|3[01])"
+    r"|(?P<epoch>1\d{12})(?!\d))")
+
+
+def _epoch_date(value):
+    """the local date of a millisecond timestamp, or None if implausible"""
+    seconds = int(value) / 1000
+    if seconds > time.time():
+        return None
+    date = datetime.date.fromtimestamp(seconds)
+    return date if date >= EPOCH_FIRST_DATE else None
+
+
+def parse_date(text):
+    """ Find the first real calendar date in a file or folder name
+
+    Args:
+        text (str): file or folder name
+
+    Returns:
+        str: date formatted as YYYY-MM-DD, or None
+    """
+    position = 0
+    while True:
+        match = DATE_PATTERN.search(text, position)
+        if match is None:
+            return None
+        year, month, day, epoch = match.group('year', 'month', 'day', 'epoch')
+        if epoch is not None:
+            date = _epoch_date(epoch)
+            if date is not None:
+                return date.isoformat()
+        elif day <= '28':
+            # 每个月都有 1-28 日，不必再构造日期校验
+            return f"{year}-{month}-{day}"
+        else:
+            try:
+                return datetime.date(int(year), int(month), int(day)).isoformat()
+            except ValueError:
+                # 2021-02-30 这类不存在的日期
+                pass
+        position = match.start() + 1
+
+
+@functools.lru_cache(maxsize=DIRECTORY_CACHE_SIZE)
+def parse_directory_date(directory):
+    """ The date in the name of directory, parsed once per directory
+
+    Args:
+        directory (str): folder path
+
+    Returns:
+        str: date formatted as YYYY-MM-DD, or None
+    """
+    return parse_date(os.path.basename(directory))
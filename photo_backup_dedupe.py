@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 12:05:52
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 12:05:52
+ * @Description  : content-addressed deduplication across the destination tree
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import os
+import threading
+
+import photo_backup_manifest
+import photo_backup_thumbnails
+import photo_backup_utils
+from photo_backup_catalog import CATALOG_NAME, Catalog
+from photo_backup_hash import (HASH_STATS, PARTIAL_SIZE, middle_digest,
+                               partial_digest)
+from photo_backup_memory import BUDGET, SpillDict
+
+# 按文件大小分段的锁数量
+SIZE_LOCK_STRIPES = 64
+
+
+def iter_archive_files(destination_dir):
+    """yield (path, stat) of every archived file, skipping hidden bookkeeping files"""
+    for root, dirs, files in os.walk(destination_dir):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for file in files:
+            if file.startswith('.'):
+                continue
+            path = os.path.join(root, file)
+            try:
+                yield path, os.stat(path)
+            except OSError as e:
+                print(e)
+
+
+class SourceDigests:
+    """ Digests of source files, shared by the DestinationIndex of several destinations
+
+    Args:
+        max_items (int): entries kept in memory before spilling
+    """
+
+    def __init__(self, max_items=None):
+        self._digests = SpillDict(max_items)
+        self._locks = [threading.Lock() for _ in range(SIZE_LOCK_STRIPES)]
+
+    def get(self, key, function, *args):
+        """the cached digest of key, computing it once as function(*args)"""
+        # 两个目标同时查同一个文件时，后来的等前一个算完
+        with self._locks[hash(key) % SIZE_LOCK_STRIPES]:
+            digest = self._digests.get(key)
+            if digest is None:
+                digest = function(*args)
+                self._digests[key] = digest
+        return digest
+
+    def close(self):
+        """drop the digests"""
+        self._digests.close()
+
+
+class DestinationIndex:
+    """ Index of every file in the destination, keyed by size then by content hash
+
+    The tree is scanned once, lazily, on the first lookup. Candidates are
+    narrowed by size, then by a head/tail hash, and only the survivors get
+    the rest of their bytes hashed; each stage is computed at most once per
+    file per run.
+    Indexes of several destinations can share one SourceDigests, so a
+    source file is hashed once for all of them.
+    """
+
+    def __init__(self, destination_dir, algorithm=None, source_digests=None):
+        self.destination_dir = destination_dir
+        self.algorithm = algorithm
+        self._sources = source_digests
+        self._lock = threading.Lock()
+        self._size_locks = [threading.Lock() for _ in range(SIZE_LOCK_STRIPES)]
+        self._by_size = None
+        # 有内存预算时，超出的条目溢写到目标目录下的临时文件
+        self._partial = SpillDict(BUDGET.max_entries(0.2), destination_dir)
+        self._middle = SpillDict(BUDGET.max_entries(0.2), destination_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        if self._by_size is None:
+            by_size = SpillDict(BUDGET.max_entries(0.4), self.destination_dir)
+            for path, stat in iter_archive_files(self.destination_dir):
+                _append(by_size, stat.st_size, path)
+            self._by_size = by_size
+
+    def _cached(self, cache, path, function, *args):
+        with self._lock:
+            digest = cache.get(path)
+        if digest is None:
+            digest = function(path, *args)
+            with self._lock:
+                cache[path] = digest
+        return digest
+
+    def _partial_digest(self, path, size):
+        return self._cached(self._partial, path, partial_digest,
+                            size, self.algorithm)
+
+    def _middle_digest(self, path, size):
+        return self._cached(self._middle, path, middle_digest, size, self.algorithm)
+
+    def _source_digest(self, stage, file_path, function, *args):
+        if self._sources is None:
+            return function(file_path, *args)
+        return self._sources.get(f'{stage}:{self.algorithm}:{file_path}', function,
+                                 file_path, *args)
+
+    def size_lock(self, size):
+        """lock serialising lookup-then-add for files of one size"""
+        return self._size_locks[size % SIZE_LOCK_STRIPES]
+
+    def find(self, file_path, size=None):
+        """ Return an archived file with the same content as file_path
+
+        Args:
+            file_path (str): file to look up
+            size (int): size of file_path, if already known
+
+        Returns:
+            str: path of the identical archived file, or None
+        """
+        if size is None:
+            size = os.path.getsize(file_path)
+        with self._lock:
+            self._load()
+            candidates = list(self._by_size.get(size, ()))
+        if not candidates:
+            return None
+        source_partial = self._source_digest('partial', file_path, partial_digest,
+                                             size, self.algorithm)
+        source_middle = None
+        for candidate in candidates:
+            HASH_STATS.add_comparison(size)
+            try:
+                if self._partial_digest(candidate, size) != source_partial:
+                    continue
+                if size <= 2 * PARTIAL_SIZE:
+                    return candidate
+                if source_middle is None:
+                    source_middle = self._source_digest('middle', file_path, middle_digest,
+                                                        size, self.algorithm)
+                if self._middle_digest(candidate, size) == source_middle:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def add(self, path, size=None):
+        """register a file just written into the destination"""
+        if size is None:
+            size = os.path.getsize(path)
+        with self._lock:
+            self._load()
+            _append(self._by_size, size, path)
+
+    def close(self):
+        """drop the index and its spill files"""
+        with self._lock:
+            if self._by_size is not None:
+                self._by_size.close()
+                self._by_size = None
+            self._partial.close()
+            self._middle.close()
+
+
+def _append(by_size, size, path):
+    """add path to the paths of size; values are tuples so they can spill to disk"""
+    paths = by_size.get(size)
+    by_size[size] = paths + (path,) if paths else (path,)
+
+
+def _group_by(paths, key):
+    """split paths into lists sharing key(path), dropping unreadable files"""
+    groups = {}
+    for path in paths:
+        try:
+            groups.setdefault(key(path), []).append(path)
+        except OSError as e:
+            print(e)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _forget_duplicate(duplicate, keep, link, catalog, manifest):
+    """update the catalog and the manifest for a duplicate collapsed into keep"""
+    if catalog is not None and not link:
+        catalog.retarget(duplicate, keep)
+    if manifest is not None:
+        row = manifest.get(duplicate)
+        if row is not None and keep not in manifest:
+            manifest.record(keep, row['digest'], row['algorithm'])
+        manifest.remove(duplicate)
+        if link:
+            # 硬链接与保留的文件共用 mtime，按保留文件的记录重新登记
+            manifest.link(keep, duplicate)
+
+
+def dedupe_existing(destination_dir, link=False):
+    """ Collapse byte-identical files already in the destination
+
+    In each group of identical files the first path in sorted order is kept;
+    the others are removed, or replaced by hard links to it when link is True.
+    Catalog rows of removed files are pointed at the kept file, so an
+    incremental run does not copy them back; the manifest and the
+    thumbnail index are updated the same way.
+
+    Args:
+        destination_dir (str): destination directory
+        link (bool): hard-link duplicates instead of deleting them
+
+    Returns:
+        tuple: (number of duplicates collapsed, bytes reclaimed)
+    """
+    photo_backup_utils.validate_folder_path(destination_dir)
+    by_size = {}
+    for path, stat in iter_archive_files(destination_dir):
+        by_size.setdefault(stat.st_size, []).append((path, stat))
+
+    catalog = Catalog(destination_dir) \
+        if os.path.exists(os.path.join(destination_dir, CATALOG_NAME)) else None
+    manifest = photo_backup_manifest.Manifest(destination_dir) \
+        if os.path.exists(os.path.join(destination_dir, photo_backup_manifest.MANIFEST_NAME)) \
+        else None
+    try:
+        collapsed, reclaimed, moves = _collapse(by_size, link, catalog, manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if catalog is not None:
+            catalog.close()
+    photo_backup_thumbnails.retarget_index(destination_dir, moves)
+    print(f"{collapsed} duplicates collapsed, {reclaimed} bytes reclaimed")
+    print(HASH_STATS.summary())
+    return collapsed, reclaimed
+
+
+def _collapse(by_size, link, catalog, manifest):
+    """collapse the groups of identical files; return (collapsed, reclaimed, removed pairs)"""
+    collapsed = 0
+    reclaimed = 0
+    moves = []
+    for size, entries in by_size.items():
+        if len(entries) < 2:
+            continue
+        paths = []
+        seen_inodes = set()
+        for path, stat in sorted(entries):
+            inode = (stat.st_dev, stat.st_ino)
+            if inode in seen_inodes:
+                # 已经是硬链接
+                continue
+            seen_inodes.add(inode)
+            paths.append(path)
+        if len(paths) < 2:
+            continue
+        HASH_STATS.add_comparison(size, len(paths))
+        groups = _group_by(paths, lambda path: partial_digest(path, size))
+        if size > 2 * PARTIAL_SIZE:
+            groups = [group for paths in groups
+                      for group in _group_by(paths, lambda path: middle_digest(path, size))]
+        for paths in groups:
+            keep = paths[0]
+            for duplicate in paths[1:]:
+                try:
+                    if link:
+                        temp_path = os.path.join(
+                            os.path.dirname(duplicate),
+                            f".{os.path.basename(duplicate)}.link")
+                        os.link(keep, temp_path)
+                        os.replace(temp_path, duplicate)
+                    else:
+                        os.remove(duplicate)
+                except OSError as e:
+                    print(e)
+                    continue
+                print(f"{duplicate} is a duplicate of {keep}")
+                _forget_duplicate(duplicate, keep, link, catalog, manifest)
+                if not link:
+                    moves.append((duplicate, keep))
+                collapsed += 1
+                reclaimed += size
+    return collapsed, reclaimed, moves
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 17:26:14
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 17:26:14
+ * @Description  : structured backup events and pluggable sinks
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# 事件类型
+FILE_SCANNED = 'file_scanned'
+DATE_RESOLVED = 'date_resolved'
+COPIED = 'copied'
+RENAMED = 'renamed'
+LINKED = 'linked'
+DUPLICATE_SKIPPED = 'duplicate_skipped'
+NEAR_DUPLICATE = 'near_duplicate'
+NEAR_DUPLICATE_SKIPPED = 'near_duplicate_skipped'
+UNCHANGED_SKIPPED = 'unchanged_skipped'
+WARNING = 'warning'
+ERROR = 'error'
+# 日期来源，对应 DATE_RESOLVED 事件的 source 字段
+DATE_SOURCES = ('exif', 'filename', 'parent', 'default')
+
+
+class EventStream:
+    """ Fan out backup events to sinks
+
+    A sink is any callable taking one event dict. Every event has 'event'
+    (the kind), 'path' and 'time' keys plus kind-specific fields. The stream
+    also carries the cancel flag of the run. Sinks are called on the worker
+    threads and must be thread-safe.
+    """
+
+    def __init__(self, sinks=(), cancel_event=None):
+        self._sinks = list(sinks)
+        self.cancel_event = cancel_event
+
+    def add_sink(self, sink):
+        """start sending events to sink"""
+        self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink):
+        """stop sending events to sink"""
+        self._sinks = [item for item in self._sinks if item is not sink]
+
+    @contextlib.contextmanager
+    def attach(self, sink):
+        """send events to sink for the duration of a with block"""
+        self.add_sink(sink)
+        try:
+            yield sink
+        finally:
+            self.remove_sink(sink)
+
+    def emit(self, kind, path=None, **fields):
+        """send one event to every sink"""
+        event = {'event': kind, 'path': path, 'time': time.time()}
+        event.update(fields)
+        self(event)
+
+    def __call__(self, event):
+        """send an already built event to every sink, so a stream can feed another"""
+        for sink in self._sinks:
+            sink(event)
+
+    def cancelled(self):
+        """return True once the run has been asked to stop"""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def close(self):
+        """close every sink that has a close() method"""
+        for sink in self._sinks:
+            close = getattr(sink, 'close', None)
+            if close is not None:
+                close()
+
+
+class CounterSink:
+    """counts events quietly; snapshot() gives the totals of the run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.dates = dict.fromkeys(DATE_SOURCES, 0)
+        self.bytes_copied = 0
+
+    def __call__(self, event):
+        kind = event['event']
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if kind in (COPIED, RENAMED, LINKED):
+                self.bytes_copied += event.get('size') or 0
+            elif kind == DATE_RESOLVED:
+                self.dates[event['source']] += 1
+
+    @property
+    def copied(self):
+        """files copied, renamed or linked into the destination"""
+        return sum(self.counts.get(kind, 0) for kind in (COPIED, RENAMED, LINKED))
+
+    def snapshot(self):
+        """the totals as a dict"""
+        with self._lock:
+            counts = dict(self.counts)
+            dates = dict(self.dates)
+            bytes_copied = self.bytes_copied
+        return {'scanned': counts.get(FILE_SCANNED, 0),
+                'copied': sum(counts.get(kind, 0) for kind in (COPIED, RENAMED, LINKED)),
+                'renamed': counts.get(RENAMED, 0),
+                'linked': counts.get(LINKED, 0),
+                'duplicates': counts.get(DUPLICATE_SKIPPED, 0),
+                'near_duplicates': counts.get(NEAR_DUPLICATE, 0)
+                + counts.get(NEAR_DUPLICATE_SKIPPED, 0),
+                'skipped': counts.get(UNCHANGED_SKIPPED, 0),
+                'warnings': counts.get(WARNING, 0),
+                'errors': counts.get(ERROR, 0),
+                'bytes_copied': bytes_copied,
+                'dates': dates}
+
+
+class ProgressBarSink(CounterSink):
+    """ single-line TTY progress display, redrawn at most every interval seconds """
+
+    def __init__(self, stream=None, interval=0.2):
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last_draw = 0.0
+        self._drawn = False
+
+    def __call__(self, event):
+        super().__call__(event)
+        now = time.monotonic()
+        if now - self._last_draw >= self.interval:
+            self._last_draw = now
+            self.draw()
+
+    def draw(self):
+        """write the current counters over the previous line"""
+        if not self.stream.isatty():
+            return
+        snapshot = self.snapshot()
+        elapsed = max(time.monotonic() - self._start, 1e-6)
+        rate = snapshot['bytes_copied'] / elapsed / 1024 / 1024
+        self.stream.write(
+            f"\rscanned {snapshot['scanned']}  copied {snapshot['copied']}  "
+            f"duplicates {snapshot['duplicates']}  skipped {snapshot['skipped']}  "
+            f"errors {snapshot['errors']}  {rate:.1f} MB/s ")
+        self.stream.flush()
+        self._drawn = True
+
+    def close(self):
+        """draw the final counters and end the line"""
+        self.draw()
+        if self._drawn:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class JsonlSink:
+    """writes one JSON object per event to a file"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        """flush and close the log file"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class PrintSink:
+    """the old per-file console messages, for --verbose"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        kind = event['event']
+        path = event['path']
+        if kind == DATE_RESOLVED:
+            message = f"{path} : date {event['date']} from {event['source']}"
+        elif kind in (COPIED, RENAMED, LINKED):
+            message = f"{path} : {kind} to {event['destination']}"
+        elif kind == DUPLICATE_SKIPPED:
+            message = f"{path} : is already exist in {event['destination']}"
+        elif kind in (NEAR_DUPLICATE, NEAR_DUPLICATE_SKIPPED):
+            action = 'skipped' if kind == NEAR_DUPLICATE_SKIPPED else 'copied anyway'
+            message = (f"{path} : looks like {event['destination']} "
+                       f"(distance {event['distance']}), {action}")
+        elif kind in (WARNING, ERROR):
+            message = f"{path} : {kind} {event['error']}"
+        else:
+            return
+        with self._lock:
+            print(message)
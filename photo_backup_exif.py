@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 10:41:17
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 10:41:17
+ * @Description  : lightweight EXIF header reader for JPEG/TIFF/HEIC
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import io
+import re
+import struct
+
+# Exif 标签编号
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME = 0x0132
+DATE_TIME_DIGITIZED = 0x9004
+EXIF_IFD_POINTER = 0x8769
+MAKE = 0x010F
+ORIENTATION = 0x0112
+IMAGE_WIDTH = 0x0100
+IMAGE_LENGTH = 0x0101
+PIXEL_X_DIMENSION = 0xA002
+PIXEL_Y_DIMENSION = 0xA003
+# 按优先级排列的日期标签
+DATE_TAGS = (DATE_TIME_ORIGINAL, DATE_TIME, DATE_TIME_DIGITIZED)
+
+# 单个 IFD 最多允许的条目数，超出说明文件已损坏
+MAX_IFD_ENTRIES = 1024
+# TIFF 字段类型对应的字节数
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8}
+_DATE_PATTERN = re.compile(r"\d{4}:\d{2}:\d{2}")
+# 可以作为照片日期的 Exif 值
+_PHOTO_DATE_PATTERN = re.compile(r"20\d{2}:\d{2}:\d{2}")
+
+
+class ExifFormatError(ValueError):
+    """the file is not a container this reader understands"""
+
+
+def _read_value(fp, base, end, order, field_type, count, raw):
+    """decode one IFD entry value; end is the size of the TIFF data"""
+    size = _TYPE_SIZES.get(field_type, 1) * count
+    if size > 4:
+        offset = struct.unpack(order + 'I', raw)[0]
+        # count 来自文件本身，先核对剩余字节数，再读取或解包
+        if base + offset + size > end:
+            raise ExifFormatError("IFD value runs past the end of the data")
+        fp.seek(base + offset)
+        raw = fp.read(size)
+        if len(raw) < size:
+            raise ExifFormatError("truncated IFD value")
+    if field_type == 2:
+        return raw[:count].split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+    if field_type == 3:
+        values = struct.unpack(f'{order}{count}H', raw[:2 * count])
+    elif field_type == 4:
+        values = struct.unpack(f'{order}{count}I', raw[:4 * count])
+    else:
+        return raw[:size]
+    return values[0] if count == 1 else values
+
+
+def _read_ifd(fp, base, end, order, offset, tags):
+    """read the wanted tags of the IFD at offset, return (values, exif_ifd_offset)"""
+    fp.seek(base + offset)
+    head = fp.read(2)
+    if len(head) < 2:
+        raise ExifFormatError("truncated IFD")
+    count = struct.unpack(order + 'H', head)[0]
+    if count > MAX_IFD_ENTRIES:
+        raise ExifFormatError("corrupt IFD")
+    entries = fp.read(12 * count)
+    values = {}
+    exif_offset = None
+    for index in range(0, len(entries) - 11, 12):
+        tag, field_type, value_count = struct.unpack(
+            order + 'HHI', entries[index:index + 8])
+        raw = entries[index + 8:index + 12]
+        if tag == EXIF_IFD_POINTER:
+            exif_offset = struct.unpack(order + 'I', raw)[0]
+        elif tag in tags:
+            values[tag] = (field_type, value_count, raw)
+    return {tag: _read_value(fp, base, end, order, *entry)
+            for tag, entry in values.items()}, exif_offset
+
+
+def _read_tiff_tags(fp, base, tags):
+    """read tags from IFD0 and the Exif IFD of the TIFF structure at base"""
+    fp.seek(base)
+    header = fp.read(8)
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        raise ExifFormatError("bad TIFF byte order")
+    magic, ifd0 = struct.unpack(order + 'HI', header[2:8])
+    if magic != 42:
+        raise ExifFormatError("bad TIFF magic")
+    end = fp.seek(0, io.SEEK_END)
+    values, exif_offset = _read_ifd(fp, base, end, order, ifd0, tags)
+    if exif_offset:
+        exif_values, _ = _read_ifd(fp, base, end, order, exif_offset, tags)
+        values.update(exif_values)
+    return values
+
+
+def _find_jpeg_app1(fp):
+    """return the TIFF payload of the Exif APP1 segment, or None"""
+    if fp.read(2) != b'\xff\xd8':
+        raise ExifFormatError("not a JPEG")
+    while True:
+        byte = fp.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            raise ExifFormatError("bad JPEG marker")
+        marker = fp.read(1)
+        while marker == b'\xff':
+            marker = fp.read(1)
+        if not marker or marker in (b'\xda', b'\xd9'):
+            # 到达图像数据，之后不会再有 Exif
+            return None
+        if b'\xd0' <= marker <= b'\xd7' or marker == b'\x01':
+            continue
+        length = struct.unpack('>H', fp.read(2))[0]
+        if marker == b'\xe1':
+            segment = fp.read(length - 2)
+            if segment.startswith(b'Exif\0\0'):
+                return segment[6:]
+        else:
+            fp.seek(length - 2, io.SEEK_CUR)
+
+
+def _iter_boxes(data, start=0, end=None):
+    """yield (type, payload start, payload end) of ISO BMFF boxes in data"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ExifFormatError("bad box size")
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _read_uint(data, offset, size):
+    """read a big-endian unsigned int of 0, 4 or 8 bytes"""
+    if size == 0:
+        return 0, offset
+    fmt = {2: '>H', 4: '>I', 8: '>Q'}.get(size)
+    if fmt is None:
+        raise ExifFormatError("bad iloc field size")
+    return struct.unpack(fmt, data[offset:offset + size])[0], offset + size
+
+
+def _find_heif_exif_item(meta, start, end):
+    """return (offset, length) of the Exif item described by a meta box"""
+    exif_id = None
+    locations = {}
+    for box_type, box_start, box_end in _iter_boxes(meta, start + 4, end):
+        if box_type == b'iinf':
+            version = meta[box_start]
+            first = box_start + (6 if version == 0 else 8)
+            for infe_type, infe_start, _ in _iter_boxes(meta, first, box_end):
+                infe_version = meta[infe_start] if infe_type == b'infe' else 0
+                if infe_version < 2:
+                    continue
+                id_size = 2 if infe_version == 2 else 4
+                item_id, _ = _read_uint(meta, infe_start + 4, id_size)
+                item_type = meta[infe_start + 4 + id_size + 2:
+                                 infe_start + 4 + id_size + 6]
+                if item_type == b'Exif':
+                    exif_id = item_id
+        elif box_type == b'iloc':
+            version = meta[box_start]
+            offset_size = meta[box_start + 4] >> 4
+            length_size = meta[box_start + 4] & 0x0f
+            base_offset_size = meta[box_start + 5] >> 4
+            index_size = meta[box_start + 5] & 0x0f if version in (1, 2) else 0
+            pos = box_start + 6
+            item_count, pos = _read_uint(meta, pos, 2 if version < 2 else 4)
+            for _ in range(item_count):
+                item_id, pos = _read_uint(meta, pos, 2 if version < 2 else 4)
+                method = 0
+                if version in (1, 2):
+                    method = struct.unpack('>H', meta[pos:pos + 2])[0] & 0x0f
+                    pos += 2
+                pos += 2  # data_reference_index
+                base_offset, pos = _read_uint(meta, pos, base_offset_size)
+                extent_count, pos = _read_uint(meta, pos, 2)
+                extents = []
+                for _ in range(extent_count):
+                    _, pos = _read_uint(meta, pos, index_size)
+                    extent_offset, pos = _read_uint(meta, pos, offset_size)
+                    extent_length, pos = _read_uint(meta, pos, length_size)
+                    extents.append((base_offset + extent_offset, extent_length))
+                if method == 0 and extents:
+                    locations[item_id] = extents[0]
+    if exif_id is None:
+        return None
+    if exif_id not in locations:
+        raise ExifFormatError("Exif item is not stored in the file")
+    return locations[exif_id]
+
+
+def _find_heif_exif(fp):
+    """return the TIFF payload of the Exif item of a HEIF/HEIC/AVIF file, or None"""
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', fp.read(8))[0]
+            header_size = 16
+        if box_type == b'meta':
+            if size == 0:
+                raise ExifFormatError("unbounded meta box")
+            meta = fp.read(size - header_size)
+            location = _find_heif_exif_item(meta, 0, len(meta))
+            if location is None:
+                return None
+            offset, length = location
+            fp.seek(offset)
+            item = fp.read(length)
+            # Exif 数据块以 4 字节的 TIFF 头偏移开头
+            tiff_offset = struct.unpack('>I', item[:4])[0]
+            return item[4 + tiff_offset:]
+        if size == 0 or size < header_size:
+            return None
+        fp.seek(size - header_size, io.SEEK_CUR)
+
+
+def read_exif_tags(file_path, tags):
+    """ Read EXIF tags from the file header without decoding the image
+
+    Only IFD0 and the Exif IFD are visited, and only the bytes they point to
+    are read; MakerNote and the pixel payload are never touched.
+
+    Args:
+        file_path (str): JPEG, TIFF or HEIF/HEIC file
+        tags (iterable): numeric tag ids to read
+
+    Raises:
+        ExifFormatError: the file is not a JPEG/TIFF/HEIF container or is corrupt
+
+    Returns:
+        dict: tag id -> value for the tags present in the file
+    """
+    tags = frozenset(tags)
+    with open(file_path, 'rb') as fp:
+        head = fp.read(12)
+        fp.seek(0)
+        try:
+            if head[:2] == b'\xff\xd8':
+                payload = _find_jpeg_app1(fp)
+            elif head[:4] in (b'II*\0', b'MM\0*'):
+                return _read_tiff_tags(fp, 0, tags)
+            elif head[4:8] == b'ftyp':
+                payload = _find_heif_exif(fp)
+            else:
+                raise ExifFormatError("unsupported file format")
+        except (struct.error, IndexError) as e:
+            raise ExifFormatError(f"corrupt header: {e}") from e
+    if not payload:
+        return {}
+    try:
+        return _read_tiff_tags(io.BytesIO(payload), 0, tags)
+    except (struct.error, IndexError) as e:
+        raise ExifFormatError(f"corrupt Exif: {e}") from e
+
+
+def read_exif_date(file_path):
+    """ Read the capture date: DateTimeOriginal, then DateTime, then DateTimeDigitized
+
+    Args:
+        file_path (str): JPEG, TIFF or HEIF/HEIC file
+
+    Raises:
+        ExifFormatError: the file is not a JPEG/TIFF/HEIF container or is corrupt
+
+    Returns:
+        str: raw EXIF value like '2016:03:26 08:13:18', or None
+    """
+    return pick_exif_date(read_exif_tags(file_path, DATE_TAGS))
+
+
+def pick_exif_date(values):
+    """the first usable date of DATE_TAGS in a read_exif_tags result, or None"""
+    for tag in DATE_TAGS:
+        value = values.get(tag)
+        if isinstance(value, str) and _DATE_PATTERN.match(value) \
+                and not value.startswith('0000'):
+            return value
+    return None
+
+
+def format_exif_date(value):
+    """ turn an EXIF value like 2011:11:22 10:00:00 into 2011-11-22, or None """
+    # check if the value is like 2011:11:22
+    if isinstance(value, str) and _PHOTO_DATE_PATTERN.match(value):
+        return value.split(' ')[0].replace(':', '-')
+    return None
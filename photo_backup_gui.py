@@ -10,11 +10,29 @@
  * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
 """
 
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 
+import photo_backup_events
+import photo_backup_pipeline
+import photo_backup_scan
 import photo_backup_utils
 
+# 界面轮询后台进度的间隔（毫秒）
+POLL_INTERVAL_MS = 100
+# 后台线程最多每隔多少秒发送一次进度
+REPORT_INTERVAL = 0.1
+
+# 后台线程发给界面的消息队列
+messages = queue.Queue()
+# 取消备份的信号
+cancel_event = threading.Event()
+# 当前备份的开始时间和待处理总量
+run_state = {'start': 0.0, 'total_files': 0, 'total_bytes': 0}
+
 
 def select_source_directory():
     """选择源路径"""
@@ -30,17 +48,124 @@ def select_destination_directory():
     destination_entry.insert(tk.END, destination_path)  # 将选择的目标路径显示在输入框中
 
 
+def run_backup(source_folder, destination_folder, selected_types):
+    """后台线程：先扫描一遍源目录得到总量，再用同一份扫描结果备份，进度通过 messages 发回界面"""
+    try:
+        counter = photo_backup_events.CounterSink()
+        last_report = [0.0]
+
+        def report(event):
+            now = time.monotonic()
+            if now - last_report[0] >= REPORT_INTERVAL:
+                last_report[0] = now
+                messages.put(('progress', counter.snapshot()))
+
+        events = photo_backup_events.EventStream((counter, report), cancel_event)
+        sources = []
+        for source in photo_backup_scan.scan_source(source_folder, selected_types,
+                                                    events=events):
+            if cancel_event.is_set():
+                break
+            sources.append(source)
+        messages.put(('total', (len(sources), sum(source.size for source in sources))))
+
+        # 引擎直接使用这份扫描结果，不再遍历一次源目录
+        photo_backup_pipeline.copy_photos_by_date_parallel(
+            source_folder, destination_folder, selected_types, events=events,
+            sources=sources)
+        messages.put(('done', counter.snapshot()))
+    except Exception as e:
+        messages.put(('error', str(e)))
+
+
+def show_progress(snapshot):
+    """更新进度条、吞吐量和剩余时间"""
+    handled = (snapshot['copied'] + snapshot['duplicates']
+               + snapshot['skipped'] + snapshot['errors'])
+    total = run_state['total_files']
+    progress_bar['value'] = handled * 100 / total if total else 0
+    elapsed = max(time.monotonic() - run_state['start'], 1e-6)
+    rate = snapshot['bytes_copied'] / elapsed / 1024 / 1024
+    eta = (total - handled) * elapsed / handled if handled else 0
+    status_var.set(
+        f"已扫描 {snapshot['scanned']}/{total}  已复制 {snapshot['copied']}  "
+        f"跳过 {snapshot['duplicates'] + snapshot['skipped']}  错误 {snapshot['errors']}  "
+        f"{rate:.1f} MB/s  剩余约 {int(eta)} 秒")
+
+
+def poll_events():
+    """在 Tk 主线程中处理后台线程发来的消息"""
+    finished = None
+    try:
+        while True:
+            kind, payload = messages.get_nowait()
+            if kind == 'total':
+                run_state['total_files'], run_state['total_bytes'] = payload
+                # 吞吐量和剩余时间只按复制阶段计时，不含扫描
+                run_state['start'] = time.monotonic()
+            elif kind == 'progress':
+                show_progress(payload)
+            else:
+                finished = (kind, payload)
+    except queue.Empty:
+        pass
+    if finished is None:
+        window.after(POLL_INTERVAL_MS, poll_events)
+        return
+
+    start_backup_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
+    kind, payload = finished
+    if kind == 'error':
+        status_var.set("备份失败")
+        messagebox.showerror("备份失败", payload)
+        return
+    show_progress(payload)
+    if cancel_event.is_set():
+        messagebox.showinfo("备份已取消", f"已复制 {payload['copied']} 个文件。")
+    else:
+        progress_bar['value'] = 100
+        messagebox.showinfo("备份完成", "照片备份已完成！")
+
+
 def start_backup():
     """开始备份"""
     source_folder = source_entry.get()  # 获取用户输入的原路径
     destination_folder = destination_entry.get()  # 获取用户输入的目标路径
 
-    selected_types = [jpg_var.get(), bmp_var.get(),
-                      png_var.get(), tif_var.get()]
-
-    photo_backup_utils.copy_photos_by_date(
-        source_folder, destination_folder, selected_types)
-    messagebox.showinfo("备份完成", "照片备份已完成！")
+    selected_types = []
+    for var, suffixes in ((jpg_var, ('.jpg', '.jpeg')),
+                          (bmp_var, ('.bmp',)),
+                          (png_var, ('.png',)),
+                          (tif_var, ('.tif', '.tiff'))):
+        if var.get():
+            selected_types.extend(suffixes)
+    if not selected_types:
+        messagebox.showwarning("提示", "请选择要备份的文件类型")
+        return
+    try:
+        photo_backup_utils.validate_folder_path(source_folder)
+        photo_backup_utils.validate_folder_path(destination_folder)
+    except ValueError as e:
+        messagebox.showerror("路径错误", str(e))
+        return
+
+    cancel_event.clear()
+    run_state.update(start=time.monotonic(), total_files=0, total_bytes=0)
+    progress_bar['value'] = 0
+    status_var.set("正在统计文件…")
+    start_backup_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    threading.Thread(target=run_backup, daemon=True,
+                     args=(source_folder, destination_folder, selected_types)).start()
+    window.after(POLL_INTERVAL_MS, poll_events)
+
+
+def cancel_backup():
+    """取消备份，当前文件处理完后停止"""
+    cancel_event.set()
+    cancel_button.config(state=tk.DISABLED)
+    status_var.set("正在取消…")
 
 
 # 创建主窗口
@@ -85,6 +210,15 @@ tk.Label(window, height=2).pack()
 # 创建开始备份按钮，换行显示
 start_backup_button = tk.Button(window, text="开始备份", command=start_backup)
 start_backup_button.pack(side=tk.LEFT)
+cancel_button = tk.Button(window, text="取消", command=cancel_backup,
+                          state=tk.DISABLED)
+cancel_button.pack(side=tk.LEFT)
+
+# 进度条和状态信息
+progress_bar = ttk.Progressbar(window, length=400, maximum=100)
+progress_bar.pack(fill=tk.X, padx=5, pady=5)
+status_var = tk.StringVar()
+tk.Label(window, textvariable=status_var).pack()
 
 
 # 运行GUI主循环
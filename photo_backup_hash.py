@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 13:10:24
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 13:10:24
+ * @Description  : staged size -> partial hash -> full hash file comparison
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import hashlib
+import os
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 全量哈希时每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+# 部分哈希读取的文件头、文件尾大小
+PARTIAL_SIZE = 64 * 1024
+# 默认哈希算法：有 xxhash 时使用 xxh3_128，否则使用 blake2b
+DEFAULT_ALGORITHM = 'xxh3' if xxhash is not None else 'blake2b'
+# 命令行可选的哈希算法，xxh3 仅在装有 xxhash 时提供
+ALGORITHMS = (('xxh3',) if xxhash is not None else ()) + ('blake2b', 'md5')
+
+
+class HashStats:
+    """bytes read by hashing versus bytes of the files that were compared"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_read = 0
+        self.bytes_compared = 0
+        self.comparisons = 0
+
+    def add_read(self, count):
+        """count bytes read from disk for hashing"""
+        with self._lock:
+            self.bytes_read += count
+
+    def add_comparison(self, size, files=2):
+        """count one comparison between files of size bytes each"""
+        with self._lock:
+            self.comparisons += 1
+            self.bytes_compared += files * size
+
+    def reset(self):
+        """zero every counter"""
+        with self._lock:
+            self.bytes_read = 0
+            self.bytes_compared = 0
+            self.comparisons = 0
+
+    def summary(self):
+        """one-line report"""
+        return (f"{self.comparisons} comparisons read {self.bytes_read} "
+                f"of {self.bytes_compared} bytes")
+
+
+# 全局统计，供命令行在运行结束时输出
+HASH_STATS = HashStats()
+
+
+def new_hash(algorithm=None):
+    """ Create a hash object
+
+    Args:
+        algorithm (str): 'xxh3', 'blake2b', 'md5' or any hashlib name
+
+    Returns:
+        hash object with update()/hexdigest()
+    """
+    algorithm = algorithm or DEFAULT_ALGORITHM
+    if algorithm == 'xxh3':
+        if xxhash is None:
+            raise ValueError("xxhash is not installed.")
+        return xxhash.xxh3_128()
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(algorithm)
+
+
+def file_digest(file_path, algorithm=None, stats=HASH_STATS):
+    """hash the whole file"""
+    digest = new_hash(algorithm)
+    read = 0
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            read += len(chunk)
+    if stats is not None:
+        stats.add_read(read)
+    return digest.hexdigest()
+
+
+def partial_digest(file_path, size=None, algorithm=None, stats=HASH_STATS):
+    """hash the first and last PARTIAL_SIZE bytes, or the whole file if it is small"""
+    if size is None:
+        size = os.path.getsize(file_path)
+    digest = new_hash(algorithm)
+    with open(file_path, 'rb') as file:
+        if size <= 2 * PARTIAL_SIZE:
+            data = file.read()
+            digest.update(data)
+            read = len(data)
+        else:
+            head = file.read(PARTIAL_SIZE)
+            file.seek(size - PARTIAL_SIZE)
+            tail = file.read(PARTIAL_SIZE)
+            digest.update(head)
+            digest.update(tail)
+            read = len(head) + len(tail)
+    if stats is not None:
+        stats.add_read(read)
+    return digest.hexdigest()
+
+
+def middle_digest(file_path, size=None, algorithm=None, stats=HASH_STATS):
+    """ hash the bytes partial_digest leaves out, between the head and the tail
+
+    Files with the same partial and middle digests are identical, and the
+    two digests together read every byte once.
+    """
+    if size is None:
+        size = os.path.getsize(file_path)
+    digest = new_hash(algorithm)
+    read = 0
+    remaining = size - 2 * PARTIAL_SIZE
+    if remaining > 0:
+        with open(file_path, 'rb') as file:
+            file.seek(PARTIAL_SIZE)
+            while remaining > 0:
+                chunk = file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                read += len(chunk)
+                remaining -= len(chunk)
+    if stats is not None:
+        stats.add_read(read)
+    return digest.hexdigest()
+
+
+def _same_middle(first_path, second_path, size, stats):
+    """compare the bytes between head and tail chunk by chunk, stopping at the first difference"""
+    read = 0
+    remaining = size - 2 * PARTIAL_SIZE
+    try:
+        with open(first_path, 'rb') as first, open(second_path, 'rb') as second:
+            first.seek(PARTIAL_SIZE)
+            second.seek(PARTIAL_SIZE)
+            while remaining > 0:
+                count = min(CHUNK_SIZE, remaining)
+                first_chunk = first.read(count)
+                second_chunk = second.read(count)
+                read += len(first_chunk) + len(second_chunk)
+                if first_chunk != second_chunk:
+                    return False
+                if not first_chunk:
+                    break
+                remaining -= len(first_chunk)
+        return True
+    finally:
+        if stats is not None:
+            stats.add_read(read)
+
+
+def files_identical(first_path, second_path, algorithm=None, stats=HASH_STATS):
+    """ Compare two files by size, then head/tail hash, then the bytes in between
+
+    The head and tail are read once: the last stage compares only the
+    middle of the files, directly, so no byte is read twice.
+
+    Args:
+        first_path (str): first file
+        second_path (str): second file
+        algorithm (str): hash algorithm, see new_hash
+        stats (HashStats): counters to update
+
+    Returns:
+        bool: True if both files have the same content
+    """
+    size = os.path.getsize(first_path)
+    if size != os.path.getsize(second_path):
+        return False
+    if stats is not None:
+        stats.add_comparison(size)
+    if partial_digest(first_path, size, algorithm, stats) != \
+            partial_digest(second_path, size, algorithm, stats):
+        return False
+    if size <= 2 * PARTIAL_SIZE:
+        # 小文件的部分哈希已覆盖全部内容
+        return True
+    return _same_middle(first_path, second_path, size, stats)
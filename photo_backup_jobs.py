@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 22:24:09
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 22:24:09
+ * @Description  : several source -> destination backup jobs from one job file
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import functools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import photo_backup_events
+import photo_backup_pipeline
+import photo_backup_scan
+import photo_backup_utils
+from photo_backup_catalog import Catalog
+from photo_backup_dedupe import DestinationIndex, SourceDigests
+from photo_backup_journal import Journal
+from photo_backup_manifest import Manifest
+from photo_backup_memory import BUDGET, SpillDict
+from photo_backup_metadata import MetadataCache
+from photo_backup_similar import DEFAULT_THRESHOLD, SimilarityIndex
+
+# 默认的全局线程预算：所有同时运行的任务的日期线程与复制线程之和
+WORKERS = photo_backup_pipeline.DATE_WORKERS + photo_backup_pipeline.COPY_WORKERS
+# 每个任务的可选项及默认值
+JOB_OPTIONS = {
+    'name': None,
+    'types': list(photo_backup_utils.SUPPORTED_IMAGE_TYPES),
+    'include': None,
+    'exclude': None,
+    'incremental': False,
+    'global_dedupe': False,
+    'link': False,
+    'metadata_cache': False,
+    'near_duplicates': None,
+    'similarity_threshold': DEFAULT_THRESHOLD,
+    'verify': False,
+}
+# 任务文件顶层的可选项及默认值
+FILE_OPTIONS = {
+    'workers': WORKERS,
+    'metadata_workers': None,
+    'journal': True,
+    'defaults': {},
+}
+
+
+class BackupJob:
+    """one source -> destination pair of a job file, with its options"""
+
+    __slots__ = ('source', 'destination') + tuple(JOB_OPTIONS)
+
+    def __init__(self, source, destination, **options):
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown job options: {', '.join(sorted(unknown))}.")
+        self.source = os.path.abspath(os.path.expanduser(source))
+        self.destination = os.path.abspath(os.path.expanduser(destination))
+        for option, default in JOB_OPTIONS.items():
+            setattr(self, option, options.get(option, default))
+        if self.name is None:
+            self.name = os.path.basename(self.source.rstrip(os.sep)) or self.source
+        if self.near_duplicates not in (None, 'flag', 'skip'):
+            raise ValueError(f"job {self.name}: near_duplicates must be flag or skip.")
+
+    def __repr__(self):
+        return f"BackupJob({self.name!r}, {self.source!r} -> {self.destination!r})"
+
+
+def _parse(path):
+    """the raw dict of a .json, .toml or .yaml/.yml job file"""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.json':
+        with open(path, encoding='utf-8') as job_file:
+            return json.load(job_file)
+    if suffix == '.toml':
+        if tomllib is None:
+            raise ValueError("TOML job files need Python 3.11 or later.")
+        with open(path, 'rb') as job_file:
+            return tomllib.load(job_file)
+    if suffix in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ValueError("YAML job files need PyYAML (pip install pyyaml).")
+        with open(path, encoding='utf-8') as job_file:
+            return yaml.safe_load(job_file)
+    raise ValueError(f"unknown job file type {suffix}, expected .json, .toml or .yaml.")
+
+
+def load_jobs(path):
+    """ Read a job file
+
+    The file holds a list of jobs, each with a source, a destination and
+    any of JOB_OPTIONS; options under "defaults" apply to every job that
+    does not set them. Top-level options are in FILE_OPTIONS.
+
+    Args:
+        path (str): .json, .toml or .yaml/.yml file
+
+    Returns:
+        tuple: (list of BackupJob, dict of the top-level options)
+    """
+    config = _parse(path)
+    if not isinstance(config, dict) or not isinstance(config.get('jobs'), list):
+        raise ValueError(f"{path} has no list of jobs.")
+    unknown = set(config) - set(FILE_OPTIONS) - {'jobs'}
+    if unknown:
+        raise ValueError(f"unknown job file options: {', '.join(sorted(unknown))}.")
+    options = {option: config.get(option, default) for option, default in FILE_OPTIONS.items()}
+    jobs = []
+    for entry in config['jobs']:
+        entry = {**options['defaults'], **entry}
+        if 'source' not in entry or 'destination' not in entry:
+            raise ValueError(f"every job of {path} needs a source and a destination.")
+        jobs.append(BackupJob(**entry))
+    if options['workers'] < 2:
+        raise ValueError("workers must be at least 2.")
+    return jobs, options
+
+
+class _Destination:
+    """the indexes shared by every job writing into one destination"""
+
+    def __init__(self, destination_dir, jobs, options):
+        self.destination_dir = destination_dir
+        self.jobs = jobs
+        self.catalog = Catalog(destination_dir) \
+            if any(job.incremental for job in jobs) else None
+        self.index = DestinationIndex(destination_dir, source_digests=options['source_digests']) \
+            if any(job.global_dedupe for job in jobs) else None
+        self.journal = Journal(destination_dir) if options['journal'] else None
+        # 同一目标的所有任务共用文件夹名索引和已处理文件表：重叠的源文件只在第一个任务里处理
+        self.names = photo_backup_utils.DirectoryNameIndex(BUDGET.max_folders())
+        self.handled = SpillDict(BUDGET.max_entries(0.1), destination_dir) \
+            if len(jobs) > 1 else None
+        self.metadata = MetadataCache(destination_dir, options['metadata_workers']) \
+            if any(job.metadata_cache for job in jobs) else None
+        self.manifest = Manifest(destination_dir) if any(job.verify for job in jobs) else None
+        self.similar = {}
+
+    def similarity_index(self, job):
+        """the SimilarityIndex for job's near-duplicate mode, or None"""
+        if job.near_duplicates is None:
+            return None
+        key = (job.near_duplicates, job.similarity_threshold)
+        if key not in self.similar:
+            self.similar[key] = SimilarityIndex(
+                self.destination_dir, job.similarity_threshold,
+                skip=job.near_duplicates == 'skip')
+        return self.similar[key]
+
+    def claim(self, job, source):
+        """ False if another job of this destination already handled source
+
+        Files are told apart by (st_dev, st_ino), so the same file reached
+        through two sources, a bind mount or a hard link is only handled
+        by the first job that sees it; hard links within one job's source
+        are still handled as separate files.
+        """
+        key = source.dev << 64 | source.inode
+        owner = self.handled.get(key)
+        if owner is None:
+            self.handled[key] = job.name
+            return True
+        return owner == job.name
+
+    def close(self, finished):
+        """close everything; the journal is deleted when every job finished"""
+        for similar in self.similar.values():
+            similar.close()
+        if self.metadata is not None:
+            self.metadata.close()
+        if self.journal is not None:
+            if finished:
+                self.journal.finish()
+            else:
+                self.journal.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.index is not None:
+            self.index.close()
+        if self.catalog is not None:
+            self.catalog.close()
+        if self.handled is not None:
+            self.handled.close()
+
+
+def _contains(folder, path):
+    return os.path.commonpath([folder, path]) == folder
+
+
+class _SharedScans:
+    """ One walk of every source tree that several jobs read
+
+    A job whose source is inside another job's source (or the same folder)
+    takes its files from a scan of the outermost such folder instead of
+    walking its own tree again. The outer tree is scanned once, with no
+    include/exclude filters, by the first job that needs it; each job
+    then applies its own filters to the records, in the order its own
+    scan would have yielded them. The records are dropped when the last
+    job using them is done.
+    """
+
+    def __init__(self, jobs):
+        self._roots = {}
+        users = {}
+        for job in jobs:
+            root = min((other.source for other in jobs if _contains(other.source, job.source)),
+                       key=len)
+            parts = os.path.relpath(job.source, root).split(os.sep)
+            # 经过被剪除目录才能到达的源目录不会出现在外层的扫描结果里
+            if any(part in photo_backup_scan.PRUNE_DIRS for part in parts):
+                root = job.source
+            self._roots[job.name] = root
+            users.setdefault(root, []).append(job)
+        self._users = {root: len(group) for root, group in users.items() if len(group) > 1}
+        self._types = {root: {suffix for job in users[root] for suffix in job.types}
+                       for root in self._users}
+        self._locks = {root: threading.Lock() for root in self._users}
+        self._records = {}
+
+    def sources(self, job, events):
+        """the SourceFile records of job from the shared scan, or None to scan its source"""
+        root = self._roots[job.name]
+        if root not in self._users:
+            return None
+        with self._locks[root]:
+            if root not in self._records:
+                records = SpillDict(BUDGET.max_entries(0.2))
+                for number, source in enumerate(photo_backup_scan.scan_source(
+                        root, self._types[root], events=events)):
+                    records[number] = source
+                self._records[root] = records
+            records = self._records[root]
+        return (source for source in map(records.get, range(len(records)))
+                if photo_backup_scan.matches_filters(source.path, job.source, job.types,
+                                                     job.include, job.exclude))
+
+    def release(self, job):
+        """the job is done with its records"""
+        root = self._roots[job.name]
+        if root not in self._users:
+            return
+        with self._locks[root]:
+            self._users[root] -= 1
+            if self._users[root] == 0 and root in self._records:
+                self._records.pop(root).close()
+
+
+def _split_budget(workers, running):
+    """(date_workers, copy_workers) of one of running jobs sharing workers threads"""
+    share = max(2, workers // running)
+    copy_workers = max(1, share // 3)
+    return share - copy_workers, copy_workers
+
+
+def run_jobs(jobs, workers=WORKERS, metadata_workers=None, journal=True, events=None):
+    """ Run backup jobs in one process
+
+    Jobs are grouped by destination. Each destination gets one catalog,
+    one destination index, one folder name index, one journal, one
+    manifest and one metadata cache shared by its jobs, which run one
+    after the other, so a file reachable from two overlapping sources is
+    dated, hashed and copied once, with or without the journal. Nested
+    sources are walked once, and with global_dedupe a source file is
+    hashed once for all destinations. Destinations are backed up at the
+    same time, splitting the workers budget of date and copy threads
+    between them.
+
+    Args:
+        jobs (list): BackupJob list, run in order within a destination
+        workers (int): date and copy threads over all running jobs
+        metadata_workers (int): processes of each metadata cache
+        journal (bool): keep a resumable journal per destination
+        events (EventStream): receives the events of every job
+
+    Returns:
+        dict: {job name: CounterSink snapshot}
+    """
+    for job in jobs:
+        photo_backup_utils.validate_folder_path(job.source)
+        photo_backup_utils.validate_folder_path(job.destination)
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("job names must be unique; set name on jobs sharing a source folder name.")
+    if events is None:
+        events = photo_backup_events.EventStream()
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.destination, []).append(job)
+    running = max(1, min(len(groups), workers // 2))
+    date_workers, copy_workers = _split_budget(workers, running)
+    scans = _SharedScans(jobs)
+    # 多个目标都做全局去重时，源文件的摘要只算一次
+    source_digests = SourceDigests(BUDGET.max_entries(0.1)) \
+        if sum(any(job.global_dedupe for job in group) for group in groups.values()) > 1 else None
+    options = {'metadata_workers': metadata_workers, 'journal': journal,
+               'source_digests': source_digests}
+    results = {}
+    results_lock = threading.Lock()
+
+    def run_destination(destination_dir, group):
+        destination = _Destination(destination_dir, group, options)
+        finished = False
+        try:
+            for job in group:
+                if events.cancelled():
+                    return
+                # 每个任务单独计数，事件再转发给整个运行的事件流
+                counter = photo_backup_events.CounterSink()
+                job_events = photo_backup_events.EventStream([counter, events],
+                                                             events.cancel_event)
+                try:
+                    photo_backup_pipeline.copy_photos_by_date_parallel(
+                        job.source, destination_dir, tuple(job.types),
+                        date_workers=date_workers, copy_workers=copy_workers,
+                        catalog=destination.catalog if job.incremental else None,
+                        index=destination.index if job.global_dedupe else None,
+                        link=job.link, journal=destination.journal,
+                        include=job.include, exclude=job.exclude, events=job_events,
+                        metadata=destination.metadata if job.metadata_cache else None,
+                        similar=destination.similarity_index(job),
+                        manifest=destination.manifest if job.verify else None,
+                        names=destination.names, sources=scans.sources(job, job_events),
+                        claim=functools.partial(destination.claim, job)
+                        if destination.handled is not None else None)
+                finally:
+                    scans.release(job)
+                with results_lock:
+                    results[job.name] = counter.snapshot()
+            finished = not events.cancelled()
+        finally:
+            destination.close(finished)
+
+    try:
+        with ThreadPoolExecutor(max_workers=running) as executor:
+            futures = [executor.submit(run_destination, destination_dir, group)
+                       for destination_dir, group in groups.items()]
+            for future in futures:
+                future.result()
+    finally:
+        if source_digests is not None:
+            source_digests.close()
+    return results
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 15:31:08
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 15:31:08
+ * @Description  : write-ahead journal for resumable backup runs
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import json
+import os
+import threading
+
+import photo_backup_transfer
+from photo_backup_memory import BUDGET, SpillDict
+
+# 日志文件名，保存在目标根目录下
+JOURNAL_NAME = '.photo_backup.journal'
+# 每写入多少条记录同步一次磁盘
+SYNC_INTERVAL = 100
+
+
+class Journal:
+    """ Append-only record of the files a run has finished
+
+    Opening the journal of an interrupted run loads what it completed, so the
+    rerun skips those files without re-reading or re-hashing them, and removes
+    the temporary files of copies that were cut short. finish() deletes the
+    journal once the run has gone through the whole source.
+    """
+
+    def __init__(self, destination_dir):
+        self.path = os.path.join(destination_dir, JOURNAL_NAME)
+        self._lock = threading.Lock()
+        self._pending = 0
+        # 有内存预算时，超出的记录溢写到目标目录下的临时文件
+        self._done = SpillDict(BUDGET.max_entries(0.2), destination_dir)
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+                    self._done[entry['source']] = (entry['size'], entry['mtime'])
+            removed = photo_backup_transfer.remove_partials(destination_dir)
+            print(f"resuming: {len(self._done)} files already done, "
+                  f"{removed} partial copies removed")
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._done)
+
+    def is_done(self, source_path, size, mtime):
+        """return True if an earlier attempt finished source_path as it is now"""
+        return self._done.get(os.path.abspath(source_path)) == (size, mtime)
+
+    def record(self, source_path, size, mtime, result, destination_path):
+        """append a finished file"""
+        source_path = os.path.abspath(source_path)
+        line = json.dumps({'source': source_path, 'size': size, 'mtime': mtime,
+                           'result': result, 'destination': destination_path},
+                          ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._done[source_path] = (size, mtime)
+            self._pending += 1
+            if self._pending >= SYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        """flush the journal to disk and close it"""
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+            self._done.close()
+
+    def finish(self):
+        """the run completed: close and delete the journal"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
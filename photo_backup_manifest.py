@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 23:58:06
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 23:58:06
+ * @Description  : manifest of verified copies and the incremental integrity audit
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import photo_backup_dedupe
+import photo_backup_hash
+import photo_backup_transfer
+
+# 清单数据库文件名，保存在目标根目录下
+MANIFEST_NAME = '.photo_backup.manifest.db'
+# 每写入多少条记录提交一次事务
+COMMIT_INTERVAL = 500
+# 文件状态：校验通过 / 内容与清单不符 / 文件不见了
+OK = 'ok'
+CORRUPT = 'corrupt'
+MISSING = 'missing'
+# 默认多少次审计（每晚一次）把整个归档校验一遍
+AUDIT_CYCLE = 30
+
+
+class Manifest:
+    """ Content hash of every archived file, kept in the destination root
+
+    One row per archived file, by path relative to the destination: size
+    and mtime when it was hashed, the hash algorithm and digest, when it
+    was last verified and its status. Verified copies add rows; audit
+    re-checks them. Safe to share between worker threads.
+
+    Args:
+        destination_dir (str): destination root
+        algorithm (str): hash of new rows, see photo_backup_hash.new_hash
+    """
+
+    def __init__(self, destination_dir, algorithm=None):
+        self.destination_dir = destination_dir
+        self.algorithm = algorithm or photo_backup_hash.DEFAULT_ALGORITHM
+        self.path = os.path.join(destination_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " algorithm TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " verified REAL NOT NULL,"
+            " status TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS manifest_verified ON manifest (verified)")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
+
+    def _relative(self, file_path):
+        return os.path.relpath(file_path, self.destination_dir)
+
+    def _write(self, sql, parameters):
+        with self._lock:
+            self._conn.execute(sql, parameters)
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def record(self, file_path, digest, algorithm=None):
+        """ Record an archived file as verified now
+
+        Args:
+            file_path (str): archived file
+            digest (str): its content digest
+            algorithm (str): hash that produced digest, self.algorithm if None
+        """
+        stat = os.stat(file_path)
+        self._write(
+            "INSERT OR REPLACE INTO manifest"
+            " (path, size, mtime, algorithm, digest, verified, status)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._relative(file_path), stat.st_size, stat.st_mtime,
+             algorithm or self.algorithm, digest, time.time(), OK))
+
+    def link(self, existing_path, link_path):
+        """record a hard link with the row of the file it links to, if known"""
+        row = self.get(existing_path)
+        if row is not None:
+            self.record(link_path, row['digest'], row['algorithm'])
+
+    def remove(self, file_path):
+        """forget an archived file that was deleted on purpose"""
+        self._write("DELETE FROM manifest WHERE path = ?", (self._relative(file_path),))
+
+    def get(self, file_path):
+        """the row of an archived file as a dict, or None"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT path, size, mtime, algorithm, digest, verified, status"
+                " FROM manifest WHERE path = ?", (self._relative(file_path),))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def __contains__(self, file_path):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM manifest WHERE path = ?",
+                                      (self._relative(file_path),)).fetchone() is not None
+
+    def least_recently_verified(self, count):
+        """ The count rows verified longest ago
+
+        Returns:
+            list: (path relative to the destination, size, mtime, algorithm, digest)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, size, mtime, algorithm, digest FROM manifest"
+                " ORDER BY verified LIMIT ?", (count,)).fetchall()
+
+    def set_status(self, relative_path, status):
+        """store the outcome of a check of the row of relative_path"""
+        self._write("UPDATE manifest SET status = ?, verified = ? WHERE path = ?",
+                    (status, time.time(), relative_path))
+
+    def problems(self):
+        """ Rows whose last check failed
+
+        Returns:
+            list: (path relative to the destination, status)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, status FROM manifest WHERE status != ? ORDER BY path",
+                (OK,)).fetchall()
+
+    def close(self):
+        """commit pending rows and close the database"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def _check(manifest, relative_path, size, mtime, algorithm, digest):
+    """re-hash one manifest row; return (status, bytes read, changed)"""
+    file_path = os.path.join(manifest.destination_dir, relative_path)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return MISSING, 0, False
+    if stat.st_size != size or stat.st_mtime != mtime:
+        # 文件被有意修改过（编辑、重新导出），以新内容为准
+        manifest.record(file_path, photo_backup_transfer.read_back_digest(file_path, algorithm),
+                        algorithm)
+        return OK, stat.st_size, True
+    actual = photo_backup_transfer.read_back_digest(file_path, algorithm)
+    return (OK if actual == digest else CORRUPT), stat.st_size, False
+
+
+def audit(destination_dir, cycle=AUDIT_CYCLE, max_bytes=None):
+    """ Re-verify a slice of the archive against the manifest
+
+    Each run hashes 1/cycle of the archive, starting with the files
+    verified longest ago, so running it nightly checks everything every
+    cycle nights without re-reading the whole archive; the tree is only
+    walked, not read, to find new files. Archived files missing from the
+    manifest (copied without --verify) are hashed and added first, within
+    the same slice. Files whose size or mtime changed are re-recorded and
+    reported; same size and mtime with a different hash is bit rot.
+
+    Args:
+        destination_dir (str): destination root
+        cycle (int): runs over which the whole archive is checked
+        max_bytes (int): stop the slice after reading this many bytes,
+            None for no limit
+
+    Returns:
+        dict: counts of checked, added, changed, corrupt and missing files
+            and bytes read in this run
+    """
+    if cycle < 1:
+        raise ValueError("cycle must be at least 1.")
+    counts = dict.fromkeys(('checked', 'added', 'changed', 'corrupt', 'missing', 'bytes'), 0)
+    with Manifest(destination_dir) as manifest:
+        # 先遍历一遍（只 stat）找出清单里没有的文件，只保留一个切片的量
+        untracked = []
+        total = len(manifest)
+        for path, stat in photo_backup_dedupe.iter_archive_files(destination_dir):
+            if path not in manifest:
+                total += 1
+                if len(untracked) < math.ceil(total / cycle):
+                    untracked.append((path, stat.st_size))
+        slice_size = math.ceil(total / cycle)
+        budget = slice_size
+
+        def over_bytes():
+            return max_bytes is not None and counts['bytes'] >= max_bytes
+
+        for path, size in untracked:
+            if over_bytes():
+                break
+            try:
+                manifest.record(path, photo_backup_transfer.read_back_digest(
+                    path, manifest.algorithm))
+            except OSError as e:
+                print(e)
+                continue
+            counts['added'] += 1
+            counts['bytes'] += size
+        budget -= counts['added']
+        rows = manifest.least_recently_verified(budget) if budget > 0 else []
+        for relative_path, size, mtime, algorithm, digest in rows:
+            if over_bytes():
+                break
+            try:
+                status, read, changed = _check(manifest, relative_path, size, mtime,
+                                               algorithm, digest)
+            except (OSError, ValueError) as e:
+                print(f"{relative_path}: {e}")
+                continue
+            counts['checked'] += 1
+            counts['bytes'] += read
+            if changed:
+                counts['changed'] += 1
+                print(f"changed since backup, re-recorded: {relative_path}")
+            else:
+                manifest.set_status(relative_path, status)
+                if status != OK:
+                    counts[status] += 1
+        problems = manifest.problems()
+    print(f"audit of {destination_dir}: {counts['checked']} files checked, "
+          f"{counts['added']} added to the manifest, {counts['changed']} changed, "
+          f"{counts['corrupt']} corrupt, {counts['missing']} missing, "
+          f"{counts['bytes'] / 1024 / 1024:.1f} MB read; slice {slice_size} of {total} files")
+    for relative_path, status in problems:
+        print(f"{status}: {relative_path}")
+    return counts
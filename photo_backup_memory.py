@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 23:20:12
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 23:20:12
+ * @Description  : memory budget, RSS readings and spill-to-disk dictionaries
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import gc
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 预算中分给内存索引（目标索引、日志、目录名）的比例，其余留给解释器、PIL 与队列
+INDEX_SHARE = 0.5
+# 估计每条内存索引记录的字节数：键、值与字典开销
+BYTES_PER_ENTRY = 256
+# 估计每个缓存的目标目录占用的字节数（目录名集合）
+BYTES_PER_FOLDER = 64 * 1024
+# 预算中分给图像解码的比例
+DECODE_SHARE = 0.25
+# 每生产多少个文件检查一次 RSS
+CHECK_INTERVAL = 256
+# RSS 超出预算时，每次等待下游消化的秒数
+WAIT_STEP = 0.05
+# 溢写到磁盘时每次插入的行数
+SPILL_BATCH = 10000
+# 进程池的启动方式：其他线程运行时 fork 会复制它们持有的锁，子进程可能死锁
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() \
+    else 'spawn'
+
+
+def process_pool(max_workers=None):
+    """ A ProcessPoolExecutor that is safe to start while other threads run
+
+    Workers are started with START_METHOD instead of fork, so they do not
+    inherit the heap, or a lock held by another thread, of the backup.
+
+    Args:
+        max_workers (int): processes, os.cpu_count() if None
+    """
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context(START_METHOD))
+
+
+def rss_bytes():
+    """resident set size of this process, or None where it cannot be read"""
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes(children=False):
+    """ Peak resident set size of this process, or of its waited-for children
+
+    Returns:
+        int: bytes, or None without the resource module
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+class MemoryBudget:
+    """ Memory limit of a run, shared by the components that can hold a lot
+
+    With no limit every component behaves as before. With one, the indexes
+    that grow with the tree size keep at most max_entries() entries in
+    memory and spill the rest to disk, the destination name cache keeps
+    max_folders() folders, and producers call throttle() so they wait
+    while the process is over budget and downstream work can still drain.
+
+    Args:
+        limit (int): bytes, None for no limit
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.waited = 0.0
+        self.over_budget = 0
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def configure(self, limit):
+        """set the limit in bytes, None to remove it"""
+        self.limit = limit
+        self.waited = 0.0
+        self.over_budget = 0
+
+    def max_entries(self, share=1.0):
+        """entries an in-memory index may hold before spilling, None without a limit"""
+        if self.limit is None:
+            return None
+        return max(1000, int(self.limit * INDEX_SHARE * share / BYTES_PER_ENTRY))
+
+    def max_folders(self):
+        """destination folders whose listing may stay cached, None without a limit"""
+        if self.limit is None:
+            return None
+        return max(16, int(self.limit * INDEX_SHARE / 4 / BYTES_PER_FOLDER))
+
+    def decode_limit(self, default):
+        """bytes of decoded pixels allowed at once"""
+        if self.limit is None:
+            return default
+        return min(default, int(self.limit * DECODE_SHARE))
+
+    def exceeded(self):
+        """True if the RSS is over the limit right now"""
+        if self.limit is None:
+            return False
+        rss = rss_bytes()
+        return rss is not None and rss > self.limit
+
+    def over(self):
+        """exceeded(), but only read every CHECK_INTERVAL calls; cheap enough per file"""
+        if self.limit is None:
+            return False
+        with self._lock:
+            self._calls += 1
+            if self._calls % CHECK_INTERVAL:
+                return False
+        return self.exceeded()
+
+    def throttle(self, pending):
+        """ Backpressure for a producer: wait while over budget and work is pending
+
+        Waiting only helps while the consumers still have queued work to
+        finish; once pending() is 0 the producer goes on, and the run is
+        counted as over budget.
+
+        Args:
+            pending (callable): number of items queued downstream
+        """
+        if not self.over():
+            return
+        start = time.perf_counter()
+        gc.collect()
+        while pending() > 0:
+            if not self.exceeded():
+                break
+            time.sleep(WAIT_STEP)
+        else:
+            if self.exceeded():
+                self.over_budget += 1
+        self.waited += time.perf_counter() - start
+
+    def summary(self):
+        """one-line report of the budget, the peak RSS and the time producers waited"""
+        peak = peak_rss_bytes()
+        peak_text = f"{peak / 1024 / 1024:.0f} MB" if peak is not None else "unknown"
+        return (f"memory budget {self.limit / 1024 / 1024:.0f} MB, peak RSS {peak_text}, "
+                f"producers waited {self.waited:.1f}s, {self.over_budget} checks over budget "
+                f"with nothing left to drain")
+
+
+# 全局内存预算，命令行 --max-memory 设置
+BUDGET = MemoryBudget()
+
+
+class SpillDict:
+    """ Mapping that moves its entries to a temporary SQLite file past max_items
+
+    Recent writes stay in a plain dict; when it grows past max_items its
+    entries are written to disk and the dict is emptied, so memory stays
+    at max_items entries whatever the total. Keys must be str or int,
+    values anything picklable. The file is deleted as soon as it is open
+    (on POSIX), so nothing is left behind after a crash. Safe to share
+    between threads.
+
+    Args:
+        max_items (int): entries kept in memory, None to never spill
+        directory (str): where to create the file; the system temp folder
+            if None (which may itself be RAM-backed)
+    """
+
+    def __init__(self, max_items=None, directory=None):
+        self.max_items = max_items
+        self.directory = directory
+        self._memory = {}
+        self._conn = None
+        self._path = None
+        self._spilled = 0
+        # 内存中尚未写到磁盘上的新键数
+        self._new = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._spilled + self._new
+
+    def _open(self):
+        descriptor, self._path = tempfile.mkstemp(prefix='.photo_backup.spill.', suffix='.db',
+                                                  dir=self.directory)
+        os.close(descriptor)
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE spill (key PRIMARY KEY, value BLOB NOT NULL)")
+        try:
+            os.remove(self._path)
+            self._path = None
+        except OSError:
+            # Windows 不能删除打开中的文件，关闭时再删
+            pass
+
+    def _on_disk(self, key):
+        return self._conn is not None and self._conn.execute(
+            "SELECT 1 FROM spill WHERE key = ?", (key,)).fetchone() is not None
+
+    def _disk_get(self, key):
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT value FROM spill WHERE key = ?", (key,)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def _spill(self):
+        if self._conn is None:
+            self._open()
+        items = list(self._memory.items())
+        for start in range(0, len(items), SPILL_BATCH):
+            rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                    for key, value in items[start:start + SPILL_BATCH]]
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO spill (key, value) VALUES (?, ?)", rows)
+            # 已经在磁盘上的键改为更新，不重复计数
+            inserted = self._conn.total_changes - before
+            self._spilled += inserted
+            if inserted < len(rows):
+                self._conn.executemany("UPDATE spill SET value = ? WHERE key = ?",
+                                       [(value, key) for key, value in rows])
+        self._conn.commit()
+        self._memory.clear()
+        self._new = 0
+
+    def get(self, key, default=None):
+        """the value of key, or default"""
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            value = self._disk_get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        if value is None:
+            raise ValueError("SpillDict cannot store None")
+        with self._lock:
+            if key not in self._memory and not self._on_disk(key):
+                self._new += 1
+            self._memory[key] = value
+            if self.max_items is not None and len(self._memory) > self.max_items:
+                self._spill()
+
+    def items(self):
+        """ All (key, value) pairs: the spilled ones, then the ones in memory
+
+        Not safe against concurrent writes.
+        """
+        memory = dict(self._memory)
+        if self._conn is not None:
+            for key, value in self._conn.execute("SELECT key, value FROM spill"):
+                if key not in memory:
+                    yield key, pickle.loads(value)
+        yield from memory.items()
+
+    @property
+    def spilled(self):
+        """True once entries have been written to disk"""
+        return self._conn is not None
+
+    def close(self):
+        """drop the entries and delete the file"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                if self._path is not None:
+                    os.remove(self._path)
+                    self._path = None
+            self._spilled = 0
+            self._new = 0
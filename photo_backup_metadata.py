@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 19:22:51
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 19:22:51
+ * @Description  : batched metadata extraction on a process pool, with a cache
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+import photo_backup_exif
+import photo_backup_memory
+
+# 缓存数据库文件名，保存在目标根目录下
+CACHE_NAME = '.photo_backup.metadata.db'
+# 每个进程任务处理的文件数，摊薄进程间通信的开销
+CHUNK_SIZE = 64
+# 一批送去解析的文件数
+BATCH_SIZE = 1024
+# 每写入多少条记录提交一次事务
+COMMIT_INTERVAL = 500
+# 需要读取的 Exif 标签
+METADATA_TAGS = photo_backup_exif.DATE_TAGS + (
+    photo_backup_exif.MAKE, photo_backup_exif.ORIENTATION,
+    photo_backup_exif.PIXEL_X_DIMENSION, photo_backup_exif.PIXEL_Y_DIMENSION,
+    photo_backup_exif.IMAGE_WIDTH, photo_backup_exif.IMAGE_LENGTH)
+
+
+class PhotoMetadata:
+    """date (YYYY-MM-DD), camera make, pixel size and EXIF orientation of a photo"""
+
+    __slots__ = ('date', 'make', 'width', 'height', 'orientation')
+
+    def __init__(self, date, make, width, height, orientation):
+        self.date = date
+        self.make = make
+        self.width = width
+        self.height = height
+        self.orientation = orientation
+
+    def __repr__(self):
+        return (f"PhotoMetadata(date={self.date!r}, make={self.make!r}, "
+                f"size={self.width}x{self.height}, orientation={self.orientation})")
+
+    def __eq__(self, other):
+        return isinstance(other, PhotoMetadata) and self.astuple() == other.astuple()
+
+    def astuple(self):
+        """the fields as a tuple, in __slots__ order"""
+        return (self.date, self.make, self.width, self.height, self.orientation)
+
+
+def _integer(value):
+    return value if isinstance(value, int) else None
+
+
+def _read_pil(file_path):
+    """metadata through PIL, for formats the header reader does not know"""
+    with Image.open(file_path) as image:
+        exif = image.getexif()
+        values = dict(exif)
+        values.update(exif.get_ifd(photo_backup_exif.EXIF_IFD_POINTER))
+        return values, image.size
+
+
+def extract_metadata(file_path):
+    """ Read the metadata of one photo from its header
+
+    The EXIF header reader is tried first; PNG, BMP and other formats go
+    through PIL, which also supplies the size when EXIF has none. Pixel
+    data is never decoded.
+
+    Args:
+        file_path (str): photo path
+
+    Returns:
+        PhotoMetadata: the record, with None for missing fields
+    """
+    size = None
+    try:
+        values = photo_backup_exif.read_exif_tags(file_path, METADATA_TAGS)
+    except photo_backup_exif.ExifFormatError:
+        values, size = _read_pil(file_path)
+    width = _integer(values.get(photo_backup_exif.PIXEL_X_DIMENSION)) or \
+        _integer(values.get(photo_backup_exif.IMAGE_WIDTH))
+    height = _integer(values.get(photo_backup_exif.PIXEL_Y_DIMENSION)) or \
+        _integer(values.get(photo_backup_exif.IMAGE_LENGTH))
+    if not (width and height):
+        if size is None:
+            with Image.open(file_path) as image:
+                size = image.size
+        width, height = size
+    make = values.get(photo_backup_exif.MAKE)
+    return PhotoMetadata(
+        photo_backup_exif.format_exif_date(photo_backup_exif.pick_exif_date(values)),
+        (make.strip() or None) if isinstance(make, str) else None,
+        width, height, _integer(values.get(photo_backup_exif.ORIENTATION)))
+
+
+def _extract_chunk(paths):
+    """process pool task: (record or None, error or None) per path"""
+    results = []
+    for path in paths:
+        try:
+            results.append((extract_metadata(path), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def extract_batch(paths, executor=None, chunk_size=CHUNK_SIZE):
+    """ Extract the metadata of many files, in chunks on a process pool
+
+    Args:
+        paths (list): photo paths
+        executor (Executor): pool to use; a temporary
+            photo_backup_memory.process_pool when None
+        chunk_size (int): files per task
+
+    Returns:
+        list: (PhotoMetadata or None, error message or None) per path, in order
+    """
+    chunks = [paths[start:start + chunk_size]
+              for start in range(0, len(paths), chunk_size)]
+    if executor is None:
+        with photo_backup_memory.process_pool() as pool:
+            return [result for chunk in pool.map(_extract_chunk, chunks) for result in chunk]
+    return [result for chunk in executor.map(_extract_chunk, chunks) for result in chunk]
+
+
+class MetadataCache:
+    """ Photo metadata cached by (device, inode, size, mtime) in an SQLite file
+
+    A file keeps its entry while it is neither rewritten nor replaced, so
+    renamed or moved sources are still found; the device keeps files of
+    two source disks that happen to share an inode number apart. Misses are extracted in
+    batches on a process pool. Safe to share between worker threads.
+
+    Args:
+        destination_dir (str): folder holding the cache file
+        workers (int): processes of the extraction pool, os.cpu_count() if None
+    """
+
+    def __init__(self, destination_dir, workers=None):
+        self.path = os.path.join(destination_dir, CACHE_NAME)
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(metadata)")]
+        if columns and 'dev' not in columns:
+            # 旧版缓存的键没有设备号，只是缓存，直接重建
+            self._conn.execute("DROP TABLE metadata")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " dev INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " date TEXT,"
+            " make TEXT,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " orientation INTEGER,"
+            " PRIMARY KEY (dev, inode, size, mtime))")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, source):
+        """return the cached PhotoMetadata of a SourceFile, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT date, make, width, height, orientation FROM metadata"
+                " WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                (source.dev, source.inode, source.size, source.mtime)).fetchone()
+        return None if row is None else PhotoMetadata(*row)
+
+    def put(self, source, metadata):
+        """store the PhotoMetadata of a SourceFile"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata"
+                " (dev, inode, size, mtime, date, make, width, height, orientation)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source.dev, source.inode, source.size, source.mtime) + metadata.astuple())
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def get_many(self, sources):
+        """ Look up a batch of SourceFiles, extracting and storing the misses
+
+        Args:
+            sources (list): SourceFile records
+
+        Returns:
+            list: (PhotoMetadata or None, error message or None) per source
+        """
+        results = [(self.get(source), None) for source in sources]
+        missing = [position for position, (metadata, _) in enumerate(results)
+                   if metadata is None]
+        if missing:
+            if self._executor is None:
+                self._executor = photo_backup_memory.process_pool(max_workers=self.workers)
+            extracted = extract_batch([sources[position].path for position in missing],
+                                      self._executor)
+            for position, (metadata, error) in zip(missing, extracted):
+                results[position] = (metadata, error)
+                if metadata is not None:
+                    self.put(sources[position], metadata)
+        return results
+
+    def iter_with_metadata(self, sources, batch_size=BATCH_SIZE):
+        """ Pair each SourceFile with its metadata, one batch at a time
+
+        Args:
+            sources (iterable): SourceFile records
+            batch_size (int): files looked up and extracted together
+
+        Yields:
+            tuple: (SourceFile, PhotoMetadata or None, error message or None)
+        """
+        batch = []
+        for source in sources:
+            batch.append(source)
+            if len(batch) >= batch_size:
+                yield from self._pair(batch)
+                batch = []
+        if batch:
+            yield from self._pair(batch)
+
+    def _pair(self, batch):
+        for source, (metadata, error) in zip(batch, self.get_many(batch)):
+            yield source, metadata, error
+
+    def close(self):
+        """stop the extraction pool, commit pending rows and close the database"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 09:12:05
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 09:12:05
+ * @Description  : pipelined scan -> date -> copy engine for copy_photos_by_date
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import contextlib
+import queue
+import threading
+
+import photo_backup_events
+import photo_backup_memory
+import photo_backup_scheduler
+import photo_backup_utils
+from photo_backup_utils import SUPPORTED_IMAGE_TYPES
+
+# 默认的各阶段线程数和队列长度
+DATE_WORKERS = 4
+COPY_WORKERS = 2
+# 使用调度器时，大文件通道的线程数
+LARGE_WORKERS = 1
+QUEUE_SIZE = 256
+
+# 通知工作线程退出的哨兵
+_STOP = object()
+
+
+class _DirectoryLocks:
+    """one lock per destination date folder, so copy workers never race on a name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get(self, path):
+        """return the lock guarding path"""
+        with self._lock:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.Lock()
+            return lock
+
+
+def _date_worker(path_queue, enqueue, destination_dir, events, catalog, journal, similar):
+    """resolve the date folder of each scanned file"""
+    while True:
+        item = path_queue.get()
+        if item is _STOP:
+            break
+        if events.cancelled():
+            continue
+        item, metadata = item
+        try:
+            date = photo_backup_utils.resolve_photo_date(item.path, events, metadata)
+            if photo_backup_utils.skip_near_duplicate(
+                    item, date, similar, events, catalog, journal):
+                continue
+            destination_dir_path = photo_backup_utils.build_destination_dir(
+                destination_dir, date)
+            enqueue((item, date, destination_dir_path))
+        except Exception as e:
+            events.emit(photo_backup_events.ERROR, item.path, error=str(e))
+
+
+def _copy_one(item, locks, names, events, catalog, index, link, journal, similar, manifest):
+    """copy one resolved file into its date folder"""
+    source, date, destination_dir_path = item
+    try:
+        # 同样大小的文件串行查重，避免两个线程同时复制同一内容
+        with _size_lock(index, source.size), locks.get(destination_dir_path):
+            result, destination_file_path = photo_backup_utils.copy_photo(
+                source.path, destination_dir_path, index, link, names, manifest)
+        photo_backup_utils.settle_near_duplicate(
+            source, similar, result, destination_file_path)
+        photo_backup_utils.record_done(
+            source, date, result, destination_file_path, catalog, journal)
+        photo_backup_utils.emit_result(
+            events, source, result, destination_file_path)
+    except Exception as e:
+        photo_backup_utils.settle_near_duplicate(source, similar)
+        events.emit(photo_backup_events.ERROR, source.path, error=str(e))
+
+
+def _copy_worker(copy_queue, locks, names, events, catalog, index, link, journal, similar,
+                 manifest):
+    """copy files into their date folders"""
+    while True:
+        item = copy_queue.get()
+        if item is _STOP:
+            break
+        if events.cancelled():
+            continue
+        _copy_one(item, locks, names, events, catalog, index, link, journal, similar,
+                  manifest)
+
+
+def _scheduled_copy_worker(scheduler, lane, locks, names, events, catalog, index, link,
+                           journal, similar, manifest):
+    """copy the files the scheduler hands out for lane"""
+    while True:
+        job = scheduler.get(lane)
+        if job is None:
+            break
+        item, device, folder, size = job
+        try:
+            if not events.cancelled():
+                scheduler.throttle(size)
+                _copy_one(item, locks, names, events, catalog, index, link, journal, similar,
+                          manifest)
+        finally:
+            scheduler.done(device, folder)
+
+
+def _size_lock(index, size):
+    """the index lock for size, or a no-op without an index"""
+    if index is None:
+        return contextlib.nullcontext()
+    return index.size_lock(size)
+
+
+def _start(target, count, *args):
+    threads = [threading.Thread(target=target, args=args, daemon=True)
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def copy_photos_by_date_parallel(source_dir, destination_dir,
+                                 supported_image_types=SUPPORTED_IMAGE_TYPES,
+                                 date_workers=DATE_WORKERS,
+                                 copy_workers=COPY_WORKERS,
+                                 queue_size=QUEUE_SIZE,
+                                 catalog=None, index=None, link=False,
+                                 journal=None, include=None, exclude=None,
+                                 events=None, metadata=None, similar=None,
+                                 scheduler=None, large_workers=LARGE_WORKERS,
+                                 manifest=None, names=None, sources=None, claim=None):
+    """ copy photos by date with a walker, a date worker pool and a copy worker pool
+
+    The stages are joined by bounded queues, so a slow copy stage blocks the
+    date stage and the walker instead of buffering the whole tree in memory.
+    Every file goes through the same resolve_photo_date/copy_photo calls as
+    copy_photos_by_date.
+
+    With a scheduler, the copy stage takes its files from the CopyScheduler
+    instead of a FIFO queue: copy_workers threads serve the small-file lane
+    and large_workers threads the large-file lane.
+
+    Args:
+        source_dir (str): source directory
+        destination_dir (str): destination directory
+        supported_image_types (tuple): file suffixes to back up
+        date_workers (int): threads reading photo dates
+        copy_workers (int): threads copying files
+        queue_size (int): max pending items between two stages
+        catalog (Catalog): skip files already backed up with the same size
+            and mtime, and record every handled file
+        index (DestinationIndex): skip files already anywhere in the destination
+        link (bool): with index, hard-link instead of skipping
+        journal (Journal): skip files an interrupted run already finished,
+            and record every handled file
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        events (EventStream): receives one event per step of every file,
+            and carries the cancel flag of the run
+        metadata (MetadataCache): extract EXIF dates in batches on a process
+            pool and reuse them across runs
+        similar (SimilarityIndex): flag or skip photos that look like one
+            already in the destination
+        scheduler (CopyScheduler): order and throttle the copies by source
+            device, destination folder and file size
+        large_workers (int): with scheduler, threads copying large files
+        manifest (Manifest): verify every copy by read-back and record its hash
+        names (DirectoryNameIndex): folder name index shared with other runs
+            into the same destination; a new one if None
+        sources (iterable): SourceFile records to use instead of scanning
+            source_dir, already filtered
+        claim (callable): called with each SourceFile; False skips it as
+            already handled by another run into the same destination
+
+    Returns:
+        int: number of files copied
+    """
+    if date_workers < 1 or copy_workers < 1:
+        raise ValueError("date_workers and copy_workers must be at least 1.")
+    if scheduler is not None and large_workers < 1:
+        raise ValueError("large_workers must be at least 1.")
+    photo_backup_utils.validate_folder_path(source_dir)
+    photo_backup_utils.validate_folder_path(destination_dir)
+
+    path_queue = queue.Queue(maxsize=queue_size)
+    copy_queue = queue.Queue(maxsize=queue_size)
+    if events is None:
+        events = photo_backup_events.EventStream()
+    counter = photo_backup_events.CounterSink()
+    events.add_sink(counter)
+
+    if names is None:
+        names = photo_backup_utils.DirectoryNameIndex(photo_backup_memory.BUDGET.max_folders())
+    copy_args = (_DirectoryLocks(), names, events, catalog, index, link, journal, similar,
+                 manifest)
+    if scheduler is None:
+        enqueue = copy_queue.put
+
+        def pending():
+            return path_queue.qsize() + copy_queue.qsize()
+        copy_threads = _start(_copy_worker, copy_workers, copy_queue, *copy_args)
+    else:
+        def enqueue(item):
+            scheduler.put(item, item[0].dev, item[2], item[0].size)
+
+        def pending():
+            return path_queue.qsize() + sum(scheduler.queue_depths().values())
+        copy_threads = _start(_scheduled_copy_worker, copy_workers, scheduler,
+                              photo_backup_scheduler.SMALL, *copy_args) + \
+            _start(_scheduled_copy_worker, large_workers, scheduler,
+                   photo_backup_scheduler.LARGE, *copy_args)
+    date_threads = _start(_date_worker, date_workers,
+                          path_queue, enqueue, destination_dir, events,
+                          catalog, journal, similar)
+    try:
+        for item in photo_backup_utils.iter_pending(
+                source_dir, supported_image_types, include, exclude,
+                catalog, journal, events, metadata, sources, claim):
+            # 超出内存预算时等下游消化已排队的文件
+            photo_backup_memory.BUDGET.throttle(pending)
+            path_queue.put(item)
+    finally:
+        for _ in date_threads:
+            path_queue.put(_STOP)
+        for thread in date_threads:
+            thread.join()
+        if scheduler is None:
+            for _ in copy_threads:
+                copy_queue.put(_STOP)
+        else:
+            scheduler.close()
+        for thread in copy_threads:
+            thread.join()
+        events.remove_sink(counter)
+
+    return counter.copied
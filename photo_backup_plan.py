@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 14:48:33
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 14:48:33
+ * @Description  : dry-run planner and plan executor for copy_photos_by_date
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import photo_backup_events
+import photo_backup_hash
+import photo_backup_scan
+import photo_backup_transfer
+import photo_backup_utils
+from photo_backup_utils import SUPPORTED_IMAGE_TYPES, COPIED, RENAMED, DUPLICATE
+
+# 计划文件格式版本
+PLAN_VERSION = 1
+# 执行计划时的默认线程数
+EXECUTE_WORKERS = 8
+
+
+def _plan_photo(file_path, destination_dir, planned, events):
+    """decide what copy_photo would do with file_path, without writing anything"""
+    file = os.path.basename(file_path)
+    date = photo_backup_utils.resolve_photo_date(file_path, events)
+    destination_dir_path = photo_backup_utils.build_destination_dir(
+        destination_dir, date)
+    destination_file_path = os.path.join(destination_dir_path, file)
+    # 本次计划中已分配到该目录的文件名 -> 源文件
+    names = planned.setdefault(destination_dir_path, {})
+    action = COPIED
+    existing = names.get(file)
+    if existing is None and os.path.exists(destination_file_path):
+        existing = destination_file_path
+    if existing is not None:
+        if photo_backup_hash.files_identical(file_path, existing):
+            action = DUPLICATE
+        else:
+            action = RENAMED
+            destination_file_path = os.path.join(
+                destination_dir_path,
+                photo_backup_utils.generate_unique_filename(
+                    destination_dir_path, file, names))
+    if action != DUPLICATE:
+        names[os.path.basename(destination_file_path)] = file_path
+    return {'source': os.path.abspath(file_path),
+            'destination': destination_file_path,
+            'action': action, 'date': date}
+
+
+def plan_copy(source_dir, destination_dir, plan_path,
+              supported_image_types=SUPPORTED_IMAGE_TYPES, include=None, exclude=None,
+              events=None):
+    """ Walk the source and write a JSONL plan of source -> destination copies
+
+    Dates are resolved exactly as copy_photos_by_date does and collisions are
+    decided against the destination as it is now plus the earlier entries of
+    the plan. Nothing is written to the destination.
+
+    Args:
+        source_dir (str): source directory
+        destination_dir (str): destination directory
+        plan_path (str): plan file to write
+        supported_image_types (tuple): file suffixes to back up
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        events (EventStream): receives scan, date and error events
+
+    Returns:
+        dict: number of planned entries per action
+    """
+    photo_backup_utils.validate_folder_path(source_dir)
+    photo_backup_utils.validate_folder_path(destination_dir)
+    source_dir = os.path.abspath(source_dir)
+    destination_dir = os.path.abspath(destination_dir)
+    if events is None:
+        events = photo_backup_events.EventStream()
+    counts = {COPIED: 0, RENAMED: 0, DUPLICATE: 0}
+    planned = {}
+    with open(plan_path, 'w', encoding='utf-8') as plan:
+        plan.write(json.dumps({'version': PLAN_VERSION,
+                               'source_dir': source_dir,
+                               'destination_dir': destination_dir},
+                              ensure_ascii=False) + '\n')
+        for source in photo_backup_scan.scan_source(
+                source_dir, supported_image_types, include, exclude,
+                events=events):
+            if events.cancelled():
+                break
+            events.emit(photo_backup_events.FILE_SCANNED, source.path, size=source.size)
+            try:
+                entry = _plan_photo(source.path, destination_dir, planned, events)
+            except Exception as e:
+                events.emit(photo_backup_events.ERROR, source.path, error=str(e))
+                continue
+            counts[entry['action']] += 1
+            plan.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    print(f"planned {counts[COPIED]} copies, {counts[RENAMED]} renamed copies, "
+          f"{counts[DUPLICATE]} duplicates")
+    return counts
+
+
+def read_plan(plan_path):
+    """ Read a plan file
+
+    Args:
+        plan_path (str): plan written by plan_copy
+
+    Returns:
+        tuple: (header dict, list of entry dicts)
+    """
+    with open(plan_path, encoding='utf-8') as plan:
+        header = json.loads(plan.readline())
+        if header.get('version') != PLAN_VERSION:
+            raise ValueError(f"{plan_path} is not a version {PLAN_VERSION} plan.")
+        return header, [json.loads(line) for line in plan if line.strip()]
+
+
+def _execute_directory(destination_dir_path, entries, events):
+    """copy the planned entries of one destination folder, return the number copied"""
+    os.makedirs(destination_dir_path, exist_ok=True)
+    count = 0
+    for entry in entries:
+        if events.cancelled():
+            break
+        file_path = entry['source']
+        destination_file_path = entry['destination']
+        try:
+            size = os.path.getsize(file_path)
+            events.emit(photo_backup_events.FILE_SCANNED, file_path, size=size)
+            action = entry['action']
+            if os.path.exists(destination_file_path):
+                if photo_backup_hash.files_identical(file_path, destination_file_path):
+                    # 上一次执行已经复制过
+                    events.emit(photo_backup_events.UNCHANGED_SKIPPED, file_path)
+                    continue
+                # 按源文件名重新编号，不在已编号的名字后面再加编号
+                action = RENAMED
+                destination_file_path = os.path.join(
+                    destination_dir_path,
+                    photo_backup_utils.generate_unique_filename(
+                        destination_dir_path, os.path.basename(file_path)))
+            photo_backup_transfer.copy_file(
+                file_path, destination_file_path, metadata=action == RENAMED)
+            count += 1
+            events.emit(photo_backup_utils.RESULT_EVENTS[action], file_path,
+                        destination=destination_file_path, size=size)
+        except Exception as e:
+            events.emit(photo_backup_events.ERROR, file_path, error=str(e))
+    return count
+
+
+def execute_plan(plan_path, workers=EXECUTE_WORKERS, events=None):
+    """ Apply a plan written by plan_copy
+
+    Entries are grouped by destination folder and the folders are copied in
+    parallel, each folder in one worker, sorted for locality. Entries whose
+    destination already holds the same bytes are skipped, so a failed run
+    can simply be executed again.
+
+    Args:
+        plan_path (str): plan file
+        workers (int): folders copied at the same time
+        events (EventStream): receives one event per step of every entry,
+            and carries the cancel flag of the run
+
+    Returns:
+        int: number of files copied
+    """
+    header, entries = read_plan(plan_path)
+    photo_backup_utils.validate_folder_path(header['destination_dir'])
+    if events is None:
+        events = photo_backup_events.EventStream()
+    by_directory = {}
+    for entry in entries:
+        if entry['action'] != DUPLICATE:
+            by_directory.setdefault(
+                os.path.dirname(entry['destination']), []).append(entry)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        counts = executor.map(lambda item: _execute_directory(*item, events),
+                              sorted(by_directory.items()))
+        file_count = sum(counts)
+    print(f"{file_count} files copied")
+    return file_count
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 18:05:42
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 18:05:42
+ * @Description  : per-stage timing of backup runs (--profile)
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import contextlib
+import heapq
+import math
+import threading
+import time
+
+# 各阶段名称，按报告中的顺序排列
+DATE_EXIF = 'date.exif'
+DATE_FILENAME = 'date.filename'
+EXISTS = 'exists'
+MAKEDIRS = 'makedirs'
+COMPARE = 'compare'
+COPY = 'copy'
+LINK = 'link'
+STAGES = (DATE_EXIF, DATE_FILENAME, EXISTS, MAKEDIRS, COMPARE, COPY, LINK)
+# 报告中列出的最慢文件数
+SLOWEST_FILES = 10
+
+
+def percentile(values, fraction):
+    """nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    position = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[position]
+
+
+class StageProfiler:
+    """ Wall time, counts and bytes per backup stage, plus the time spent per file
+
+    Disabled by default: timed() then returns a shared no-op context, so the
+    instrumented code pays next to nothing outside --profile runs. Safe to
+    use from several worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """drop every sample"""
+        with self._lock:
+            self.samples = {}
+            self.bytes = {}
+            self.files = {}
+            self.start = time.perf_counter()
+
+    def timed(self, stage, path=None, size=None):
+        """ Time a block as one sample of stage
+
+        Args:
+            stage (str): stage name, see STAGES
+            path (str): source file the work was done for
+            size (int): bytes processed, for the throughput column
+
+        Returns:
+            context manager
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(stage, path, size)
+
+    @contextlib.contextmanager
+    def _timed(self, stage, path, size):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, path, size)
+
+    def add(self, stage, seconds, path=None, size=None):
+        """record one sample"""
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+            if size:
+                self.bytes[stage] = self.bytes.get(stage, 0) + size
+            if path is not None:
+                self.files[path] = self.files.get(path, 0.0) + seconds
+
+    def report(self, slowest=SLOWEST_FILES):
+        """ Format the timing table and the slowest files
+
+        Args:
+            slowest (int): number of files to list
+
+        Returns:
+            str: multi-line report
+        """
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            sizes = dict(self.bytes)
+            files = heapq.nlargest(slowest, self.files.items(), key=lambda item: item[1])
+            wall = time.perf_counter() - self.start
+        lines = [f"profile: {wall:.3f} s wall time",
+                 f"{'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}"
+                 f"{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'MB/s':>10}"]
+        order = [stage for stage in STAGES if stage in samples] + \
+            sorted(stage for stage in samples if stage not in STAGES)
+        for stage in order:
+            values = samples[stage]
+            total = sum(values)
+            rate = f"{sizes[stage] / total / 1024 / 1024:.1f}" \
+                if sizes.get(stage) and total else '-'
+            lines.append(
+                f"{stage:<14}{len(values):>8}{total:>10.3f}"
+                f"{percentile(values, 0.5) * 1e3:>10.2f}"
+                f"{percentile(values, 0.9) * 1e3:>10.2f}"
+                f"{percentile(values, 0.99) * 1e3:>10.2f}"
+                f"{values[-1] * 1e3:>10.2f}{rate:>10}")
+        if files:
+            lines.append(f"slowest {len(files)} files:")
+            for path, seconds in files:
+                lines.append(f"{seconds * 1e3:10.2f} ms  {path}")
+        return "\n".join(lines)
+
+
+# 全局实例，命令行 --profile 时启用
+PROFILER = StageProfiler()
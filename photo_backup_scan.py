@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 16:20:47
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 16:20:47
+ * @Description  : os.scandir based streaming source scanner
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import fnmatch
+import os
+from stat import S_ISREG
+
+import photo_backup_events
+
+# 默认跳过的目录：群晖索引/回收站/快照目录
+PRUNE_DIRS = frozenset(('@eaDir', '#recycle', '#snapshot', '@Recycle', '.@__thumb'))
+
+
+class SourceFile:
+    """one scanned source file, with the stat fields the backup needs"""
+
+    __slots__ = ('path', 'name', 'parent', 'size', 'mtime', 'inode', 'dev')
+
+    def __init__(self, path, name, parent, size, mtime, inode, dev):
+        self.path = path
+        self.name = name
+        self.parent = parent
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.dev = dev
+
+    def __repr__(self):
+        return f"SourceFile({self.path!r}, size={self.size})"
+
+
+def normalize_extensions(supported_image_types):
+    """ Turn suffixes like ('.jpg', 'JPG', 'png') into {'.jpg', '.png'}
+
+    Args:
+        supported_image_types (iterable): file suffixes, any case, dot optional
+
+    Returns:
+        frozenset: lower-case suffixes with a leading dot
+    """
+    if isinstance(supported_image_types, str):
+        supported_image_types = (supported_image_types,)
+    return frozenset(
+        (suffix if suffix.startswith('.') else '.' + suffix).lower()
+        for suffix in supported_image_types)
+
+
+def _matches(patterns, name, relative_path):
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern)
+               for pattern in patterns)
+
+
+def _report_error(events, path, error):
+    if events is None:
+        print(error)
+    else:
+        events.emit(photo_backup_events.ERROR, path, error=str(error))
+
+
+def scan_file(path, source_dir, supported_image_types, include=None, exclude=None,
+              prune=PRUNE_DIRS):
+    """ Apply the filters of scan_source to one file under source_dir
+
+    Args:
+        path (str): file path
+        source_dir (str): source directory the filters are relative to
+        supported_image_types (iterable): file suffixes to back up
+        include (list): glob patterns a file name or relative path must match
+        exclude (list): glob patterns of file or directory names/relative
+            paths to leave out
+        prune (iterable): directory names never entered
+
+    Returns:
+        SourceFile: the record, or None if scan_source would not yield path
+        or it is no longer a regular file
+    """
+    if not matches_filters(path, source_dir, supported_image_types, include, exclude, prune):
+        return None
+    try:
+        stat = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    return SourceFile(path, os.path.basename(path), os.path.dirname(path), stat.st_size,
+                      stat.st_mtime, stat.st_ino, stat.st_dev)
+
+
+def matches_filters(path, source_dir, supported_image_types, include=None, exclude=None,
+                    prune=PRUNE_DIRS):
+    """ True if scan_source(source_dir, ...) would yield path, judging by its name only
+
+    Args:
+        path (str): file path
+        source_dir (str): source directory the filters are relative to
+        supported_image_types (iterable): file suffixes to back up
+        include (list): glob patterns a file name or relative path must match
+        exclude (list): glob patterns of file or directory names/relative
+            paths to leave out
+        prune (iterable): directory names never entered
+    """
+    name = os.path.basename(path)
+    if os.path.splitext(name)[1].lower() not in normalize_extensions(supported_image_types):
+        return False
+    relative_path = os.path.relpath(path, source_dir)
+    parts = relative_path.split(os.sep)
+    if parts[0] == os.pardir:
+        return False
+    prune = frozenset(prune or ())
+    for depth, part in enumerate(parts[:-1]):
+        if part in prune or (exclude and _matches(exclude, part, os.path.join(*parts[:depth + 1]))):
+            return False
+    if include and not _matches(include, name, relative_path):
+        return False
+    return not (exclude and _matches(exclude, name, relative_path))
+
+
+def scan_source(source_dir, supported_image_types, include=None, exclude=None,
+                prune=PRUNE_DIRS, events=None):
+    """ Yield the image files under source_dir, one directory listing at a time
+
+    Directories are read with os.scandir and never materialised as lists;
+    the files of a directory are yielded before its subdirectories, like
+    os.walk. Suffixes are matched case-insensitively and only matching
+    files are stat'ed.
+
+    Args:
+        source_dir (str): source directory
+        supported_image_types (iterable): file suffixes to back up
+        include (list): glob patterns a file name or relative path must match
+        exclude (list): glob patterns of file or directory names/relative
+            paths to leave out; excluded directories are not entered
+        prune (iterable): directory names never entered
+        events (EventStream): receives an error event for unreadable
+            folders and files; printed when None
+
+    Yields:
+        SourceFile: one record per matching file
+    """
+    extensions = normalize_extensions(supported_image_types)
+    include = list(include or ())
+    exclude = list(exclude or ())
+    prune = frozenset(prune or ())
+    stack = [source_dir]
+    while stack:
+        directory = stack.pop()
+        subdirs = []
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            _report_error(events, directory, e)
+            continue
+        with entries:
+            for entry in entries:
+                name = entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                relative_path = os.path.relpath(entry.path, source_dir) \
+                    if include or exclude else name
+                if is_dir:
+                    if name not in prune and not (exclude and _matches(exclude, name, relative_path)):
+                        subdirs.append(entry.path)
+                    continue
+                if os.path.splitext(name)[1].lower() not in extensions:
+                    continue
+                if include and not _matches(include, name, relative_path):
+                    continue
+                if exclude and _matches(exclude, name, relative_path):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    _report_error(events, entry.path, e)
+                    continue
+                yield SourceFile(entry.path, name, directory, stat.st_size,
+                                 stat.st_mtime, stat.st_ino, stat.st_dev)
+        # 逆序入栈，保持与 os.walk 相同的子目录顺序
+        stack.extend(reversed(subdirs))
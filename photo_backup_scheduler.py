@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 21:58:40
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 21:58:40
+ * @Description  : device- and folder-aware copy scheduler with bandwidth/IOPS caps
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import collections
+import threading
+import time
+
+# 两条通道：大文件（视频等）与小文件（照片）分开排队
+SMALL = 'small'
+LARGE = 'large'
+# 不小于这个字节数的文件走大文件通道
+LARGE_FILE_SIZE = 32 * 1024 * 1024
+# 排队中的文件数上限，超出时提交方阻塞
+MAX_PENDING = 256
+
+
+class RateLimiter:
+    """ Token bucket shared by threads
+
+    An acquire larger than the bucket is let through and paid back by
+    making the following callers wait, so one big file is not refused.
+
+    Args:
+        rate (float): units per second; None or 0 for no limit
+        burst (float): units that may be taken at once after an idle period,
+            one second of rate if None
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate or None
+        self.burst = burst if burst is not None else (rate or 0)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.waited = 0.0
+
+    def acquire(self, amount=1):
+        """take amount units, sleeping while the bucket is in debt"""
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+
+
+class CopyScheduler:
+    """ Queue of pending copies grouped by source device and destination folder
+
+    Copy workers take whole runs of one destination folder from one device,
+    so both disks see mostly sequential work, and each worker prefers the
+    device with the fewest copies in progress, so a slow device holds at
+    most the workers already on it. A folder is served by one worker at a
+    time, which keeps the files of a folder in scan order. Large files wait
+    in their own lane: small-lane workers never pick them up, large-lane
+    workers fall back to small files when no large file is waiting.
+
+    Args:
+        large_file_size (int): bytes from which a file goes to the large lane
+        bandwidth (float): bytes per second over all copies, None for no cap
+        iops (float): files per second over all copies, None for no cap
+        max_pending (int): files queued at once before put blocks
+    """
+
+    def __init__(self, large_file_size=LARGE_FILE_SIZE, bandwidth=None, iops=None,
+                 max_pending=MAX_PENDING):
+        self.large_file_size = large_file_size
+        self.bandwidth = RateLimiter(bandwidth)
+        self.iops = RateLimiter(iops)
+        self.max_pending = max_pending
+        self._condition = threading.Condition()
+        # 设备 -> 通道 -> 目标目录 -> 待复制的队列，目录按首次出现的顺序
+        self._queues = {}
+        # 设备 -> 排队中的文件数 / 正在复制的文件数 / 排队的峰值
+        self._depths = collections.Counter()
+        self._active = collections.Counter()
+        self._peaks = collections.Counter()
+        # 各通道排队中的文件数
+        self._lane_depths = collections.Counter()
+        # 正在被某个工作线程处理的目标目录
+        self._busy_folders = set()
+        self._pending = 0
+        self._closed = False
+
+    def lane(self, size):
+        """the lane of a file of size bytes"""
+        return LARGE if size >= self.large_file_size else SMALL
+
+    def put(self, item, device, folder, size):
+        """ Queue a copy, blocking while max_pending copies are waiting
+
+        Args:
+            item: what get returns for this copy
+            device (int): st_dev of the source file
+            folder (str): destination folder
+            size (int): bytes to copy
+        """
+        lane = self.lane(size)
+        with self._condition:
+            while self._pending >= self.max_pending and not self._closed:
+                self._condition.wait()
+            lanes = self._queues.setdefault(device, {SMALL: {}, LARGE: {}})
+            lanes[lane].setdefault(folder, collections.deque()).append((item, size))
+            self._pending += 1
+            self._lane_depths[lane] += 1
+            self._depths[device] += 1
+            self._peaks[device] = max(self._peaks[device], self._depths[device])
+            self._condition.notify_all()
+
+    def _pick(self, lanes):
+        """(device, lane, folder) of the next copy, or None if none can start"""
+        for lane in lanes:
+            if not self._lane_depths[lane]:
+                continue
+            # 优先正在复制的文件最少的设备，其次是排队最多的设备
+            devices = sorted(self._queues, key=lambda device: (self._active[device],
+                                                               -self._depths[device]))
+            for device in devices:
+                for folder, pending in self._queues[device][lane].items():
+                    if pending and folder not in self._busy_folders:
+                        return device, lane, folder
+        return None
+
+    def get(self, lane=SMALL):
+        """ Take the next copy of a lane, waiting for one if needed
+
+        Call done with the returned device and folder when the copy is over.
+
+        Args:
+            lane (str): SMALL or LARGE; LARGE also serves small files
+
+        Returns:
+            tuple: (item, device, folder, size), or None once close was called
+            and the lane is drained
+        """
+        lanes = (LARGE, SMALL) if lane == LARGE else (SMALL,)
+        with self._condition:
+            while True:
+                picked = self._pick(lanes)
+                if picked is not None:
+                    break
+                if self._closed and not any(self._lane_depths[name] for name in lanes):
+                    return None
+                self._condition.wait()
+            device, lane, folder = picked
+            folders = self._queues[device][lane]
+            item, size = folders[folder].popleft()
+            if not folders[folder]:
+                del folders[folder]
+            self._pending -= 1
+            self._lane_depths[lane] -= 1
+            self._depths[device] -= 1
+            self._active[device] += 1
+            self._busy_folders.add(folder)
+            self._condition.notify_all()
+        return item, device, folder, size
+
+    def throttle(self, size):
+        """wait until the bandwidth and IOPS caps allow copying size bytes"""
+        self.iops.acquire(1)
+        self.bandwidth.acquire(size)
+
+    def done(self, device, folder):
+        """mark a copy taken with get as finished"""
+        with self._condition:
+            self._active[device] -= 1
+            self._busy_folders.discard(folder)
+            self._condition.notify_all()
+
+    def close(self):
+        """accept no more copies; get returns None once the queues are empty"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def queue_depths(self):
+        """files waiting per source device, as {st_dev: count}"""
+        with self._condition:
+            return {device: depth for device, depth in self._depths.items() if depth}
+
+    def summary(self):
+        """peak queue depth per device and time the copies waited on the caps"""
+        with self._condition:
+            peaks = ", ".join(f"device {device}: {peak}"
+                              for device, peak in sorted(self._peaks.items()))
+        return (f"peak queue depth {peaks or 'none'}; copies waited "
+                f"{self.bandwidth.waited + self.iops.waited:.1f}s on the caps")
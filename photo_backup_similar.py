@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 20:41:09
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 20:41:09
+ * @Description  : perceptual hashes and a multi-index hash table of near-duplicate photos
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+import photo_backup_dedupe
+import photo_backup_hash
+import photo_backup_memory
+import photo_backup_scan
+import photo_backup_utils
+
+# 哈希数据库文件名，保存在目标根目录下
+SIMILAR_NAME = '.photo_backup.similar.db'
+# 感知哈希的种类
+HASH_NAMES = ('ahash', 'dhash', 'phash')
+DEFAULT_HASH = 'phash'
+# 默认的汉明距离阈值（64 位中不同的位数）
+DEFAULT_THRESHOLD = 8
+# 计算哈希前先缩小到的边长
+HASH_DECODE_SIZE = 64
+# pHash 先缩放到的边长，再取左上角 8x8 的 DCT 系数
+PHASH_SIZE = 32
+# 每写入多少条记录提交一次事务
+COMMIT_INTERVAL = 500
+# 建立索引时每个进程任务处理的文件数
+CHUNK_SIZE = 32
+
+# DCT-II 余弦表：_DCT[u][x] = cos((2x + 1) u pi / 2N)，只需要前 8 个频率
+_DCT = [[math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+        for u in range(8)]
+
+
+def _bits(flags):
+    value = 0
+    for flag in flags:
+        value = (value << 1) | bool(flag)
+    return value
+
+
+def average_hash(image):
+    """64-bit aHash of a grayscale image: 8x8 pixels above or below their mean"""
+    pixels = list(image.resize((8, 8), Image.BILINEAR).getdata())
+    mean = sum(pixels) / len(pixels)
+    return _bits(pixel > mean for pixel in pixels)
+
+
+def difference_hash(image):
+    """64-bit dHash of a grayscale image: is each pixel of a 9x8 copy brighter than its right neighbour"""
+    pixels = list(image.resize((9, 8), Image.BILINEAR).getdata())
+    return _bits(pixels[row * 9 + column] > pixels[row * 9 + column + 1]
+                 for row in range(8) for column in range(8))
+
+
+def perceptual_hash(image):
+    """64-bit pHash of a grayscale image: low 8x8 DCT coefficients of a 32x32 copy above their median"""
+    pixels = list(image.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR).getdata())
+    rows = [pixels[start:start + PHASH_SIZE]
+            for start in range(0, len(pixels), PHASH_SIZE)]
+    # 先对每行做 DCT，只保留前 8 个频率，再对列做 DCT
+    row_dct = [[sum(c * p for c, p in zip(cosines, row)) for cosines in _DCT] for row in rows]
+    coefficients = [sum(_DCT[v][y] * row_dct[y][u] for y in range(PHASH_SIZE))
+                    for v in range(8) for u in range(8)]
+    # 直流分量不参与中位数
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    return _bits(coefficient > median for coefficient in coefficients)
+
+
+def image_hashes(file_path):
+    """ All three perceptual hashes of a photo, from one reduced decode
+
+    Args:
+        file_path (str): photo path
+
+    Returns:
+        dict: 'ahash', 'dhash' and 'phash' as 64-bit ints
+    """
+    image = photo_backup_utils.load_image_reduced(file_path, HASH_DECODE_SIZE, 'L')
+    return {'ahash': average_hash(image), 'dhash': difference_hash(image),
+            'phash': perceptual_hash(image)}
+
+
+def hamming(first, second):
+    """number of differing bits"""
+    return (first ^ second).bit_count()
+
+
+def _masks(bits, weight):
+    """every bits-wide mask with at most weight bits set"""
+    return [mask for count in range(weight + 1)
+            for mask in _combinations(bits, count)]
+
+
+def _combinations(bits, count):
+    if count == 0:
+        return [0]
+    return [(1 << high) | rest for high in range(count - 1, bits)
+            for rest in _combinations(high, count - 1)]
+
+
+class HashIndex:
+    """ Multi-index hashing over 64-bit hashes with the Hamming distance
+
+    Each hash is split into CHUNKS 16-bit pieces with one table per piece.
+    Two hashes within radius r share at least one piece within r // CHUNKS
+    bits (pigeonhole), so a lookup probes only the table entries near the
+    query's pieces and checks the few hashes found there, instead of
+    comparing against every hash in the index.
+
+    Args:
+        radius (int): the largest distance search() will be asked for
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self, radius):
+        self.radius = radius
+        self._masks = _masks(self.CHUNK_BITS, radius // self.CHUNKS)
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        # 哈希 -> 条目列表
+        self._items = {}
+
+    def __len__(self):
+        return sum(len(items) for items in self._items.values())
+
+    def _pieces(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (position * self.CHUNK_BITS)) & mask
+                for position in range(self.CHUNKS)]
+
+    def add(self, value, item):
+        """insert item under hash value"""
+        items = self._items.get(value)
+        if items is None:
+            items = self._items[value] = []
+            for table, piece in zip(self._tables, self._pieces(value)):
+                table.setdefault(piece, set()).add(value)
+        items.append(item)
+
+    def remove(self, value, item):
+        """remove item from under hash value, if present"""
+        items = self._items.get(value)
+        if items is None or item not in items:
+            return
+        items.remove(item)
+        if not items:
+            del self._items[value]
+            for table, piece in zip(self._tables, self._pieces(value)):
+                table[piece].discard(value)
+                if not table[piece]:
+                    del table[piece]
+
+    def search(self, value, radius=None):
+        """ Items within radius of value
+
+        Returns:
+            list: (distance, item) pairs, closest first
+        """
+        radius = self.radius if radius is None else min(radius, self.radius)
+        candidates = set()
+        for table, piece in zip(self._tables, self._pieces(value)):
+            for mask in self._masks:
+                bucket = table.get(piece ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for candidate in candidates:
+            distance = hamming(value, candidate)
+            if distance <= radius:
+                found.extend((distance, item) for item in self._items[candidate])
+        found.sort()
+        return found
+
+
+def _to_signed(value):
+    """store a 64-bit unsigned hash in an SQLite INTEGER"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _same_bytes(first_path, second_path):
+    """True if both files exist and hold the same content"""
+    try:
+        return photo_backup_hash.files_identical(first_path, second_path)
+    except OSError:
+        return False
+
+
+def _hash_chunk(paths):
+    """process pool task: hashes or None per path"""
+    results = []
+    for path in paths:
+        try:
+            results.append(image_hashes(path))
+        except Exception:
+            results.append(None)
+    return results
+
+
+class SimilarityIndex:
+    """ Perceptual hashes of the destination photos, indexed for Hamming lookups
+
+    Hashes are kept in an SQLite file in the destination root, keyed by path
+    and checked against size and mtime, so only new or changed files are
+    decoded when the index is loaded. Safe to share between worker threads.
+
+    Args:
+        destination_dir (str): destination directory
+        threshold (int): max Hamming distance of a near-duplicate
+        hash_name (str): 'phash', 'dhash' or 'ahash', the hash compared
+        skip (bool): skip near-duplicates during backup instead of only
+            flagging them
+        supported_image_types (tuple): suffixes of the files to index
+    """
+
+    def __init__(self, destination_dir, threshold=DEFAULT_THRESHOLD, hash_name=DEFAULT_HASH,
+                 skip=False, supported_image_types=photo_backup_utils.SUPPORTED_IMAGE_TYPES):
+        if hash_name not in HASH_NAMES:
+            raise ValueError(f"unknown hash {hash_name}, expected one of {HASH_NAMES}.")
+        self.destination_dir = destination_dir
+        self.threshold = threshold
+        self.hash_name = hash_name
+        self.skip = skip
+        self.extensions = photo_backup_scan.normalize_extensions(supported_image_types)
+        self.path = os.path.join(destination_dir, SIMILAR_NAME)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._pending = 0
+        self._hashes = None
+        # 本次运行中已占用、尚未复制完成的源文件 -> 哈希
+        self._claimed = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " ahash INTEGER NOT NULL,"
+            " dhash INTEGER NOT NULL,"
+            " phash INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _store(self, path, size, mtime, hashes):
+        """write one row; call with the lock held"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime, ahash, dhash, phash)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime) + tuple(_to_signed(hashes[name]) for name in HASH_NAMES))
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self._conn.commit()
+            self._pending = 0
+
+    def load(self, workers=None):
+        """ Build the hash index from the destination, hashing new or changed files
+
+        Called on the first lookup; call it directly to pick the number of
+        hashing processes.
+
+        Args:
+            workers (int): processes hashing new files, os.cpu_count() if None
+        """
+        with self._load_lock:
+            if self._hashes is not None:
+                return
+            with self._lock:
+                rows = {row[0]: row[1:] for row in self._conn.execute(
+                    "SELECT path, size, mtime, ahash, dhash, phash FROM hashes")}
+            known = {}
+            missing = []
+            for path, stat in photo_backup_dedupe.iter_archive_files(self.destination_dir):
+                if os.path.splitext(path)[1].lower() not in self.extensions:
+                    continue
+                row = rows.get(path)
+                if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                    known[path] = dict(zip(HASH_NAMES, map(_to_unsigned, row[2:])))
+                else:
+                    missing.append((path, stat))
+            if missing:
+                chunks = [[path for path, _ in missing[start:start + CHUNK_SIZE]]
+                          for start in range(0, len(missing), CHUNK_SIZE)]
+                with photo_backup_memory.process_pool(max_workers=workers) as pool:
+                    results = [hashes for chunk in pool.map(_hash_chunk, chunks)
+                               for hashes in chunk]
+                with self._lock:
+                    for (path, stat), hashes in zip(missing, results):
+                        if hashes is not None:
+                            self._store(path, stat.st_size, stat.st_mtime, hashes)
+                            known[path] = hashes
+            hashes_index = HashIndex(self.threshold)
+            for path, hashes in known.items():
+                hashes_index.add(hashes[self.hash_name], path)
+            with self._lock:
+                self._hashes = hashes_index
+
+    def find(self, hashes):
+        """ The closest indexed photo within the threshold
+
+        Args:
+            hashes (dict): image_hashes() of the photo to look up
+
+        Returns:
+            tuple: (path, distance), or None
+        """
+        self.load()
+        with self._lock:
+            found = self._hashes.search(hashes[self.hash_name], self.threshold)
+        return (found[0][1], found[0][0]) if found else None
+
+    def claim(self, file_path):
+        """ Look up a source photo and, when it has no near-duplicate, reserve it
+
+        The reservation makes later near-duplicates in the same run match this
+        file even before it has been copied. Call settle() once the file is
+        handled. A match holding the very same bytes is an exact duplicate,
+        left to the copy stage to detect: the photo is then neither reported
+        nor reserved.
+
+        Args:
+            file_path (str): source photo
+
+        Returns:
+            tuple: (path, distance) of the near-duplicate, or None
+        """
+        self.load()
+        try:
+            hashes = image_hashes(file_path)
+        except Exception:
+            # PIL 无法解码的文件不参与相似度比较
+            return None
+        value = hashes[self.hash_name]
+        with self._lock:
+            found = self._hashes.search(value, self.threshold)
+            if not found:
+                self._hashes.add(value, file_path)
+                self._claimed[file_path] = hashes
+                return None
+        if any(_same_bytes(file_path, path) for _, path in found):
+            return None
+        return found[0][1], found[0][0]
+
+    def settle(self, file_path, destination_path=None):
+        """ Finish a claimed source photo
+
+        Args:
+            file_path (str): source photo passed to claim()
+            destination_path (str): where it was copied, or None if it was not
+        """
+        with self._lock:
+            hashes = self._claimed.pop(file_path, None)
+            if hashes is None:
+                return
+            value = hashes[self.hash_name]
+            self._hashes.remove(value, file_path)
+            if destination_path is None:
+                return
+            self._hashes.add(value, destination_path)
+        try:
+            stat = os.stat(destination_path)
+        except OSError:
+            return
+        with self._lock:
+            self._store(destination_path, stat.st_size, stat.st_mtime, hashes)
+
+    def groups(self):
+        """ Near-duplicate groups among the indexed photos
+
+        Returns:
+            list: lists of paths, each sorted, with more than one path
+        """
+        self.load()
+        with self._lock:
+            rows = list(self._conn.execute(f"SELECT path, {self.hash_name} FROM hashes"))
+            hashes_index = self._hashes
+        seen = set()
+        groups = []
+        for path, value in sorted(rows):
+            if path in seen or not os.path.exists(path):
+                continue
+            found = hashes_index.search(_to_unsigned(value), self.threshold)
+            group = sorted({item for _, item in found} - seen)
+            if len(group) > 1:
+                groups.append(group)
+            seen.update(group)
+        return groups
+
+    def close(self):
+        """commit pending rows and close the database"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def report_similar_existing(destination_dir, threshold=DEFAULT_THRESHOLD, hash_name=DEFAULT_HASH):
+    """ Print the near-duplicate groups already in the destination
+
+    Nothing is deleted: near-duplicates are different files and need a
+    person to choose which one to keep.
+
+    Args:
+        destination_dir (str): destination directory
+        threshold (int): max Hamming distance of a near-duplicate
+        hash_name (str): 'phash', 'dhash' or 'ahash'
+
+    Returns:
+        list: the groups, see SimilarityIndex.groups
+    """
+    photo_backup_utils.validate_folder_path(destination_dir)
+    with SimilarityIndex(destination_dir, threshold, hash_name) as index:
+        groups = index.groups()
+    for group in groups:
+        print("near-duplicates:")
+        for path in group:
+            print(f"    {path}")
+    print(f"{len(groups)} groups of near-duplicates")
+    return groups
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 21:32:16
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 21:32:16
+ * @Description  : content-addressed thumbnail cache beside the backup tree
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+
+from PIL import features
+
+import photo_backup_dedupe
+import photo_backup_events
+import photo_backup_hash
+import photo_backup_memory
+import photo_backup_scan
+import photo_backup_transfer
+import photo_backup_utils
+
+# 缩略图目录，位于目标根目录下；以 . 开头，归档扫描会跳过
+THUMBNAIL_DIR = '.thumbnails'
+# 缩略图索引：归档文件 -> 内容哈希
+INDEX_NAME = 'index.db'
+# 默认生成的缩略图边长
+DEFAULT_SIZES = (256, 1024)
+# 默认格式：Pillow 支持时使用 WebP
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+DEFAULT_FORMAT = 'webp' if features.check('webp') else 'jpeg'
+QUALITY = 80
+# 等待生成的文件数上限，超出时提交方阻塞
+MAX_PENDING = 256
+# 事件接收端最多积压多少个待提交的文件，超出时发出事件的线程才等待
+MAX_BACKLOG = 10000
+# 通知提交线程结束的哨兵
+_STOP = None
+# 每写入多少条记录提交一次事务
+COMMIT_INTERVAL = 500
+
+
+def thumbnail_path(destination_dir, digest, size, fmt=DEFAULT_FORMAT):
+    """where the size-pixel thumbnail of content digest is stored"""
+    return os.path.join(destination_dir, THUMBNAIL_DIR, str(size), digest[:2],
+                        f"{digest}.{fmt}")
+
+
+def make_thumbnails(file_path, destination_dir, sizes=DEFAULT_SIZES, fmt=DEFAULT_FORMAT,
+                    algorithm=None):
+    """ Write the missing thumbnails of one photo
+
+    The photo is decoded once, at the largest size, through the reduced
+    decode layer; smaller sizes are scaled from that. Content that already
+    has every thumbnail is not decoded at all.
+
+    Args:
+        file_path (str): photo to thumbnail
+        destination_dir (str): destination root holding the cache
+        sizes (tuple): longest side of each thumbnail
+        fmt (str): 'webp' or 'jpeg'
+        algorithm (str): content hash, see photo_backup_hash.new_hash
+
+    Returns:
+        tuple: (content digest, number of thumbnails written)
+    """
+    digest = photo_backup_hash.file_digest(file_path, algorithm, stats=None)
+    missing = [size for size in sorted(sizes, reverse=True)
+               if not os.path.exists(thumbnail_path(destination_dir, digest, size, fmt))]
+    if not missing:
+        return digest, 0
+    image = photo_backup_utils.load_image_reduced(
+        file_path, missing[0], 'RGB', transpose=True, budget=None)
+    for size in missing:
+        image.thumbnail((size, size))
+        path = thumbnail_path(destination_dir, digest, size, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = _partial_path(path)
+        image.save(temp_path, FORMATS[fmt], quality=QUALITY)
+        os.replace(temp_path, path)
+    return digest, len(missing)
+
+
+def _partial_path(path):
+    """temporary name of a thumbnail being written, unique per process"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}{photo_backup_transfer.PARTIAL_SUFFIX}")
+
+
+class ThumbnailGenerator:
+    """ Generate thumbnails on a process pool while the backup copies files
+
+    Also an event sink: attached to the EventStream of a run, it queues
+    every copied, renamed or linked photo. At most max_pending photos wait
+    in the pool at once; beyond that submit blocks until the pool catches
+    up. The sink never calls submit itself: it hands the photo to a feeder
+    thread through a backlog of max_backlog photos, so the thread emitting
+    the events (the event loop of the async engine) only waits when the
+    backlog is full.
+
+    Args:
+        destination_dir (str): destination root holding the cache
+        sizes (tuple): longest side of each thumbnail
+        fmt (str): 'webp' or 'jpeg'
+        workers (int): processes generating thumbnails, os.cpu_count() if None
+        max_pending (int): photos queued or in progress at once
+        max_backlog (int): photos from events waiting to be submitted
+    """
+
+    def __init__(self, destination_dir, sizes=DEFAULT_SIZES, fmt=DEFAULT_FORMAT,
+                 workers=None, max_pending=MAX_PENDING, max_backlog=MAX_BACKLOG):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown thumbnail format {fmt}, expected one of {tuple(FORMATS)}.")
+        self.destination_dir = destination_dir
+        self.sizes = tuple(sizes)
+        self.fmt = fmt
+        self.algorithm = photo_backup_hash.DEFAULT_ALGORITHM
+        self._executor = photo_backup_memory.process_pool(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.created = 0
+        self.cached = 0
+        self.failed = 0
+        index_dir = os.path.join(destination_dir, THUMBNAIL_DIR)
+        os.makedirs(index_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(index_dir, INDEX_NAME),
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            " path TEXT PRIMARY KEY,"
+            " digest TEXT NOT NULL)")
+        self._conn.commit()
+        self._backlog = queue.Queue(maxsize=max_backlog)
+        self._feeder = threading.Thread(target=self._feed, name='thumbnail-feeder')
+        self._feeder.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __call__(self, event):
+        if event['event'] in (photo_backup_events.COPIED, photo_backup_events.RENAMED,
+                              photo_backup_events.LINKED):
+            # 源文件与归档文件内容相同，从本地的源文件读取
+            self._backlog.put((event['path'], event['destination']))
+
+    def _feed(self):
+        while True:
+            item = self._backlog.get()
+            if item is _STOP:
+                return
+            try:
+                self.submit(*item)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"thumbnail of {item[0]} failed: {e}")
+
+    def submit(self, file_path, archived_path=None):
+        """ Queue a photo
+
+        Args:
+            file_path (str): file to read
+            archived_path (str): its path in the destination, recorded in the
+                index; file_path when None
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(make_thumbnails, file_path, self.destination_dir,
+                                           self.sizes, self.fmt, self.algorithm)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(
+            lambda done: self._done(done, file_path, archived_path or file_path))
+
+    def _done(self, future, file_path, archived_path):
+        try:
+            try:
+                digest, created = future.result()
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"thumbnail of {file_path} failed: {e}")
+                return
+            relative_path = os.path.relpath(archived_path, self.destination_dir)
+            with self._lock:
+                self.created += created
+                self.cached += not created
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO thumbnails (path, digest) VALUES (?, ?)",
+                    (relative_path, digest))
+                self._pending += 1
+                if self._pending >= COMMIT_INTERVAL:
+                    self._conn.commit()
+                    self._pending = 0
+        finally:
+            self._slots.release()
+
+    def lookup(self, archived_path, size):
+        """the thumbnail path of an archived photo, or None if it has none yet"""
+        relative_path = os.path.relpath(archived_path, self.destination_dir)
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM thumbnails WHERE path = ?",
+                                     (relative_path,)).fetchone()
+        if row is None:
+            return None
+        path = thumbnail_path(self.destination_dir, row[0], size, self.fmt)
+        return path if os.path.exists(path) else None
+
+    def summary(self):
+        """one-line report"""
+        return (f"{self.created} thumbnails written, {self.cached} photos already "
+                f"thumbnailed, {self.failed} failed")
+
+    def close(self):
+        """wait for the queued photos, then close the index"""
+        if self._executor is None:
+            return
+        self._backlog.put(_STOP)
+        self._feeder.join()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+def retarget_index(destination_dir, moves):
+    """ Move the index rows of removed archived files to the files replacing them
+
+    Thumbnails are stored by content, so a duplicate's row is simply
+    carried over to the kept file when that has none yet.
+
+    Args:
+        destination_dir (str): destination root holding the cache
+        moves (list): (removed path, kept path) pairs
+    """
+    index_path = os.path.join(destination_dir, THUMBNAIL_DIR, INDEX_NAME)
+    if not moves or not os.path.exists(index_path):
+        return
+    conn = sqlite3.connect(index_path)
+    try:
+        for removed_path, kept_path in moves:
+            removed = os.path.relpath(removed_path, destination_dir)
+            conn.execute("UPDATE OR IGNORE thumbnails SET path = ? WHERE path = ?",
+                         (os.path.relpath(kept_path, destination_dir), removed))
+            conn.execute("DELETE FROM thumbnails WHERE path = ?", (removed,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def backfill_thumbnails(destination_dir, sizes=DEFAULT_SIZES, fmt=DEFAULT_FORMAT,
+                        workers=None, supported_image_types=photo_backup_utils.SUPPORTED_IMAGE_TYPES):
+    """ Thumbnail every photo already in the destination
+
+    Photos whose content already has thumbnails are hashed but not decoded,
+    so the command can be rerun after an interrupted backfill.
+
+    Args:
+        destination_dir (str): destination root
+        sizes (tuple): longest side of each thumbnail
+        fmt (str): 'webp' or 'jpeg'
+        workers (int): processes generating thumbnails, os.cpu_count() if None
+        supported_image_types (tuple): suffixes of the photos to thumbnail
+
+    Returns:
+        ThumbnailGenerator: the finished generator, for its counters
+    """
+    photo_backup_utils.validate_folder_path(destination_dir)
+    extensions = photo_backup_scan.normalize_extensions(supported_image_types)
+    with ThumbnailGenerator(destination_dir, sizes, fmt, workers) as generator:
+        for path, _ in photo_backup_dedupe.iter_archive_files(destination_dir):
+            if os.path.splitext(path)[1].lower() in extensions:
+                generator.submit(path)
+    print(generator.summary())
+    return generator
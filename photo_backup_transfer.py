@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 14:02:10
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 14:02:10
+ * @Description  : kernel-side file copy backends (reflink/copy_file_range/sendfile)
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import errno
+import os
+import shutil
+import threading
+import time
+
+import photo_backup_hash
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux FICLONE ioctl，btrfs/XFS 上的 reflink
+FICLONE = 0x40049409
+# 缓冲复制时每次读写的字节数
+BUFFER_SIZE = 1024 * 1024
+# 复制过程中使用的临时文件后缀
+PARTIAL_SUFFIX = '.partial'
+# 这些错误说明当前文件系统不支持该方式，应尝试下一种
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+                       errno.EOPNOTSUPP, errno.EBADF, errno.EPERM, errno.ETXTBSY}
+
+
+class TransferStats:
+    """files, bytes and seconds per copy strategy"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.strategies = {}
+
+    def add(self, strategy, size, seconds):
+        """record one copied file"""
+        with self._lock:
+            files, total, elapsed = self.strategies.get(strategy, (0, 0, 0.0))
+            self.strategies[strategy] = (files + 1, total + size, elapsed + seconds)
+
+    def summary(self):
+        """one line per strategy with its throughput"""
+        lines = []
+        for strategy, (files, size, seconds) in sorted(self.strategies.items()):
+            rate = size / seconds / 1024 / 1024 if seconds else 0.0
+            lines.append(f"{strategy}: {files} files, {size} bytes, {rate:.1f} MB/s")
+        return "\n".join(lines)
+
+
+# 全局统计，供命令行在运行结束时输出
+TRANSFER_STATS = TransferStats()
+
+
+def _reflink(src, dst, size):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflink is not available")
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _short_copy(copied, size):
+    """ the error for a kernel copy call that returned 0 before size bytes
+
+    Some FUSE and network filesystems (and older kernels) return 0 instead
+    of failing when they cannot copy; with nothing written yet that means
+    the backend is unsupported, like shutil._fastcopy_sendfile assumes.
+    """
+    if copied == 0:
+        return OSError(errno.ENOSYS, "the kernel copied no data")
+    return OSError(errno.EIO, f"source ended after {copied} of {size} bytes")
+
+
+def _copy_file_range(src, dst, size):
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+        if count == 0:
+            raise _short_copy(copied, size)
+        copied += count
+
+
+def _sendfile(src, dst, size):
+    copied = 0
+    while copied < size:
+        count = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+        if count == 0:
+            raise _short_copy(copied, size)
+        copied += count
+
+
+def _buffered(src, dst, size):
+    shutil.copyfileobj(src, dst, BUFFER_SIZE)
+
+
+# 按优先级排列的复制方式
+STRATEGIES = [('reflink', _reflink)]
+if hasattr(os, 'copy_file_range'):
+    STRATEGIES.append(('copy_file_range', _copy_file_range))
+if hasattr(os, 'sendfile') and os.name == 'posix':
+    STRATEGIES.append(('sendfile', _sendfile))
+STRATEGIES.append(('buffered', _buffered))
+
+# (源设备, 目标设备) -> 可用复制方式在 STRATEGIES 中的位置
+_strategy_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _destination_dev(dst_path):
+    return os.stat(os.path.dirname(os.path.abspath(dst_path))).st_dev
+
+
+def get_strategy(src_path, dst_path):
+    """return the name of the copy strategy cached for this pair of filesystems"""
+    key = (os.stat(src_path).st_dev, _destination_dev(dst_path))
+    with _cache_lock:
+        return STRATEGIES[_strategy_cache.get(key, 0)][0]
+
+
+def partial_path(dst_path):
+    """temporary name a copy is written to before it is renamed into place"""
+    directory, name = os.path.split(dst_path)
+    return os.path.join(directory, f".{name}{PARTIAL_SUFFIX}")
+
+
+def publish(temp_path, dst_path):
+    """ Give a finished temporary file its final name, never replacing a file
+
+    The name is taken with a hard link, which fails if dst_path exists,
+    also when only its case differs on a case-insensitive filesystem.
+    Where hard links are not supported (exFAT, some SMB shares) the name
+    is claimed with O_EXCL first and the file renamed onto that claim.
+
+    Raises:
+        FileExistsError: dst_path already exists
+    """
+    try:
+        os.link(temp_path, dst_path)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS and e.errno != errno.EMLINK:
+            raise
+        os.close(os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        os.replace(temp_path, dst_path)
+        return
+    os.remove(temp_path)
+
+
+def sync_directory(directory):
+    """fsync a folder so the names created in it are durable; a no-op off POSIX"""
+    if os.name != 'posix':
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def remove_partials(destination_dir):
+    """ Delete temporary files left behind by an interrupted run
+
+    Args:
+        destination_dir (str): destination directory
+
+    Returns:
+        int: number of files removed
+    """
+    removed = 0
+    for root, dirs, files in os.walk(destination_dir):
+        for file in files:
+            if file.startswith('.') and file.endswith(PARTIAL_SUFFIX):
+                try:
+                    os.remove(os.path.join(root, file))
+                    removed += 1
+                except OSError as e:
+                    print(e)
+    return removed
+
+
+def copy_file(src_path, dst_path, metadata=False, stats=TRANSFER_STATS, sync=True):
+    """ Copy src_path to dst_path with the fastest backend the filesystems allow
+
+    Tries reflink, copy_file_range, sendfile and a buffered copy in that
+    order. The first backend that works for a (source device, destination
+    device) pair is cached, so later files start there. The data is written
+    to a hidden temporary file and published as dst_path only once
+    complete, so dst_path never holds a half-written file, and an existing
+    dst_path is never replaced (FileExistsError).
+
+    With sync the data is fsync'ed before it is published and the folder
+    after, so once this returns the copy survives a power loss; a journal
+    entry written afterwards never points at a file that did not make it
+    to disk.
+
+    Args:
+        src_path (str): source file
+        dst_path (str): destination file path
+        metadata (bool): also copy timestamps like shutil.copy2, otherwise
+            only the permission bits like shutil.copy
+        stats (TransferStats): counters to update
+        sync (bool): make the copy durable before returning
+
+    Returns:
+        str: name of the strategy that copied the file
+    """
+    src_stat = os.stat(src_path)
+    key = (src_stat.st_dev, _destination_dev(dst_path))
+    with _cache_lock:
+        first = _strategy_cache.get(key, 0)
+    temp_path = partial_path(dst_path)
+    start = time.perf_counter()
+    try:
+        with open(src_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            for position in range(first, len(STRATEGIES)):
+                name, function = STRATEGIES[position]
+                try:
+                    function(src, dst, src_stat.st_size)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED_ERRNOS or position == len(STRATEGIES) - 1:
+                        raise
+                    # 回退到下一种方式，先清空已写入的内容
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+                    continue
+                if position != first:
+                    with _cache_lock:
+                        _strategy_cache[key] = position
+                break
+            dst.flush()
+            written = os.fstat(dst.fileno()).st_size
+            if written != src_stat.st_size:
+                # 无论哪种方式，短于源文件的副本都不能发布
+                raise OSError(errno.EIO, f"copy of {src_path} has {written} of "
+                                         f"{src_stat.st_size} bytes")
+            if sync:
+                os.fsync(dst.fileno())
+        if metadata:
+            shutil.copystat(src_path, temp_path)
+        else:
+            shutil.copymode(src_path, temp_path)
+        publish(temp_path, dst_path)
+        if sync:
+            sync_directory(os.path.dirname(os.path.abspath(dst_path)))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if stats is not None:
+        stats.add(name, src_stat.st_size, time.perf_counter() - start)
+    return name
+
+
+def read_back_digest(file_path, algorithm=None):
+    """ Hash a file as stored on disk rather than as cached in memory
+
+    The file's clean pages are dropped from the page cache first where
+    posix_fadvise is available, so a freshly written, fsync'ed file is
+    read back from the device.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        with open(file_path, 'rb') as file:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return photo_backup_hash.file_digest(file_path, algorithm, stats=None)
+
+
+def copy_file_verified(src_path, dst_path, metadata=False, algorithm=None,
+                       stats=TRANSFER_STATS):
+    """ Copy src_path to dst_path, hashing the data on the way, and check it
+
+    The source is read once: each buffer is hashed and written. The copy
+    is fsync'ed and read back from disk, and only published as dst_path
+    if both hashes match, so a bad write never takes the final name. The
+    kernel-side backends never hand the data to Python, so this always
+    uses a buffered copy.
+
+    Args:
+        src_path (str): source file
+        dst_path (str): destination file path
+        metadata (bool): also copy timestamps like shutil.copy2
+        algorithm (str): hash algorithm, see photo_backup_hash.new_hash
+        stats (TransferStats): counters to update
+
+    Returns:
+        str: content digest of the copy
+    """
+    temp_path = partial_path(dst_path)
+    start = time.perf_counter()
+    digest = photo_backup_hash.new_hash(algorithm)
+    size = 0
+    try:
+        with open(src_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(BUFFER_SIZE), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        written = read_back_digest(temp_path, algorithm)
+        if written != digest.hexdigest():
+            raise OSError(errno.EIO, f"copy of {src_path} does not match the source on read-back")
+        if metadata:
+            shutil.copystat(src_path, temp_path)
+        else:
+            shutil.copymode(src_path, temp_path)
+        publish(temp_path, dst_path)
+        sync_directory(os.path.dirname(os.path.abspath(dst_path)))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if stats is not None:
+        stats.add('verified', size, time.perf_counter() - start)
+    return written
@@ -1,15 +1,46 @@
+import collections
+import contextlib
 import os
-import re
-import shutil
 import hashlib
-from PIL import Image
-from PIL.ExifTags import TAGS
+import tempfile
+import threading
+from PIL import Image, ImageOps
+
+import photo_backup_dates
+import photo_backup_events
+import photo_backup_exif
+import photo_backup_hash
+import photo_backup_memory
+import photo_backup_profile
+import photo_backup_scan
+import photo_backup_transfer
+from photo_backup_exif import DATE_TIME_ORIGINAL
+from photo_backup_profile import PROFILER
 
 # 定义支持的图片文件类型
 SUPPORTED_IMAGE_TYPES = ('.jpg', '.jpeg', '.png', 'JPG')
 # 定义需要从Exif数据中提取的标签名称
 DATE_TIME_ORIGINAL_TAG = 'DateTimeOriginal'
 MAKE_TAG = 'Make'
+# 无法识别日期时使用的默认日期
+DEFAULT_DATE = "2000-01-01"
+# copy_photo 的处理结果
+COPIED = 'copied'
+RENAMED = 'renamed'
+LINKED = 'linked'
+DUPLICATE = 'duplicate'
+NEAR_DUPLICATE = 'near_duplicate'
+# 单张图片解码后允许占用的最大内存（字节），约 16 MP RGB
+DECODE_MEMORY_LIMIT = 64 * 1024 * 1024
+# 本进程内同时解码的图片最多占用的内存（字节）
+DECODE_MEMORY_BUDGET = 128 * 1024 * 1024
+# PIL 各模式每个像素占用的字节数，多通道图像按 4 字节存储
+_MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I': 4, 'F': 4}
+# copy_photo 的处理结果对应的事件
+RESULT_EVENTS = {COPIED: photo_backup_events.COPIED,
+                 RENAMED: photo_backup_events.RENAMED,
+                 LINKED: photo_backup_events.LINKED,
+                 DUPLICATE: photo_backup_events.DUPLICATE_SKIPPED}
 
 
 def validate_folder_path(folder_path):
@@ -20,72 +51,377 @@ def validate_folder_path(folder_path):
         raise ValueError(f"{folder_path} is not a valid directory.")
 
 
-def generate_unique_filename(destination_path, base_name):
-    """generate a unique filename"""
+def _numbered_name(base_name, counter):
+    """name(counter).ext for base_name name.ext"""
+    return f"{base_name.split('.')[-2]}({counter}).{base_name.split('.')[-1]}"
+
+
+def generate_unique_filename(destination_path, base_name, reserved=()):
+    """generate a unique filename, also avoiding the names in reserved"""
     unique_name = f"{base_name}"
     unique_path = os.path.join(destination_path, unique_name)
-    if os.path.exists(unique_path):
+    if os.path.exists(unique_path) or unique_name in reserved:
         counter = 1
         while True:
-            unique_name = f"{base_name.split('.')[-2]}({counter}).{base_name.split('.')[-1]}"
+            unique_name = _numbered_name(base_name, counter)
             unique_path = os.path.join(destination_path, unique_name)
-            if not os.path.exists(unique_path):
+            if not os.path.exists(unique_path) and unique_name not in reserved:
                 return unique_name
             counter += 1
     else:
         return unique_name
 
 
+# 设备号 -> 该文件系统是否不区分文件名大小写
+_case_insensitive_devices = {}
+_case_lock = threading.Lock()
+
+
+def is_case_insensitive(directory):
+    """ Whether file names differ only by case on the filesystem of directory
+
+    Probed once per device with a temporary file (SMB shares, APFS and
+    exFAT usually ignore case); a directory that does not exist yet is
+    judged by its nearest existing parent.
+    """
+    existing = os.path.abspath(directory)
+    while not os.path.isdir(existing) and os.path.dirname(existing) != existing:
+        existing = os.path.dirname(existing)
+    device = os.stat(existing).st_dev
+    with _case_lock:
+        if device in _case_insensitive_devices:
+            return _case_insensitive_devices[device]
+        try:
+            descriptor, probe = tempfile.mkstemp(prefix='.photo_backup.case.', dir=existing)
+        except OSError:
+            insensitive = os.path.normcase('A') == 'a'
+        else:
+            os.close(descriptor)
+            folder, name = os.path.split(probe)
+            insensitive = os.path.exists(os.path.join(folder, name.swapcase()))
+            os.remove(probe)
+        _case_insensitive_devices[device] = insensitive
+        return insensitive
+
+
+class DirectoryNameIndex:
+    """ In-memory view of the file names in destination folders
+
+    Each folder is listed with a single os.scandir the first time it is
+    touched; existence checks and unique-name allocation are then answered
+    from memory. On case-insensitive filesystems names are compared
+    case-folded, so IMG_1.JPG and IMG_1.jpg count as the same name. All
+    methods are safe to call from several threads.
+
+    With max_folders, the least recently used listings beyond that many
+    are dropped and re-read on the next touch. Only safe when a name is
+    reserved and written under the same folder lock, as in the serial and
+    pipelined engines.
+
+    Args:
+        max_folders (int): folder listings kept, None for all
+    """
+
+    def __init__(self, max_folders=None):
+        self._lock = threading.Lock()
+        self.max_folders = max_folders
+        # 目录 -> {比较用的文件名: 磁盘上的文件名}，目录不存在时为 None；按最近使用排序
+        self._folders = collections.OrderedDict()
+        # 目录 -> {文件名: 上次分配的序号}，避免每次从 (1) 开始探测
+        self._counters = {}
+        # 目录 -> 是否按忽略大小写比较文件名
+        self._folding = {}
+
+    def _key(self, directory, name):
+        """name as stored for directory; call inside _folder"""
+        return name.casefold() if self._folding[directory] else name
+
+    def cached(self, directory):
+        """True if the listing of directory is in memory, so lookups do not touch the disk"""
+        with self._lock:
+            return directory in self._folders
+
+    def load(self, directory):
+        """ Read the listing of directory into memory unless it is already there
+
+        The folder is listed without holding the index lock, so a slow
+        listing (a cold folder on a NAS) does not stall lookups in other
+        folders; if another thread cached the folder meanwhile, its
+        listing, which may already hold new reservations, is kept.
+        """
+        if self.cached(directory):
+            return
+        folding = is_case_insensitive(directory)
+        try:
+            with os.scandir(directory) as entries:
+                names = {entry.name.casefold() if folding else entry.name: entry.name
+                         for entry in entries}
+        except (FileNotFoundError, NotADirectoryError):
+            names = None
+        with self._lock:
+            if directory in self._folders:
+                return
+            self._folding[directory] = folding
+            self._folders[directory] = names
+            if self.max_folders is not None:
+                while len(self._folders) > self.max_folders:
+                    evicted, _ = self._folders.popitem(last=False)
+                    self._counters.pop(evicted, None)
+                    self._folding.pop(evicted, None)
+
+    @contextlib.contextmanager
+    def _folder(self, directory):
+        """hold the index lock with directory cached; yields its names, None if it does not exist"""
+        while True:
+            with self._lock:
+                if directory in self._folders:
+                    if self.max_folders is not None:
+                        self._folders.move_to_end(directory)
+                    yield self._folders[directory]
+                    return
+            # 读取目录时不持有索引锁；读完后若又被挤出则重读
+            self.load(directory)
+
+    def dir_exists(self, directory):
+        """return True if directory exists"""
+        with self._folder(directory) as names:
+            return names is not None
+
+    def exists(self, directory, name):
+        """return True if directory contains name"""
+        with self._folder(directory) as names:
+            return names is not None and self._key(directory, name) in names
+
+    def existing_name(self, directory, name):
+        """the name on disk matching name in directory, which may differ in case, or None"""
+        with self._folder(directory) as names:
+            return None if names is None else names.get(self._key(directory, name))
+
+    def makedirs(self, directory):
+        """create directory if needed"""
+        if not self.dir_exists(directory):
+            os.makedirs(directory, exist_ok=True)
+            folding = is_case_insensitive(directory)
+            with self._lock:
+                if self._folders.get(directory) is None:
+                    self._folding[directory] = folding
+                    self._folders[directory] = {}
+
+    def add(self, directory, name):
+        """record that name now exists in directory"""
+        with self._folder(directory) as names:
+            if names is None:
+                names = self._folders[directory] = {}
+            names[self._key(directory, name)] = name
+
+    def discard(self, directory, name):
+        """forget a name reserved for a file that was not written after all"""
+        with self._lock:
+            names = self._folders.get(directory)
+            if names is not None:
+                names.pop(self._key(directory, name), None)
+
+    def reserve_unique(self, directory, base_name):
+        """ Pick base_name or the first free name(N).ext in directory and reserve it
+
+        Args:
+            directory (str): destination folder
+            base_name (str): wanted file name
+
+        Returns:
+            str: the reserved file name
+        """
+        with self._folder(directory) as names:
+            if names is None:
+                names = self._folders[directory] = {}
+            unique_name = base_name
+            if self._key(directory, unique_name) in names:
+                counters = self._counters.setdefault(directory, {})
+                counter = counters.get(base_name, 0) + 1
+                unique_name = _numbered_name(base_name, counter)
+                while self._key(directory, unique_name) in names:
+                    counter += 1
+                    unique_name = _numbered_name(base_name, counter)
+                counters[base_name] = counter
+            names[self._key(directory, unique_name)] = unique_name
+            return unique_name
+
+
 def get_md5(file_path):
     """计算文件的MD5哈希值"""
     with open(file_path, 'rb') as file:
         md5_hash = hashlib.md5()
-        for chunk in iter(lambda: file.read(4096), b""):
+        for chunk in iter(lambda: file.read(photo_backup_hash.CHUNK_SIZE), b""):
             md5_hash.update(chunk)
     return md5_hash.hexdigest()
 
 
-def extract_dateComponents(match):
+def get_photo_date_from_filename(filename):
     """
-    Extracts the year, month, and day from a regex match.
+    Extracts the date from the file name.
     """
-    year = "20" + match.group(1)
-    month = match.group(2)
-    day = match.group(3)
-    return f"{year}-{month}-{day}", year, month, day
+    return photo_backup_dates.parse_date(filename)
 
 
-def get_photo_date_from_filename(filename):
+def _format_exif_date(value):
+    """ turn an EXIF value like 2011:11:22 10:00:00 into 2011-11-22, or None """
+    return photo_backup_exif.format_exif_date(value)
+
+
+def get_exif_date_pil(file_path):
+    """ Read DateTimeOriginal through PIL, formatted as YYYY-MM-DD
+
+    Args:
+        file_path (str): file path
+
+    Returns:
+        str: date formatted as YYYY-MM-DD, or None
     """
-    Extracts the date from the file name.
+    with Image.open(file_path) as img:
+        # getexif() exists for every format (empty for BMP/GIF), unlike _getexif()
+        exif_data = img.getexif()
+        value = exif_data.get_ifd(photo_backup_exif.EXIF_IFD_POINTER).get(DATE_TIME_ORIGINAL) \
+            or exif_data.get(DATE_TIME_ORIGINAL)
+    return _format_exif_date(value)
+
+
+def get_exif_date(file_path):
+    """ Read the EXIF date with the header parser, falling back to PIL
+
+    Args:
+        file_path (str): file path
+
+    Returns:
+        str: date formatted as YYYY-MM-DD, or None
     """
-    # match date format like 20221111
-    pattern1 = r"20(\d{2})(0[1-9]|1[0-2])(0[1-9]|[12][0-9]|3[01])"
-    # match date format like 2022-11-11
-    pattern2 = r"20(\d{2})-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])"
-    match1 = re.search(pattern1, filename)
-    match2 = re.search(pattern2, filename)
-
-    if match1:
-        # 成功匹配时，调用extract_dateComponents处理匹配结果
-        date_str, year, month, day = extract_dateComponents(match1)
-        # 可以在这里进一步处理或验证日期，例如检查月份和日期的合法性
-        return date_str
-    elif match2:
-        date_str, year, month, day = extract_dateComponents(match2)
-        # 可以在这里进一步处理或验证日期，例如检查月份和日期的合法性
-        return date_str
+    try:
+        return _format_exif_date(photo_backup_exif.read_exif_date(file_path))
+    except photo_backup_exif.ExifFormatError:
+        # 不是 JPEG/TIFF/HEIC 或文件头损坏，交给 PIL 处理
+        return get_exif_date_pil(file_path)
 
-    else:
-        # 未匹配时，返回None或其他自定义消息
-        return None
 
+class ImageTooLargeError(ValueError):
+    """decoding the image would need more memory than allowed"""
+
+
+class DecodeBudget:
+    """ Bytes of decoded pixels allowed at once in this process
+
+    reserve() blocks until the request fits, so worker threads decoding
+    images together never hold more than limit bytes of pixels. Each
+    process of a pool has its own budget.
+    """
 
-def get_photo_date(file_path):
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, size):
+        """hold size bytes for the duration of a with block"""
+        if size > self.limit:
+            raise ImageTooLargeError(f"{size} bytes exceed the decode budget of {self.limit}")
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_use + size <= self.limit)
+            self.in_use += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= size
+                self._condition.notify_all()
+
+
+# 全局解码预算
+DECODE_BUDGET = DecodeBudget(DECODE_MEMORY_BUDGET)
+
+
+def decoded_bytes(image):
+    """memory the pixels of image take once loaded"""
+    width, height = image.size
+    return width * height * _MODE_BYTES.get(image.mode, 4)
+
+
+@contextlib.contextmanager
+def open_image_reduced(file_path, size, mode=None, max_bytes=DECODE_MEMORY_LIMIT,
+                       budget=DECODE_BUDGET):
+    """ Open an image decoded at the smallest scale that still covers size
+
+    JPEGs are decoded with DCT scaling (Image.draft) at 1/2, 1/4 or 1/8 of
+    their size, directly in the wanted mode; other formats are decoded at
+    full size. The decode is refused when it would take more than max_bytes
+    and waits for room in budget, so the memory used for pixels stays capped.
+
+    Args:
+        file_path (str): image path
+        size (int): both sides are kept at least this long when the image allows
+        mode (str): PIL mode to decode to, e.g. 'L' or 'RGB'; the file's own
+            mode when None
+        max_bytes (int): largest decode allowed
+        budget (DecodeBudget): shared budget of the process, or None
+
+    Raises:
+        ImageTooLargeError: the reduced image would still exceed max_bytes
+
+    Yields:
+        Image: the loaded image, valid inside the with block
+    """
+    with Image.open(file_path) as image:
+        if image.format == 'JPEG':
+            image.draft(mode or image.mode, (size, size))
+        needed = decoded_bytes(image)
+        if needed > max_bytes:
+            raise ImageTooLargeError(
+                f"{file_path}: decoding {image.size[0]}x{image.size[1]} {image.mode} "
+                f"needs {needed} bytes, over the limit of {max_bytes}")
+        with budget.reserve(needed) if budget is not None else contextlib.nullcontext():
+            image.load()
+            yield image
+
+
+def load_image_reduced(file_path, size, mode='RGB', transpose=False,
+                       max_bytes=DECODE_MEMORY_LIMIT, budget=DECODE_BUDGET):
+    """ Decode an image scaled down to fit in a size x size box
+
+    The shared entry point for pixel work (perceptual hashes, thumbnails,
+    orientation checks); see open_image_reduced for the memory limits.
+
+    Args:
+        file_path (str): image path
+        size (int): the longest side of the result is at most this
+        mode (str): PIL mode of the result
+        transpose (bool): apply the EXIF orientation
+        max_bytes (int): largest decode allowed
+        budget (DecodeBudget): shared budget of the process, or None
+
+    Returns:
+        Image: a new image, independent of the file
+    """
+    with open_image_reduced(file_path, size, mode, max_bytes, budget) as image:
+        if image.mode in ('1', 'P', 'LA', 'PA', 'CMYK', 'YCbCr', 'I;16'):
+            # 调色板等模式不能直接插值缩放
+            image = image.convert(mode)
+        width, height = image.size
+        ratio = min(size / width, size / height, 1)
+        target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        # resize/copy 都返回新图像，文件关闭后仍然有效
+        reduced = image.resize(target, Image.BILINEAR) if target != image.size \
+            else image.copy()
+    if reduced.mode != mode:
+        reduced = reduced.convert(mode)
+    if transpose:
+        reduced = ImageOps.exif_transpose(reduced)
+    return reduced
+
+
+def get_photo_date(file_path, events=None):
     """ Read photo exif date and return photo date, formatted as YYYY-MM-DD
 
     Args:
         file_path (str): file path
+        events (EventStream): receives a warning if the EXIF could not be read
 
     Returns:
         str: date formatted as YYYY-MM-DD
@@ -94,87 +430,391 @@ def get_photo_date(file_path):
     file_name = os.path.basename(file_path)
 
     try:
-        with Image.open(file_path) as img:
-            exif_data = img._getexif()
-            # check if the exif data is not None
-            if exif_data is not None:
-                for tag, value in exif_data.items():
-                    tag_name = TAGS.get(tag, tag)
-                    # check if the tag DateTimeOriginal exists
-                    if tag_name == 'DateTimeOriginal':
-                        # extract the date and time from the value
-                        # check if the value is like 2011:11:22
-                        if re.match(r"20\d{2}:\d{2}:\d{2}", value):
-                            date = value.split(' ')[0].replace(':', '-')
-                            return date
+        date = get_exif_date(file_path)
+        if date:
+            return date
     except (OSError, IsADirectoryError, KeyError, TypeError) as e:
-        print(f"Error processing {file_path}: {e}")
+        if events is not None:
+            events.emit(photo_backup_events.WARNING, file_path,
+                        error=f"Error processing {file_path}: {e}")
 
     return get_photo_date_from_filename(file_name)
 
 
-def copy_photos_by_date(source_dir, destination_dir, supported_image_types=SUPPORTED_IMAGE_TYPES):
+def build_destination_dir(destination_dir, date):
+    """ Build the YYYY/MM/YYYY-MM-DD folder for a photo date
+
+    Args:
+        destination_dir (str): destination root
+        date (str): date formatted as YYYY-MM-DD
+
+    Returns:
+        str: destination folder path
+    """
+    year, month, _ = date.split('-')
+    return os.path.join(destination_dir, f"{year}/{month}/{date}")
+
+
+def resolve_photo_date(file_path, events=None, metadata=None):
+    """ Resolve the backup date of a photo: exif, file name, parent dir, then default
+
+    Args:
+        file_path (str): file path
+        events (EventStream): receives a date_resolved event, and a warning
+            if the EXIF could not be read
+        metadata (PhotoMetadata): already extracted metadata of the file;
+            its date is used instead of reading the EXIF again
+
+    Returns:
+        str: date formatted as YYYY-MM-DD
+    """
+    date = None
+    source = 'exif'
+    if metadata is not None:
+        date = metadata.date
+    else:
+        try:
+            with PROFILER.timed(photo_backup_profile.DATE_EXIF, file_path):
+                date = get_exif_date(file_path)
+        except (OSError, KeyError, TypeError) as e:
+            if events is not None:
+                events.emit(photo_backup_events.WARNING, file_path,
+                            error=f"Error processing {file_path}: {e}")
+    if not date:
+        with PROFILER.timed(photo_backup_profile.DATE_FILENAME, file_path):
+            date = get_photo_date_from_filename(os.path.basename(file_path))
+            source = 'filename'
+            if not date:
+                date = photo_backup_dates.parse_directory_date(os.path.dirname(file_path))
+                source = 'parent'
+    if not date:
+        date = DEFAULT_DATE
+        source = 'default'
+    if events is not None:
+        events.emit(photo_backup_events.DATE_RESOLVED, file_path,
+                    date=date, source=source)
+    return date
+
+
+def copy_photo(file_path, destination_dir_path, index=None, link=False, names=None,
+               manifest=None):
+    """ Copy one photo into its date folder
+
+    Args:
+        file_path (str): source file path
+        destination_dir_path (str): destination date folder
+        index (DestinationIndex): skip files whose content is already
+            anywhere in the destination
+        link (bool): with index, hard-link the archived copy into the date
+            folder instead of skipping
+        names (DirectoryNameIndex): shared view of the destination folders,
+            so existence checks do not hit the disk
+        manifest (Manifest): verify every copy by read-back and record its
+            hash; None for a plain copy
+
+    Returns:
+        tuple: (COPIED, RENAMED, LINKED or DUPLICATE, destination file path)
+    """
+    if names is None:
+        names = DirectoryNameIndex()
+    file = os.path.basename(file_path)
+    destination_file_path = os.path.join(destination_dir_path, file)
+    if index is not None:
+        size = os.path.getsize(file_path)
+        with PROFILER.timed(photo_backup_profile.COMPARE, file_path):
+            existing = index.find(file_path, size)
+        if existing is not None:
+            if not link or os.path.dirname(existing) == destination_dir_path:
+                return DUPLICATE, existing
+            with PROFILER.timed(photo_backup_profile.MAKEDIRS, file_path):
+                names.makedirs(destination_dir_path)
+            link_path = os.path.join(
+                destination_dir_path,
+                names.reserve_unique(destination_dir_path, file))
+            try:
+                with PROFILER.timed(photo_backup_profile.LINK, file_path):
+                    os.link(existing, link_path)
+            except FileExistsError:
+                raise
+            except BaseException:
+                names.discard(destination_dir_path, os.path.basename(link_path))
+                raise
+            if manifest is not None:
+                manifest.link(existing, link_path)
+            return LINKED, link_path
+        result, destination_file_path = _copy_new_photo(
+            file_path, destination_dir_path, destination_file_path, names,
+            compare=False, manifest=manifest)
+        index.add(destination_file_path, size)
+        return result, destination_file_path
+    return _copy_new_photo(file_path, destination_dir_path, destination_file_path, names,
+                           manifest=manifest)
+
+
+def transfer_file(file_path, destination_file_path, metadata=False, manifest=None):
+    """ Copy one file into the archive
+
+    With a manifest the copy is hashed on the way, verified by read-back
+    and its hash recorded; a mismatch raises OSError and leaves nothing
+    under destination_file_path.
+    """
+    if manifest is None:
+        photo_backup_transfer.copy_file(file_path, destination_file_path, metadata=metadata)
+        return
+    digest = photo_backup_transfer.copy_file_verified(
+        file_path, destination_file_path, metadata=metadata, algorithm=manifest.algorithm)
+    manifest.record(destination_file_path, digest)
+
+
+def _copy_new_photo(file_path, destination_dir_path, destination_file_path, names, compare=True,
+                    manifest=None):
+    """copy file_path to destination_file_path, renaming on a name collision"""
+    file = os.path.basename(file_path)
+    with PROFILER.timed(photo_backup_profile.EXISTS, file_path):
+        dir_exists = names.dir_exists(destination_dir_path)
+        exists = dir_exists and names.exists(destination_dir_path, file)
+    if exists:
+        return copy_on_collision(file_path, destination_dir_path, destination_file_path,
+                                 names, compare, manifest)
+    if not dir_exists:
+        with PROFILER.timed(photo_backup_profile.MAKEDIRS, file_path):
+            names.makedirs(destination_dir_path)
+    names.add(destination_dir_path, file)
+    try:
+        with PROFILER.timed(photo_backup_profile.COPY, file_path,
+                            os.path.getsize(file_path)):
+            transfer_file(file_path, destination_file_path, manifest=manifest)
+    except FileExistsError:
+        # 名字索引里没有、磁盘上却已存在（其他进程写入等）：不覆盖，按重名处理
+        return copy_on_collision(file_path, destination_dir_path, destination_file_path,
+                                 names, manifest=manifest)
+    except BaseException:
+        # 没写成的文件不能占着名字，否则之后的同名文件会去比较一个不存在的文件
+        names.discard(destination_dir_path, file)
+        raise
+    return COPIED, destination_file_path
+
+
+def copy_on_collision(file_path, destination_dir_path, destination_file_path, names,
+                      compare=True, manifest=None):
+    """ Handle a file whose name is already taken in its date folder
+
+    Returns:
+        tuple: (DUPLICATE, destination_file_path) if the taken name holds the
+            same bytes, else (RENAMED, path of the numbered copy)
+    """
+    file = os.path.basename(file_path)
+    taken = names.existing_name(destination_dir_path, file)
+    if taken is not None:
+        # 不区分大小写的文件系统上，占用该名字的文件可能大小写不同
+        destination_file_path = os.path.join(destination_dir_path, taken)
+    # not needed when the destination index has ruled out a duplicate
+    if compare:
+        with PROFILER.timed(photo_backup_profile.COMPARE, file_path):
+            identical = photo_backup_hash.files_identical(file_path, destination_file_path)
+        if identical:
+            return DUPLICATE, destination_file_path
+    while True:
+        # rename file
+        rename_path = os.path.join(
+            destination_dir_path,
+            names.reserve_unique(destination_dir_path, file))
+        # copy file
+        try:
+            with PROFILER.timed(photo_backup_profile.COPY, file_path,
+                                os.path.getsize(file_path)):
+                transfer_file(file_path, rename_path, metadata=True, manifest=manifest)
+        except FileExistsError:
+            continue
+        except BaseException:
+            names.discard(destination_dir_path, os.path.basename(rename_path))
+            raise
+        return RENAMED, rename_path
+
+
+def is_already_done(source, catalog=None, journal=None):
+    """ Check the catalog and the journal before touching a source file
+
+    Args:
+        source (SourceFile): scanned source file
+        catalog (Catalog): persistent catalog, or None
+        journal (Journal): journal of an interrupted run, or None
+
+    Returns:
+        bool: True if the file can be skipped
+    """
+    if catalog is not None and catalog.is_unchanged(source.path, source.size, source.mtime):
+        return True
+    return journal is not None and journal.is_done(source.path, source.size, source.mtime)
+
+
+def record_done(source, date, result, destination_file_path, catalog=None, journal=None):
+    """record a handled source file in the catalog and the journal"""
+    if catalog is not None:
+        catalog.record(source.path, source.size, source.mtime, date, destination_file_path)
+    if journal is not None:
+        journal.record(source.path, source.size, source.mtime, result,
+                       destination_file_path)
+
+
+def iter_pending(source_dir, supported_image_types, include=None, exclude=None,
+                 catalog=None, journal=None, events=None, metadata=None, sources=None,
+                 claim=None):
+    """ Scan the source and yield the files that still need a backup
+
+    Emits file_scanned and unchanged_skipped events and stops when the run
+    is cancelled.
+
+    Args:
+        source_dir (str): source directory
+        supported_image_types (tuple): file suffixes to back up
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        catalog (Catalog): skip files it records as unchanged
+        journal (Journal): skip files an interrupted run already finished
+        events (EventStream): event stream of the run
+        metadata (MetadataCache): look up or extract the metadata of the
+            pending files in batches
+        sources (iterable): SourceFile records to use instead of scanning
+            source_dir, already filtered
+        claim (callable): called with each SourceFile; False skips it as
+            already handled by another job of the run
+
+    Yields:
+        tuple: (SourceFile, PhotoMetadata or None)
+    """
+    if sources is None:
+        sources = photo_backup_scan.scan_source(source_dir, supported_image_types,
+                                                include, exclude, events=events)
+
+    def pending():
+        for source in sources:
+            if events.cancelled():
+                return
+            events.emit(photo_backup_events.FILE_SCANNED, source.path, size=source.size)
+            if is_already_done(source, catalog, journal) or \
+                    (claim is not None and not claim(source)):
+                events.emit(photo_backup_events.UNCHANGED_SKIPPED, source.path)
+                continue
+            yield source
+
+    if metadata is None:
+        for source in pending():
+            yield source, None
+        return
+    # 解析失败的文件得到 None，由 resolve_photo_date 按原流程读取并报告
+    for source, record, _ in metadata.iter_with_metadata(pending()):
+        yield source, record
+
+
+def skip_near_duplicate(source, date, similar, events, catalog=None, journal=None):
+    """ Check a source photo against the similarity index before copying it
+
+    Near-duplicates are reported with a near_duplicate event, or with
+    near_duplicate_skipped and recorded as done when the index skips them.
+    Photos that are copied must be passed to settle_near_duplicate afterwards.
+
+    Args:
+        source (SourceFile): scanned source file
+        date (str): resolved date
+        similar (SimilarityIndex): perceptual hash index, or None
+        events (EventStream): event stream of the run
+        catalog (Catalog): persistent catalog, or None
+        journal (Journal): journal of the run, or None
+
+    Returns:
+        bool: True if the photo must not be copied
+    """
+    if similar is None:
+        return False
+    match = similar.claim(source.path)
+    if match is None:
+        return False
+    existing, distance = match
+    if not similar.skip:
+        events.emit(photo_backup_events.NEAR_DUPLICATE, source.path,
+                    destination=existing, distance=distance)
+        return False
+    record_done(source, date, NEAR_DUPLICATE, existing, catalog, journal)
+    events.emit(photo_backup_events.NEAR_DUPLICATE_SKIPPED, source.path,
+                destination=existing, distance=distance, size=source.size)
+    return True
+
+
+def settle_near_duplicate(source, similar, result=None, destination_file_path=None):
+    """tell the similarity index where a checked photo ended up (None: nowhere new)"""
+    if similar is not None:
+        similar.settle(source.path, destination_file_path
+                       if result in (COPIED, RENAMED) else None)
+
+
+def copy_photos_by_date(source_dir, destination_dir, supported_image_types=SUPPORTED_IMAGE_TYPES,
+                        catalog=None, index=None, link=False, journal=None,
+                        include=None, exclude=None, events=None, metadata=None,
+                        similar=None, scheduler=None, sources=None, manifest=None):
     """ copy photos by date
 
     Args:
-        source_dir (_type_): _description_
-        destination_dir (_type_): _description_
+        source_dir (str): source directory
+        destination_dir (str): destination directory
+        supported_image_types (tuple): file suffixes to back up
+        catalog (Catalog): skip files already backed up with the same size
+            and mtime, and record every handled file
+        index (DestinationIndex): skip files already anywhere in the destination
+        link (bool): with index, hard-link instead of skipping
+        journal (Journal): skip files an interrupted run already finished,
+            and record every handled file
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        events (EventStream): receives one event per step of every file,
+            and carries the cancel flag of the run
+        metadata (MetadataCache): extract EXIF dates in batches on a process
+            pool and reuse them across runs
+        similar (SimilarityIndex): flag or skip photos that look like one
+            already in the destination
+        scheduler (CopyScheduler): only its bandwidth and IOPS caps apply,
+            files are copied in scan order
+        sources (iterable): SourceFile records to back up instead of
+            scanning source_dir, see photo_backup_scan.scan_file
+        manifest (Manifest): verify every copy by read-back and record
+            its hash
+
+    Returns:
+        int: number of files copied
     """
-    file_count = 0
+    if events is None:
+        events = photo_backup_events.EventStream()
+    names = DirectoryNameIndex(photo_backup_memory.BUDGET.max_folders())
     validate_folder_path(source_dir)
     validate_folder_path(destination_dir)
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            # check if the file is an image
-            if file.endswith(SUPPORTED_IMAGE_TYPES):
-
-                file_path = os.path.join(root, file)
-                parent_dir = os.path.basename(
-                    os.path.dirname(file_path))
-                try:
-                    # get the date of the photo, default to 0000-00-00
-                    date_fromfile = get_photo_date(file_path)
-                    date_fromparent = get_photo_date_from_filename(parent_dir)
-                    if date_fromfile:
-                        date = date_fromfile
-                        print(f"{file_path} : date has got from file {date}")
-                    elif date_fromparent:
-                        date = date_fromparent
-                        print(f"{file_path} : date has got from dir {date}")
-                    else:
-                        date = "2000-01-01"
-                        print(f"{file_path} : date has set to default {date}")
-                    # create destination directory if it doesn't exist
-
-                    year = date.split('-')[0]
-                    month = date.split('-')[1]
-                    day = date.split('-')[2]
-                    date = f"{year}/{month}/{date}"
-                    destination_dir_path = os.path.join(
-                        destination_dir, date)
-                    destination_file_path = os.path.join(
-                        destination_dir_path, file)
-                    if os.path.exists(destination_dir_path):
-                        if os.path.exists(destination_file_path):
-                            # md5
-                            source_md5 = get_md5(file_path)
-                            destination_md5 = get_md5(destination_file_path)
-                            if source_md5 == destination_md5:
-                                print(f'{file} is already exist')
-                                break
-                            else:
-                                # rename file
-                                rename_path = generate_unique_filename(
-                                    destination_dir_path, file)
-                                # copy file
-                                shutil.copy2(file_path, rename_path)
-                        else:
-
-                            shutil.copy(file_path, destination_file_path)
-                    else:
-                        os.makedirs(destination_dir_path)
-                        shutil.copy(file_path, destination_file_path)
-                    file_count += 1
-                except Exception as e:
-                    print(e)
-    print(f"{file_count} files copied")
+    with events.attach(photo_backup_events.CounterSink()) as counter:
+        for source, record in iter_pending(source_dir, supported_image_types,
+                                           include, exclude, catalog, journal,
+                                           events, metadata, sources):
+            if events.cancelled():
+                break
+            try:
+                # get the date of the photo, default to 2000-01-01
+                date = resolve_photo_date(source.path, events, record)
+                if skip_near_duplicate(source, date, similar, events, catalog, journal):
+                    continue
+                destination_dir_path = build_destination_dir(
+                    destination_dir, date)
+                if scheduler is not None:
+                    scheduler.throttle(source.size)
+                result, destination_file_path = copy_photo(
+                    source.path, destination_dir_path, index, link, names, manifest)
+                settle_near_duplicate(source, similar, result, destination_file_path)
+                record_done(source, date, result, destination_file_path,
+                            catalog, journal)
+                emit_result(events, source, result, destination_file_path)
+            except Exception as e:
+                settle_near_duplicate(source, similar)
+                events.emit(photo_backup_events.ERROR, source.path, error=str(e))
+    return counter.copied
+
+
+def emit_result(events, source, result, destination_file_path):
+    """send the event matching a copy_photo result"""
+    events.emit(RESULT_EVENTS[result], source.path,
+                destination=destination_file_path, size=source.size)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+ * @Author       : JIYONGFENG jiyongfeng@163.com
+ * @Date         : 2026-10-18 22:51:34
+ * @LastEditors  : JIYONGFENG jiyongfeng@163.com
+ * @LastEditTime : 2026-10-18 22:51:34
+ * @Description  : watch mode: back up new photos as they arrive (inotify or polling)
+ * @Copyright (c) 2024 by ZEZEDATA Technology CO, LTD, All Rights Reserved.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+import photo_backup_events
+import photo_backup_scan
+import photo_backup_utils
+from photo_backup_utils import SUPPORTED_IMAGE_TYPES
+
+# inotify 事件掩码，见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+# struct inotify_event 的定长部分：wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct('iIII')
+# 一次 read 的缓冲区大小
+READ_SIZE = 64 * 1024
+# 文件最后一次变化后静默多少秒才认为写完
+DEBOUNCE = 2.0
+# 打开写入后一直未关闭的文件，最多等待这么多秒
+MAX_WRITE_WAIT = 3600.0
+# 无法使用 inotify 时两次扫描的间隔秒数
+POLL_INTERVAL = 30.0
+# 空闲时检查取消标志的间隔秒数
+IDLE_WAKEUP = 1.0
+
+
+class InotifyWatcher:
+    """ Report changed files under a tree through Linux inotify, via ctypes
+
+    Every directory gets a watch; folders created later are watched as
+    they appear and the files already in them are reported. Files created
+    or written and not yet closed are kept in writing. A queue overflow
+    sets rescan, meaning events were lost.
+
+    Args:
+        source_dir (str): tree to watch
+        prune (iterable): directory names never watched
+    """
+
+    def __init__(self, source_dir, prune=photo_backup_scan.PRUNE_DIRS):
+        library = ctypes.util.find_library('c')
+        if library is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.source_dir = source_dir
+        self.prune = frozenset(prune or ())
+        self.rescan = False
+        self.writing = set()
+        # watch descriptor -> 目录
+        self._directories = {}
+        self._add_tree(source_dir)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code == errno.ENOSPC:
+                print("inotify watch limit reached, raise fs.inotify.max_user_watches")
+            elif code not in (errno.ENOENT, errno.ENOTDIR):
+                print(f"cannot watch {directory}: {os.strerror(code)}")
+            return False
+        self._directories[wd] = directory
+        return True
+
+    def _add_tree(self, directory):
+        """watch directory and its subfolders; return the files found in them"""
+        files = []
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            if not self._add_watch(directory):
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in self.prune:
+                                stack.append(entry.path)
+                        else:
+                            files.append(entry.path)
+            except OSError as e:
+                print(e)
+        return files
+
+    def read(self, timeout):
+        """ Wait up to timeout seconds for changes
+
+        Returns:
+            list: paths of the files created, written or moved in
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.rescan = True
+                continue
+            directory = self._directories.get(wd)
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and name not in self.prune:
+                    changed.extend(self._add_tree(path))
+                continue
+            if mask & (IN_CREATE | IN_MODIFY):
+                self.writing.add(path)
+            elif mask & IN_CLOSE_WRITE:
+                self.writing.discard(path)
+            changed.append(path)
+        return changed
+
+    def close(self):
+        """stop watching"""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """ Report changed files by rescanning the tree every interval seconds
+
+    Used where inotify is unavailable (non-Linux, network mounts). Only
+    matching photos are stat'ed, with the filters of scan_source.
+
+    Args:
+        source_dir (str): tree to watch
+        supported_image_types (tuple): file suffixes to back up
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        interval (float): seconds between scans
+    """
+
+    def __init__(self, source_dir, supported_image_types=SUPPORTED_IMAGE_TYPES,
+                 include=None, exclude=None, interval=POLL_INTERVAL):
+        self.source_dir = source_dir
+        self.supported_image_types = supported_image_types
+        self.include = include
+        self.exclude = exclude
+        self.interval = interval
+        self.rescan = False
+        self.writing = frozenset()
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self):
+        return {source.path: (source.size, source.mtime)
+                for source in photo_backup_scan.scan_source(
+                    self.source_dir, self.supported_image_types, self.include, self.exclude)}
+
+    def read(self, timeout):
+        """ Wait up to timeout seconds, scanning if the interval is over
+
+        Returns:
+            list: paths of the files added or changed since the last scan
+        """
+        wait = self._next - time.monotonic()
+        if timeout is not None:
+            wait = min(wait, timeout)
+        if wait > 0:
+            time.sleep(wait)
+        if time.monotonic() < self._next:
+            return []
+        snapshot = self._scan()
+        changed = [path for path, stat in snapshot.items() if self._snapshot.get(path) != stat]
+        self._snapshot = snapshot
+        self._next = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        """nothing to release"""
+
+
+class _Debouncer:
+    """ Coalesce change notifications until each file has stopped changing
+
+    A file is ready once debounce seconds passed since its last
+    notification, it is not open for writing, and its size and mtime are
+    the same as at the previous check; otherwise it waits another period.
+    A burst of notifications for one file costs one stat.
+    """
+
+    def __init__(self, debounce):
+        self.debounce = debounce
+        # 路径 -> [到期时间, 上次检查时的 (size, mtime), 首次通知时间]
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def touch(self, path, now):
+        """a change was reported for path"""
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = [now + self.debounce, self._stat(path), now]
+        else:
+            entry[0] = now + self.debounce
+
+    def next_deadline(self):
+        """the earliest time a pending file may be ready, or None"""
+        return min((entry[0] for entry in self._pending.values()), default=None)
+
+    def pop_ready(self, now, writing=()):
+        """ Remove and return the files that have stopped changing
+
+        Args:
+            now (float): time.monotonic()
+            writing (set): files still open for writing
+        """
+        ready = []
+        for path, entry in list(self._pending.items()):
+            deadline, stat, first = entry
+            if deadline > now:
+                continue
+            current = self._stat(path)
+            if current is None:
+                # 已删除或被改名，改名后的新名字会单独通知
+                del self._pending[path]
+            elif current == stat and (path not in writing or now - first > MAX_WRITE_WAIT):
+                del self._pending[path]
+                ready.append(path)
+            else:
+                entry[0] = now + self.debounce
+                entry[1] = current
+        return ready
+
+
+def watch(source_dir, destination_dir, supported_image_types=SUPPORTED_IMAGE_TYPES,
+          include=None, exclude=None, events=None, debounce=DEBOUNCE,
+          poll_interval=POLL_INTERVAL, use_inotify=True, **options):
+    """ Back up source_dir, then keep backing up new and changed photos
+
+    The watcher is started before the initial full pass, so files arriving
+    during it are not missed. Afterwards only the files reported by the
+    watcher go through copy_photos_by_date, in small batches, once they
+    have been closed and stopped changing. Runs until the event stream is
+    cancelled.
+
+    Args:
+        source_dir (str): source directory
+        destination_dir (str): destination directory
+        supported_image_types (tuple): file suffixes to back up
+        include (list): glob patterns source files must match
+        exclude (list): glob patterns of source files/folders to leave out
+        events (EventStream): events of every pass; cancel it to stop
+        debounce (float): seconds a file must stay unchanged
+        poll_interval (float): seconds between scans without inotify
+        use_inotify (bool): False forces polling
+        **options: catalog, index, link, metadata, similar, scheduler,
+            manifest as for copy_photos_by_date
+
+    Returns:
+        int: number of files copied
+    """
+    photo_backup_utils.validate_folder_path(source_dir)
+    photo_backup_utils.validate_folder_path(destination_dir)
+    if events is None:
+        events = photo_backup_events.EventStream()
+    watcher = None
+    if use_inotify:
+        try:
+            watcher = InotifyWatcher(source_dir)
+        except OSError as e:
+            print(f"inotify unavailable ({e}), polling every {poll_interval:g}s")
+    if watcher is None:
+        watcher = PollingWatcher(source_dir, supported_image_types, include, exclude,
+                                 poll_interval)
+    pending = _Debouncer(debounce)
+    extensions = photo_backup_scan.normalize_extensions(supported_image_types)
+    copied = 0
+
+    def backup(sources=None):
+        return photo_backup_utils.copy_photos_by_date(
+            source_dir, destination_dir, supported_image_types, include=include,
+            exclude=exclude, events=events, sources=sources, **options)
+
+    try:
+        copied += backup()
+        while not events.cancelled():
+            deadline = pending.next_deadline()
+            timeout = IDLE_WAKEUP if deadline is None else \
+                min(IDLE_WAKEUP, max(0.0, deadline - time.monotonic()))
+            changed = watcher.read(timeout)
+            now = time.monotonic()
+            for path in changed:
+                if os.path.splitext(path)[1].lower() in extensions:
+                    pending.touch(path, now)
+            if watcher.rescan:
+                # 事件队列溢出，丢失的事件只能靠整棵树重新扫描补上
+                watcher.rescan = False
+                copied += backup()
+            ready = [source for source in (
+                photo_backup_scan.scan_file(path, source_dir, supported_image_types,
+                                            include, exclude)
+                for path in sorted(pending.pop_ready(now, watcher.writing)))
+                if source is not None]
+            if ready:
+                copied += backup(ready)
+    finally:
+        watcher.close()
+    return copied